@@ -1,49 +1,284 @@
 # agents.py
 import numpy as np
-# Import the real LLM orchestrator instead of the mock one
-from real_llm import query_gpt4_orchestrator
+from config import PARAMS
+from pdt import ForecastArrays, forecast_arrays
+from environment import Action, as_action, channel_gain
+from checkpoint import rng_state, set_rng_state
+from surrogate import SurrogateModel, vehicle_features
+# LLM queries go to the backend chosen by PARAMS['llm_backend'] (real GPT-4 by default)
+from backends import LLMUsage, charged_to, get_backend
 
 class BaseAgent:
-    def __init__(self, env, pdt=None):
+    uses_llm = False # Whether act() waits on a network call
+    llm_usage = None # LLMUsage of agents that may query an LLM
+
+    @classmethod
+    def queries_llm(cls, **agent_kwargs):
+        """Whether an agent built with agent_kwargs under the current PARAMS would have uses_llm set."""
+        return cls.uses_llm
+
+    def __init__(self, env, pdt=None, rng=None):
         self.env = env
         self.pdt = pdt
         self.num_vehicles = env.num_vehicles
+        self.rng = rng if rng is not None else np.random
+        # (state, forecasts, goal, plan horizon, clusters) of the LLM query behind the last action, for the decision log
+        self.last_query = None
 
     def act(self, state, semantic_goal="BALANCE"):
         raise NotImplementedError
 
+    def state_dict(self):
+        state = {'rng': rng_state(self.rng)}
+        if self.llm_usage is not None:
+            state['llm_usage'] = self.llm_usage.state_dict()
+        return state
+
+    def load_state_dict(self, state):
+        set_rng_state(self.rng, state['rng'])
+        if self.llm_usage is not None and 'llm_usage' in state: # Checkpoints from before usage accounting lack it
+            self.llm_usage.load_state_dict(state['llm_usage'])
+
+    async def act_async(self, state, semantic_goal="BALANCE"):
+        # Agents without network calls decide synchronously
+        return self.act(state, semantic_goal)
+
+def _vehicle_ids(state):
+    return np.arange(state.num_vehicles) if state.vehicle_id is None else state.vehicle_id
+
 class SP_LLM_Agent(BaseAgent):
+    """
+    With plan_mode (default PARAMS['llm_plan_mode']) the LLM returns an action
+    plan over the pDT horizon that is replayed slot by slot. A new plan is
+    requested when it runs out, when the goal changes, when the set of
+    vehicles changes (e.g. as they cross shard boundaries in sharded.py), or
+    when the observed state drifts from the forecast the plan was made on by
+    more than PARAMS['plan_max_position_error_m'] or PARAMS['plan_max_load_error_bytes'].
+
+    With num_clusters (default PARAMS['llm_num_clusters']) the LLM decides,
+    or plans, per cluster of vehicles rather than per vehicle.
+    """
+    uses_llm = True
+
+    def __init__(self, env, pdt=None, rng=None, plan_mode=None, num_clusters=None):
+        super().__init__(env, pdt, rng)
+        self.plan_mode = PARAMS['llm_plan_mode'] if plan_mode is None else plan_mode
+        self.num_clusters = PARAMS['llm_num_clusters'] if num_clusters is None else num_clusters
+        self.llm_usage = LLMUsage()
+        self.plan = []
+        self.plan_forecasts = None
+        self.plan_goal = None
+        self.plan_vehicle_ids = None # The vehicles the plan's w/a entries belong to, in order
+        self.plan_step = 0
+        self.plan_stats = {'decisions': 0, 'plan_requests': 0, 'exhausted_replans': 0, 'divergence_replans': 0,
+                           'fleet_replans': 0}
+
     def act(self, state, semantic_goal="BALANCE"):
+        if self.plan_mode:
+            action = self._next_planned_action(state, semantic_goal)
+            if action is None:
+                forecasts = self.pdt.forecast()
+                self.last_query = (state, forecasts, semantic_goal, PARAMS['pdt_prediction_horizon'], self.num_clusters)
+                with charged_to(self.llm_usage):
+                    plan = get_backend().query_plan(state, pdt_forecasts=forecasts, semantic_goal=semantic_goal,
+                                                    num_clusters=self.num_clusters, rng=self.rng)
+                action = self._start_plan(plan, state, forecasts, semantic_goal)
+            return action
+        forecasts = self.pdt.forecast()
+        self.last_query = (state, forecasts, semantic_goal, None, self.num_clusters)
+        # Query the LLM backend with predictive data
+        with charged_to(self.llm_usage):
+            return get_backend().query(state, pdt_forecasts=forecasts, semantic_goal=semantic_goal,
+                                       num_clusters=self.num_clusters, rng=self.rng)
+
+    async def act_async(self, state, semantic_goal="BALANCE"):
+        if self.plan_mode:
+            action = self._next_planned_action(state, semantic_goal)
+            if action is None:
+                forecasts = self.pdt.forecast()
+                self.last_query = (state, forecasts, semantic_goal, PARAMS['pdt_prediction_horizon'], self.num_clusters)
+                with charged_to(self.llm_usage):
+                    plan = await get_backend().query_plan_async(state, pdt_forecasts=forecasts, semantic_goal=semantic_goal,
+                                                                num_clusters=self.num_clusters, rng=self.rng)
+                action = self._start_plan(plan, state, forecasts, semantic_goal)
+            return action
         forecasts = self.pdt.forecast()
-        # Call the real GPT-4 API with predictive data
-        return query_gpt4_orchestrator(state, pdt_forecasts=forecasts, semantic_goal=semantic_goal)
+        self.last_query = (state, forecasts, semantic_goal, None, self.num_clusters)
+        with charged_to(self.llm_usage):
+            return await get_backend().query_async(state, pdt_forecasts=forecasts, semantic_goal=semantic_goal,
+                                                   num_clusters=self.num_clusters, rng=self.rng)
+
+    def state_dict(self):
+        state = super().state_dict()
+        state.update(plan_goal=self.plan_goal, plan_step=self.plan_step, plan_stats=self.plan_stats)
+        if self.plan_vehicle_ids is not None:
+            state['plan_vehicle_ids'] = self.plan_vehicle_ids
+        if self.plan:
+            state.update(plan_w=np.stack([action.w for action in self.plan]), plan_a=np.stack([action.a for action in self.plan]))
+        if self.plan_forecasts is not None:
+            positions, loads = forecast_arrays(self.plan_forecasts)
+            state.update(plan_forecast_slot=getattr(self.plan_forecasts, 'time_slot', None),
+                         plan_forecast_positions_m=positions, plan_forecast_loads_bytes=loads)
+        return state
+
+    def load_state_dict(self, state):
+        super().load_state_dict(state)
+        if 'plan_w' in state:
+            self.plan = [Action(w, a) for w, a in zip(state['plan_w'], state['plan_a'])]
+        else: # Checkpoints from before array actions hold the plan as dicts
+            self.plan = [as_action(action) for action in state.get('plan', [])]
+        self.plan_goal = state['plan_goal']
+        self.plan_step = state['plan_step']
+        self.plan_stats = {'fleet_replans': 0, **state['plan_stats']} # Older checkpoints lack fleet_replans
+        self.plan_vehicle_ids = state.get('plan_vehicle_ids')
+        self.plan_forecasts = None
+        if 'plan_forecast_positions_m' in state:
+            positions = state['plan_forecast_positions_m']
+            self.plan_forecasts = ForecastArrays(state['plan_forecast_slot'], positions, state['plan_forecast_loads_bytes'],
+                                                 channel_gain(positions))
+
+    def _start_plan(self, plan, state, forecasts, semantic_goal):
+        self.plan = [as_action(action) for action in plan]
+        self.plan_forecasts = forecasts
+        self.plan_vehicle_ids = _vehicle_ids(state).copy()
+        self.plan_goal = semantic_goal
+        self.plan_step = 1
+        self.plan_stats['decisions'] += 1
+        self.plan_stats['plan_requests'] += 1
+        return self.plan[0]
+
+    def _next_planned_action(self, state, semantic_goal):
+        """Returns the next buffered action, or None if a new plan is needed."""
+        if not self.plan or semantic_goal != self.plan_goal:
+            return None
+        if self.plan_step >= len(self.plan):
+            self.plan_stats['exhausted_replans'] += 1
+            return None
+        if self.plan_vehicle_ids is None or not np.array_equal(_vehicle_ids(state), self.plan_vehicle_ids):
+            # Vehicles left or joined (or were reordered): the plan's entries belong to other vehicles
+            self.plan_stats['fleet_replans'] += 1
+            return None
+        # plan[k] was made for the slot the forecast predicted k steps ahead
+        if self._diverged(state, self.plan_step - 1):
+            self.plan_stats['divergence_replans'] += 1
+            return None
+        action = self.plan[self.plan_step]
+        self.plan_step += 1
+        self.plan_stats['decisions'] += 1
+        return action
+
+    def _diverged(self, state, h):
+        road_length_m = PARAMS['road_length_km'] * 1000
+        predicted_positions, predicted_loads = forecast_arrays(self.plan_forecasts)
+        pos_error = np.abs(state.position_m - predicted_positions[h]) % road_length_m
+        pos_error = np.minimum(pos_error, road_length_m - pos_error) # Positions wrap around the road
+        return (np.mean(pos_error) > PARAMS['plan_max_position_error_m']
+                or np.mean(np.abs(state.task_load_bytes - predicted_loads[h])) > PARAMS['plan_max_load_error_bytes'])
 
 class LLM_DT_Agent(BaseAgent):
+    uses_llm = True
+
+    def __init__(self, env, pdt=None, rng=None, num_clusters=None):
+        super().__init__(env, pdt, rng)
+        self.num_clusters = PARAMS['llm_num_clusters'] if num_clusters is None else num_clusters
+        self.llm_usage = LLMUsage()
+
     def act(self, state, semantic_goal="BALANCE"):
-        # Call the real GPT-4 API without predictive data (reactive)
+        # Query the LLM backend without predictive data (reactive)
         # We pass the default semantic goal as it does not adapt
-        return query_gpt4_orchestrator(state, pdt_forecasts=None, semantic_goal="BALANCE")
+        self.last_query = (state, None, "BALANCE", None, self.num_clusters)
+        with charged_to(self.llm_usage):
+            return get_backend().query(state, pdt_forecasts=None, semantic_goal="BALANCE", num_clusters=self.num_clusters, rng=self.rng)
+
+    async def act_async(self, state, semantic_goal="BALANCE"):
+        self.last_query = (state, None, "BALANCE", None, self.num_clusters)
+        with charged_to(self.llm_usage):
+            return await get_backend().query_async(state, pdt_forecasts=None, semantic_goal="BALANCE",
+                                                   num_clusters=self.num_clusters, rng=self.rng)
 
 class S_MARL_Agent(BaseAgent):
     def act(self, state, semantic_goal="BALANCE"):
         # Behavior remains the same for this baseline
-        num_vehicles = len(state['vehicles'])
-        w_ratios = [np.random.uniform(0.3, 0.7) for _ in range(num_vehicles)]
-        a_ratios = np.random.rand(num_vehicles)
+        num_vehicles = state.num_vehicles
+        w_ratios = self.rng.uniform(0.3, 0.7, size=num_vehicles)
+        a_ratios = self.rng.random(num_vehicles)
         a_ratios /= np.sum(a_ratios)
-        return {'w': w_ratios, 'a': list(a_ratios)}
+        return Action(w_ratios, a_ratios)
 
 class GreedyAgent(BaseAgent):
     def act(self, state, semantic_goal="BALANCE"):
         # Behavior remains the same for this baseline
-        num_vehicles = len(state['vehicles'])
-        channel_gains = [v['channel_gain'] for v in state['vehicles']]
-        best_vehicle_idx = np.argmax(channel_gains) if channel_gains else 0
-        
-        w_ratios = [0.1] * num_vehicles
-        if w_ratios:
-             w_ratios[best_vehicle_idx] = 0.9
-        
-        a_ratios = [1.0 / num_vehicles] * num_vehicles if num_vehicles > 0 else []
-        
-        return {'w': w_ratios, 'a': a_ratios}
\ No newline at end of file
+        num_vehicles = state.num_vehicles
+        w_ratios = np.full(num_vehicles, 0.1)
+        if num_vehicles:
+            w_ratios[np.argmax(state.channel_gain)] = 0.9
+        a_ratios = np.full(num_vehicles, 1.0 / num_vehicles) if num_vehicles > 0 else np.zeros(0)
+        return Action(w_ratios, a_ratios)
+
+class SurrogateAgent(BaseAgent):
+    """
+    Imitates SP-LLM with a SurrogateModel distilled from its decisions (see
+    distill.py): one batched prediction per slot and no network calls. With
+    max_novelty (default PARAMS['surrogate_max_novelty']), slots whose state
+    looks unlike the training data are sent to the LLM instead.
+    """
+    def __init__(self, env, pdt=None, rng=None, model=None, max_novelty=None):
+        super().__init__(env, pdt, rng)
+        if model is None:
+            if not PARAMS['surrogate_model_path']:
+                raise ValueError("SurrogateAgent needs a model or PARAMS['surrogate_model_path']")
+            model = SurrogateModel.load(PARAMS['surrogate_model_path'])
+        self.model = model
+        self.max_novelty = PARAMS['surrogate_max_novelty'] if max_novelty is None else max_novelty
+        self.llm_fallbacks = 0
+        self.llm_usage = LLMUsage()
+
+    @property
+    def uses_llm(self):
+        # Only a novelty threshold sends slots to the LLM
+        return self.max_novelty is not None
+
+    @classmethod
+    def queries_llm(cls, max_novelty=None, **agent_kwargs):
+        return (PARAMS['surrogate_max_novelty'] if max_novelty is None else max_novelty) is not None
+
+    def _route(self, state, semantic_goal):
+        """(features, forecasts, whether the slot goes to the LLM)."""
+        forecasts = self.pdt.forecast()
+        features = vehicle_features(state, forecasts, semantic_goal)
+        novel = self.max_novelty is not None and self.model.novelty(features) > self.max_novelty
+        if novel:
+            self.llm_fallbacks += 1
+            self.last_query = (state, forecasts, semantic_goal, None, None)
+        else:
+            self.last_query = None
+        return features, forecasts, novel
+
+    def act(self, state, semantic_goal="BALANCE"):
+        features, forecasts, novel = self._route(state, semantic_goal)
+        if novel:
+            with charged_to(self.llm_usage):
+                return get_backend().query(state, pdt_forecasts=forecasts, semantic_goal=semantic_goal, rng=self.rng)
+        return self.model.predict_action(features)
+
+    async def act_async(self, state, semantic_goal="BALANCE"):
+        features, forecasts, novel = self._route(state, semantic_goal)
+        if novel:
+            with charged_to(self.llm_usage):
+                return await get_backend().query_async(state, pdt_forecasts=forecasts, semantic_goal=semantic_goal, rng=self.rng)
+        return self.model.predict_action(features)
+
+class ReplayAgent(BaseAgent):
+    """
+    Serves logged decisions back by time slot, with no network calls.
+    `decisions` maps slot -> action, e.g. DecisionReplay.decisions_for(...).
+    """
+    def __init__(self, env, pdt=None, rng=None, decisions=None):
+        super().__init__(env, pdt, rng)
+        self.decisions = decisions if decisions is not None else {}
+
+    def act(self, state, semantic_goal="BALANCE"):
+        try:
+            return self.decisions[state.time_slot]
+        except KeyError:
+            raise KeyError(f"No logged decision for time slot {state.time_slot}") from None
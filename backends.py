@@ -0,0 +1,156 @@
+# backends.py
+"""
+Orchestrator backends: what answers the LLM agents' queries.
+
+    real       GPT-4 through the OpenAI API, or OPENAI_BASE_URL (real_llm.py)
+    mock       the rule-based mock orchestrator (mock_llm.py), in-process
+    surrogate  a distilled SurrogateModel from PARAMS['surrogate_model_path']
+    replay     logged decisions from PARAMS['decision_replay_dir']; main runs
+               LLM agent cells as ReplayAgent instead of querying
+
+PARAMS['llm_backend'] picks the backend. Each backend imports its
+dependencies when it is first used, so runs that never query an LLM do not
+load openai and do not need it installed.
+
+LLM agents charge their requests, tokens, cost and fallbacks to their own
+LLMUsage by querying inside charged_to(); backends record into it with charge().
+"""
+import contextlib
+import contextvars
+from config import PARAMS
+
+class LLMUsage:
+    """LLM queries, requests sent (calls), retries, tokens, dollar cost and fallback decisions of one agent."""
+    FIELDS = ('queries', 'calls', 'retries', 'prompt_tokens', 'completion_tokens', 'cost_usd', 'fallbacks')
+
+    def __init__(self):
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    def add(self, **amounts):
+        for field, amount in amounts.items():
+            setattr(self, field, getattr(self, field) + amount)
+
+    def state_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    def load_state_dict(self, state):
+        for field in self.FIELDS:
+            setattr(self, field, state[field])
+
+# Context variables follow each asyncio task, so concurrent agents charge their own usage
+_current_usage = contextvars.ContextVar('llm_usage', default=None)
+
+@contextlib.contextmanager
+def charged_to(usage):
+    token = _current_usage.set(usage)
+    try:
+        yield
+    finally:
+        _current_usage.reset(token)
+
+def charge(**amounts):
+    """Adds to the LLMUsage of the query being answered, if it has one."""
+    usage = _current_usage.get()
+    if usage is not None:
+        usage.add(**amounts)
+
+class Backend:
+    """Subclasses implement query and query_plan; the async variants default to calling them directly."""
+    def query(self, state, pdt_forecasts=None, semantic_goal="BALANCE", num_clusters=None, rng=None):
+        raise NotImplementedError
+
+    def query_plan(self, state, pdt_forecasts=None, semantic_goal="BALANCE", horizon=None, num_clusters=None, rng=None):
+        raise NotImplementedError
+
+    async def query_async(self, state, pdt_forecasts=None, semantic_goal="BALANCE", num_clusters=None, rng=None):
+        return self.query(state, pdt_forecasts, semantic_goal, num_clusters, rng)
+
+    async def query_plan_async(self, state, pdt_forecasts=None, semantic_goal="BALANCE", horizon=None, num_clusters=None, rng=None):
+        return self.query_plan(state, pdt_forecasts, semantic_goal, horizon, num_clusters, rng)
+
+    async def close(self):
+        pass
+
+class RealBackend(Backend):
+    def __init__(self):
+        import real_llm
+        self.llm = real_llm
+
+    def query(self, state, pdt_forecasts=None, semantic_goal="BALANCE", num_clusters=None, rng=None):
+        return self.llm.query_gpt4_orchestrator(state, pdt_forecasts, semantic_goal, num_clusters)
+
+    def query_plan(self, state, pdt_forecasts=None, semantic_goal="BALANCE", horizon=None, num_clusters=None, rng=None):
+        return self.llm.query_gpt4_plan(state, pdt_forecasts, semantic_goal, horizon, num_clusters)
+
+    async def query_async(self, state, pdt_forecasts=None, semantic_goal="BALANCE", num_clusters=None, rng=None):
+        return await self.llm.query_gpt4_orchestrator_async(state, pdt_forecasts, semantic_goal, num_clusters)
+
+    async def query_plan_async(self, state, pdt_forecasts=None, semantic_goal="BALANCE", horizon=None, num_clusters=None, rng=None):
+        return await self.llm.query_gpt4_plan_async(state, pdt_forecasts, semantic_goal, horizon, num_clusters)
+
+    async def close(self):
+        await self.llm.close_async_client()
+
+class MockBackend(Backend):
+    """Decides per vehicle (num_clusters is ignored) with the agent's rng; a plan is H independent decisions."""
+    def __init__(self):
+        from mock_llm import query_llm_orchestrator
+        self._decide = query_llm_orchestrator
+
+    def query(self, state, pdt_forecasts=None, semantic_goal="BALANCE", num_clusters=None, rng=None):
+        return self._decide(state, pdt_forecasts, semantic_goal, rng=rng)
+
+    def query_plan(self, state, pdt_forecasts=None, semantic_goal="BALANCE", horizon=None, num_clusters=None, rng=None):
+        horizon = horizon or PARAMS['pdt_prediction_horizon']
+        return [self._decide(state, pdt_forecasts, semantic_goal, rng=rng) for _ in range(horizon)]
+
+class SurrogateBackend(Backend):
+    """Answers with the SurrogateModel's prediction; a plan repeats it over the horizon."""
+    def __init__(self):
+        from surrogate import SurrogateModel, vehicle_features
+        if not PARAMS['surrogate_model_path']:
+            raise ValueError("The surrogate backend needs PARAMS['surrogate_model_path']")
+        self.model = SurrogateModel.load(PARAMS['surrogate_model_path'])
+        self._features = vehicle_features
+
+    def query(self, state, pdt_forecasts=None, semantic_goal="BALANCE", num_clusters=None, rng=None):
+        return self.model.predict_action(self._features(state, pdt_forecasts, semantic_goal))
+
+    def query_plan(self, state, pdt_forecasts=None, semantic_goal="BALANCE", horizon=None, num_clusters=None, rng=None):
+        horizon = horizon or PARAMS['pdt_prediction_horizon']
+        return [self.query(state, pdt_forecasts, semantic_goal)] * horizon
+
+class ReplayBackend(Backend):
+    def query(self, state, pdt_forecasts=None, semantic_goal="BALANCE", num_clusters=None, rng=None):
+        raise RuntimeError("The replay backend serves logged decisions through ReplayAgent; run LLM agents with main.agent_class_for")
+
+    def query_plan(self, state, pdt_forecasts=None, semantic_goal="BALANCE", horizon=None, num_clusters=None, rng=None):
+        return self.query(state)
+
+# Add an entry here (name -> Backend subclass) to plug in another backend
+BACKENDS = {
+    'real': RealBackend,
+    'mock': MockBackend,
+    'surrogate': SurrogateBackend,
+    'replay': ReplayBackend,
+}
+
+_backends = {}
+
+def get_backend(name=None):
+    """The backend named `name` (default PARAMS['llm_backend']), created on first use and shared within the process."""
+    name = name or PARAMS['llm_backend']
+    if name not in _backends:
+        if name not in BACKENDS:
+            raise ValueError(f"Unknown LLM backend {name!r}; choose from {sorted(BACKENDS)}")
+        _backends[name] = BACKENDS[name]()
+    return _backends[name]
+
+def loaded_backend(name):
+    """The backend if this process has already created it, else None."""
+    return _backends.get(name)
+
+async def close_backends():
+    for backend in _backends.values():
+        await backend.close()
@@ -0,0 +1,203 @@
+# benchmark.py
+"""
+Benchmarks for the simulator hot paths.
+
+    python benchmark.py --sizes 10 100 1000 10000 --horizons 5 20 --output bench.json
+    python benchmark.py --baseline bench.json        # exit code 1 on regression, 2 if nothing matched
+    python benchmark.py --save-baseline bench.json   # store this run as the baseline
+
+Each case reports calls/s (slots/s for step), per-call latency percentiles
+and peak traced memory of one call, as JSON.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+import types
+import numpy as np
+from config import PARAMS
+import real_llm
+import prompts
+from environment import VECEnvironment, ArrayVECEnvironment, EventVECEnvironment
+from pdt import PredictiveDigitalTwin
+from agents import SP_LLM_Agent, LLM_DT_Agent, S_MARL_Agent, GreedyAgent
+from mock_llm import query_llm_orchestrator
+
+ENGINES = {'object': VECEnvironment, 'array': ArrayVECEnvironment, 'event': EventVECEnvironment}
+# The object engine is too slow to be useful beyond this size
+MAX_OBJECT_ENGINE_VEHICLES = 2000
+
+class _StubCompletions:
+    """Answers every chat completion with a valid action for the prompt's vehicle count."""
+    def __init__(self, num_vehicles):
+        content = json.dumps({'w': [0.5] * num_vehicles, 'a': [1.0] * num_vehicles})
+        self.completion = types.SimpleNamespace(
+            usage=None, choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))])
+
+    def create(self, **kwargs):
+        return self.completion
+
+@contextlib.contextmanager
+def stubbed_llm(num_vehicles):
+    """Swaps in a stub OpenAI client and disables the decision cache, so the prompt/parse path is measured."""
+    saved = real_llm.client, real_llm.decision_cache
+    real_llm.client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=_StubCompletions(num_vehicles)))
+    real_llm.decision_cache = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+    finally:
+        real_llm.client, real_llm.decision_cache = saved
+
+def measure(fn, min_calls=5, min_time_s=0.5, max_calls=10000):
+    """Times fn() until both min_calls and min_time_s are reached, then measures one call's peak memory."""
+    times = []
+    start = time.perf_counter()
+    while len(times) < max_calls and (len(times) < min_calls or time.perf_counter() - start < min_time_s):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+
+    tracemalloc.start()
+    fn()
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    times_ms = np.array(times) * 1000
+    return {
+        'calls': len(times),
+        'calls_per_s': len(times) / sum(times),
+        'p50_ms': float(np.percentile(times_ms, 50)),
+        'p95_ms': float(np.percentile(times_ms, 95)),
+        'p99_ms': float(np.percentile(times_ms, 99)),
+        'peak_mem_kb': peak_bytes / 1024,
+    }
+
+def _env(engine, n, seed=0):
+    env = ENGINES[engine](n, rng=np.random.default_rng(seed))
+    # Warm up so queues and the pDT have something to work with
+    for _ in range(3):
+        env.step(real_llm.get_default_action(n))
+    return env
+
+def bench_environment(engine, n, min_time_s):
+    env = _env(engine, n)
+    action = real_llm.get_default_action(n)
+    return {
+        'env_step': measure(lambda: env.step(action), min_time_s=min_time_s),
+        'env_get_state': measure(env.get_state, min_time_s=min_time_s),
+    }
+
+def bench_forecast(engine, n, h, min_time_s):
+    env = _env(engine, n)
+    pdt = PredictiveDigitalTwin(env, horizon=h, rng=np.random.default_rng(1))
+
+    def forecast():
+        env.time_slot += 1 # Defeat the per-slot cache so every call does the incremental update
+        return pdt.forecast()
+    return {'pdt_forecast': measure(forecast, min_time_s=min_time_s)}
+
+def bench_prompt_and_agents(engine, n, h, min_time_s):
+    env = _env(engine, n)
+    pdt = PredictiveDigitalTwin(env, horizon=h, rng=np.random.default_rng(1))
+    state, forecasts = env.get_state(), pdt.forecast()
+    results = {
+        'user_prompt_json': measure(lambda: prompts.generate_user_prompt(state, forecasts, "BALANCE"), min_time_s=min_time_s),
+        'user_prompt_compact': measure(lambda: prompts.generate_compact_user_prompt(state, forecasts, "BALANCE"), min_time_s=min_time_s),
+        'mock_llm_query': measure(lambda: query_llm_orchestrator(state, forecasts), min_time_s=min_time_s),
+    }
+    with stubbed_llm(n):
+        results['gpt4_query_stubbed'] = measure(lambda: real_llm.query_gpt4_orchestrator(state, forecasts), min_time_s=min_time_s)
+        saved_horizon = PARAMS['pdt_prediction_horizon']
+        PARAMS['pdt_prediction_horizon'] = h
+        try:
+            for name, AgentClass in [('SP-LLM', SP_LLM_Agent), ('LLM-DT', LLM_DT_Agent), ('S-MARL', S_MARL_Agent), ('GO', GreedyAgent)]:
+                agent = AgentClass(env, pdt=pdt, rng=np.random.default_rng(2))
+                results[f'agent_act_{name}'] = measure(lambda: agent.act(state), min_time_s=min_time_s)
+        finally:
+            PARAMS['pdt_prediction_horizon'] = saved_horizon
+    return results
+
+def run_benchmarks(sizes, horizons, engines, min_time_s):
+    records = []
+    for engine in engines:
+        for n in sizes:
+            if engine == 'object' and n > MAX_OBJECT_ENGINE_VEHICLES:
+                continue
+            cases = [(None, bench_environment(engine, n, min_time_s))]
+            for h in horizons:
+                cases.append((h, bench_forecast(engine, n, h, min_time_s)))
+                cases.append((h, bench_prompt_and_agents(engine, n, h, min_time_s)))
+            for h, results in cases:
+                for name, result in results.items():
+                    records.append({'case': name, 'engine': engine, 'n': n, 'h': h, **result})
+                    print(f"{name:24s} {engine:6s} N={n:<6d} H={str(h):4s} {result['p50_ms']:10.3f} ms p50 "
+                          f"{result['calls_per_s']:12.1f}/s", file=sys.stderr)
+    return records
+
+def _key(record):
+    return f"{record['case']}|{record['engine']}|{record['n']}|{record['h']}"
+
+def compare_to_baseline(records, baseline_records, tolerance):
+    """Cases whose p50 latency grew by more than `tolerance` (a fraction) over the baseline."""
+    baseline = {_key(r): r for r in baseline_records}
+    regressions = []
+    for record in records:
+        base = baseline.get(_key(record))
+        if base and record['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+            regressions.append({'case': _key(record), 'baseline_p50_ms': base['p50_ms'], 'p50_ms': record['p50_ms'],
+                                'slowdown': record['p50_ms'] / base['p50_ms']})
+    return regressions
+
+def unmatched_cases(records, baseline_records):
+    """Cases of this run that the baseline has no result for, so they cannot be compared."""
+    baseline = {_key(r) for r in baseline_records}
+    return [_key(r) for r in records if _key(r) not in baseline]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--horizons', type=int, nargs='+', default=[PARAMS['pdt_prediction_horizon'], 20])
+    parser.add_argument('--engines', nargs='+', choices=sorted(ENGINES), default=sorted(ENGINES))
+    parser.add_argument('--min-time', type=float, default=0.5, help="Seconds to spend timing each case")
+    parser.add_argument('--output', help="Write the JSON report here instead of stdout")
+    parser.add_argument('--baseline', help="Compare against this stored report")
+    parser.add_argument('--save-baseline', help="Also store this run as a baseline report")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed p50 slowdown before flagging a regression")
+    args = parser.parse_args(argv)
+    if args.baseline and not os.path.exists(args.baseline):
+        parser.error(f"no baseline report at {args.baseline}; record one first with --save-baseline {args.baseline}")
+
+    records = run_benchmarks(args.sizes, args.horizons, args.engines, args.min_time)
+    report = {'params': {'sizes': args.sizes, 'horizons': args.horizons, 'engines': args.engines}, 'results': records}
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline_records = json.load(f)['results']
+        unmatched = unmatched_cases(records, baseline_records)
+        if len(unmatched) == len(records):
+            print(f"error: {args.baseline} has none of this run's cases (other sizes, horizons or engines); "
+                  f"nothing was compared", file=sys.stderr)
+            return 2
+        if unmatched:
+            print(f"warning: {len(unmatched)} case(s) missing from {args.baseline} were not compared, "
+                  f"e.g. {unmatched[0]}", file=sys.stderr)
+        report['unmatched'] = unmatched
+        report['regressions'] = compare_to_baseline(records, baseline_records, args.tolerance)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(text)
+    return 1 if report.get('regressions') else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+# clustering.py
+"""
+Vehicle clusters for hierarchical (cluster-level) LLM orchestration.
+
+Vehicles are grouped by position, channel gain and task load with a few
+vectorized k-means iterations over standardized features. The initial
+centroids are taken at position quantiles, so the clustering of a state is
+deterministic. The LLM decides one (w, a) pair per cluster from the cluster
+summaries, and VehicleClusters.expand() maps it back to per-vehicle ratios.
+"""
+import numpy as np
+from environment import Action, as_observation, channel_gain
+from pdt import forecast_arrays
+
+def kmeans_labels(features, num_clusters, iterations=5):
+    """
+    Cluster label of each row of an (N, F) feature matrix, with clusters
+    numbered in order of their mean first feature and no empty clusters.
+    """
+    n = features.shape[0]
+    k = min(num_clusters, n)
+    if k == 0:
+        return np.zeros(0, dtype=np.int64)
+    scale = features.std(axis=0)
+    x = (features - features.mean(axis=0)) / np.where(scale > 0, scale, 1.0)
+    order = np.argsort(x[:, 0], kind='stable')
+    centroids = x[order[((np.arange(k) + 0.5) * n / k).astype(np.int64)]]
+    x_sq = (x**2).sum(axis=1, keepdims=True)
+    for _ in range(iterations):
+        # Squared distances to every centroid as one (N, k) matrix product
+        labels = np.argmin(x_sq - 2 * x @ centroids.T + (centroids**2).sum(axis=1), axis=1)
+        counts = np.bincount(labels, minlength=k)
+        sums = np.stack([np.bincount(labels, weights=x[:, j], minlength=k) for j in range(x.shape[1])], axis=1)
+        nonempty = counts > 0
+        centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+    # Renumber the non-empty clusters by their mean first feature
+    used, labels = np.unique(labels, return_inverse=True)
+    rank = np.argsort(np.argsort(centroids[used, 0], kind='stable'))
+    return rank[labels]
+
+class VehicleClusters:
+    """Cluster labels of a state's vehicles, their summary statistics and the expansion of cluster decisions."""
+    def __init__(self, state, pdt_forecasts=None, num_clusters=8):
+        state = as_observation(state)
+        positions = state.position_m
+        gains_db = 10 * np.log10(np.maximum(state.channel_gain, 1e-30))
+        loads = state.task_load_bytes
+        queues = state.server_queue_lengths.astype(float)
+
+        self.labels = kmeans_labels(np.column_stack([positions, gains_db, loads]), num_clusters)
+        k = self.num_clusters = int(self.labels.max()) + 1 if self.labels.size else 0
+        self.counts = np.bincount(self.labels, minlength=k)
+        safe_counts = np.maximum(self.counts, 1)
+
+        def mean(values):
+            return np.bincount(self.labels, weights=values, minlength=k) / safe_counts
+
+        mean_pos = mean(positions)
+        self.summary = {
+            't': state.time_slot,
+            'n': self.counts.tolist(),
+            'pos_m': mean_pos,
+            'spread_m': np.sqrt(np.maximum(mean(positions**2) - mean_pos**2, 0)),
+            'speed_mps': mean(state.speed_mps),
+            'gain_db': mean(gains_db),
+            'load_bytes': np.bincount(self.labels, weights=loads, minlength=k),
+            'queue': np.bincount(self.labels, weights=queues, minlength=k),
+        }
+        self.forecasts = None
+        if pdt_forecasts:
+            # Per-step cluster totals in one bincount over (step, cluster) indices
+            f_positions, f_loads = forecast_arrays(pdt_forecasts)
+            horizon = f_loads.shape[0]
+            flat = (np.arange(horizon)[:, None] * k + self.labels).ravel()
+            f_gains_db = 10 * np.log10(np.maximum(channel_gain(f_positions), 1e-30))
+            self.forecasts = {
+                'load_bytes': np.bincount(flat, weights=f_loads.ravel(), minlength=horizon * k).reshape(horizon, k),
+                'gain_db': np.bincount(flat, weights=f_gains_db.ravel(), minlength=horizon * k).reshape(horizon, k) / safe_counts,
+            }
+
+        # Each cluster's CPU share is split among its vehicles by server backlog (plus one, so idle vehicles get some)
+        self.weights = queues + 1
+        self._weight_sums = np.bincount(self.labels, weights=self.weights, minlength=k)
+
+    def expand(self, cluster_action):
+        """Per-vehicle Action from one (w, a) pair per cluster; 'a' keeps the clusters' total."""
+        w = np.clip(np.asarray(cluster_action['w'], dtype=float), 0.0, 1.0)
+        a = np.asarray(cluster_action['a'], dtype=float)
+        labels = self.labels
+        return Action(w[labels], a[labels] * self.weights / self._weight_sums[labels])
@@ -1,12 +1,16 @@
 # config.py
 import os
-from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
-
-# Securely load the API key
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+def openai_settings():
+    """
+    (OPENAI_API_KEY, OPENAI_BASE_URL) from the environment or the .env file.
+    Only the real LLM backend reads them, so python-dotenv is imported here.
+    OPENAI_BASE_URL points the client at another OpenAI-compatible endpoint,
+    e.g. the local llm_server.py.
+    """
+    from dotenv import load_dotenv
+    load_dotenv()
+    return os.getenv("OPENAI_API_KEY"), os.getenv("OPENAI_BASE_URL")
 
 # All simulation parameters in one place for easy modification.
 PARAMS = {
@@ -23,6 +27,62 @@ PARAMS = {
     'simulation_time_slots': 100,
     'task_deadline_ms': 200,
     'road_length_km': 2,
+    'engine': 'array',  # 'array' (slot-based VectorVECEnv), 'event' (EventVECEnvironment per replica) or 'object' (original VECEnvironment per replica)
+    'event_task_rate_hz': 0.7,  # Poisson task rate per vehicle of the event engine (0.7 matches the slot engines)
+    'event_drop_expired': False,  # Event engine: drop tasks still queued at their deadline
+    'num_rsus': 1,  # Roadside units evenly spaced along the road (MultiRSUEnvironment)
+    'rsu_cpu_freq_ghz': None,  # CPU of each RSU; None uses vec_server_cpu_freq_ghz
+    'seed': None,  # Master seed; every cell/replica stream derives from it. None draws fresh entropy
+    'num_workers': None,  # Process pool size for run_cells_parallel (None = all cores)
+    'trace_enabled': False,  # Time each simulation phase and count LLM calls (tracing.py)
+    'trace_path': None,  # Write a Chrome trace / Perfetto JSON file here after the run
+    'checkpoint_dir': None,  # Save cell progress here and resume from it on the next run
+    'checkpoint_every': 10,  # Slots between checkpoints
+    'decision_log_dir': None,  # Append every LLM agent decision to a log here
+    'decision_replay_dir': None,  # Serve LLM agent decisions from this log instead of the API
+    'surrogate_model_path': None,  # SurrogateModel file for SurrogateAgent (see distill.py)
+    'surrogate_max_novelty': None,  # Ask the LLM when a slot's novelty score exceeds this; None never does
+    'metrics_trace_every': None,  # Keep every k-th completed task as a raw trace sample
+    'num_replicas': 1,  # Independent replicas per scenario cell (VectorVECEnv)
+    'confidence_level': 0.95,
+    # Adaptive replication (replaces num_replicas): add replicas to a cell until the CI
+    # half-width of each metric below is within adaptive_ci_rel_width of its mean, or
+    # under the metric's absolute width, or the cell reaches adaptive_max_replicas
+    'adaptive_replication': False,
+    'adaptive_min_replicas': 3,
+    'adaptive_max_replicas': 30,
+    'adaptive_ci_rel_width': 0.05,
+    'adaptive_ci_metrics': {'avg_latency_ms': 0.5, 'qos_violation_rate': 0.5, 'total_energy_j': 0.0},
+    'llm_backend': 'real',  # What answers LLM agent queries: 'real', 'mock', 'surrogate' or 'replay' (backends.py)
+    'llm_max_concurrency': 16,  # In-flight requests on the async orchestration path
+    'llm_request_timeout_s': 60,
+    'llm_max_retries': 2,  # Retries of 429s, 5xx, timeouts and connection errors (real_llm.RequestScheduler)
+    'llm_backoff_base_s': 0.5,  # Full-jitter exponential backoff: up to base * 2**attempt, capped at max
+    'llm_backoff_max_s': 20,
+    'llm_rate_limit_rpm': None,  # The account's requests/min and tokens/min; None does not pace
+    'llm_rate_limit_tpm': None,
+    'llm_rate_limit_cooldown_s': 0.1,  # After a 429, hold back other requests at most this long (the 429'd one waits its Retry-After)
+    'llm_decision_deadline_s': None,  # Fall back if a decision takes longer, waits and retries included
+    'llm_price_per_1k_tokens': {'prompt': 0.01, 'completion': 0.03},  # gpt-4-turbo, USD
+    'llm_budget_usd': None,  # Stop querying (and fall back) once this much has been spent
+    'llm_prompt_format': 'json',  # 'json' (indented state dump, as in the paper) or 'compact' (columnar, far fewer tokens)
+    'llm_prompt_token_budget': None,  # Coarsen the compact prompt above this many tokens
+    'llm_num_clusters': None,  # Hierarchical mode: the LLM decides per cluster of vehicles (e.g. 8), not per vehicle
+    # Plan mode: SP-LLM requests an H-step action plan and replans on forecast divergence
+    'llm_plan_mode': False,
+    'plan_max_position_error_m': 50,
+    'plan_max_load_error_bytes': 500,
+    # Decision cache keyed on a quantized state/forecast/goal fingerprint. Off by default:
+    # reusing answers for near-identical slots changes the results
+    'llm_cache_enabled': False,
+    'llm_cache_max_entries': 10000,
+    'llm_cache_path': None,  # e.g. "llm_cache.sqlite" to persist decisions across runs
+    'llm_cache_quantization': {
+        'position_m': 50,
+        'channel_gain_db': 3,
+        'task_load_bytes': 250,
+        'queue_length': 1,
+    },
     # Derived parameters
     'channel_noise_watts': 10**(-110 / 10) / 1000,
     'vehicle_tx_power_watts': 200 / 1000,
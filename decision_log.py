@@ -0,0 +1,108 @@
+# decision_log.py
+"""
+Append-only log of orchestrator decisions, and its replay index.
+
+The log is a directory of columnar .npz chunks. Each row is keyed by
+(scenario, agent, params, replica, slot) and holds the semantic goal, a hash
+of the LLM prompt behind the decision and the action's w and a vectors (one
+flat array per chunk, sliced by per-row offsets). Chunks are only ever added,
+never rewritten, so several worker processes can log into one directory.
+"""
+import glob
+import hashlib
+import json
+import os
+import time
+import numpy as np
+from environment import Action
+from clustering import VehicleClusters
+from prompts import (generate_cluster_system_prompt, generate_cluster_user_prompt, generate_plan_system_prompt,
+                     generate_system_prompt, user_prompt_for)
+
+KEY_COLUMNS = ('scenario', 'agent', 'params', 'replica', 'slot', 'goal', 'prompt_hash')
+
+def params_key(params):
+    return json.dumps(params, sort_keys=True)
+
+def prompt_hash(state, pdt_forecasts, semantic_goal, plan_horizon=None, num_clusters=None):
+    """Short hash of the messages a query (or a plan or cluster-level query) for this input sends."""
+    if num_clusters:
+        clusters = VehicleClusters(state, pdt_forecasts, num_clusters)
+        system_prompt = generate_cluster_system_prompt(clusters.num_clusters)
+        user_prompt = generate_cluster_user_prompt(clusters, semantic_goal)
+    else:
+        system_prompt = generate_system_prompt()
+        user_prompt = user_prompt_for(state, pdt_forecasts, semantic_goal)
+    if plan_horizon:
+        system_prompt = generate_plan_system_prompt(plan_horizon, system_prompt)
+    return hashlib.sha256((system_prompt + user_prompt).encode()).hexdigest()[:16]
+
+class DecisionLog:
+    """Buffers appended rows and writes them out as a new chunk every `flush_rows` rows and on flush()."""
+    def __init__(self, path, flush_rows=1000):
+        self.path = path
+        self.flush_rows = flush_rows
+        self.rows = []
+        self._chunks_written = 0
+        os.makedirs(path, exist_ok=True)
+
+    def append(self, scenario, agent, params, replica, slot, goal, prompt_hash, action):
+        self.rows.append((scenario, agent, params_key(params), replica, slot, goal, prompt_hash,
+                          np.asarray(action['w'], dtype=float), np.asarray(action['a'], dtype=float)))
+        if len(self.rows) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        columns = list(zip(*self.rows))
+        self.rows = []
+        w, a = columns[-2], columns[-1]
+        chunk = {name: np.array(values) for name, values in zip(KEY_COLUMNS, columns)}
+        chunk['offsets'] = np.concatenate([[0], np.cumsum([x.size for x in w])])
+        chunk['w'] = np.concatenate(w)
+        chunk['a'] = np.concatenate(a)
+
+        # Chunk names sort in write order; the pid keeps concurrent writers apart
+        name = f"{time.time_ns():020d}-{os.getpid()}-{self._chunks_written:06d}.npz"
+        self._chunks_written += 1
+        tmp_path = os.path.join(self.path, name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **chunk)
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+def read_decision_log(path):
+    """All rows of a log directory as one dict of columns, in write order."""
+    chunks = []
+    for chunk_path in sorted(glob.glob(os.path.join(path, "*.npz"))):
+        with np.load(chunk_path) as data:
+            chunks.append({name: data[name] for name in data.files})
+    if not chunks:
+        raise FileNotFoundError(f"No decision log chunks in {path}")
+    columns = {name: np.concatenate([c[name] for c in chunks]) for name in KEY_COLUMNS + ('w', 'a')}
+    # Re-base each chunk's offsets onto the concatenated w/a arrays
+    starts = np.cumsum([0] + [c['w'].size for c in chunks[:-1]])
+    columns['offsets'] = np.concatenate([c['offsets'][:-1] + start for c, start in zip(chunks, starts)] + [[columns['w'].size]])
+    return columns
+
+class DecisionReplay:
+    """
+    Index of a decision log: (scenario, agent, params, replica) -> {slot: Action}.
+    If a slot was logged more than once (e.g. re-run after resuming from a
+    checkpoint), the last row wins.
+    """
+    def __init__(self, path):
+        columns = read_decision_log(path)
+        offsets, w, a = columns['offsets'].tolist(), columns['w'], columns['a']
+        self.decisions = {}
+        rows = zip(columns['scenario'].tolist(), columns['agent'].tolist(), columns['params'].tolist(),
+                   columns['replica'].tolist(), columns['slot'].tolist())
+        for i, (scenario, agent, params, replica, slot) in enumerate(rows):
+            start, end = offsets[i], offsets[i + 1]
+            self.decisions.setdefault((scenario, agent, params, replica), {})[slot] = Action(w[start:end], a[start:end])
+
+    def decisions_for(self, scenario, agent, params, replica):
+        key = (scenario, agent, params_key(params), replica)
+        if key not in self.decisions:
+            raise KeyError(f"No logged decisions for {key}")
+        return self.decisions[key]
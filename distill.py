@@ -0,0 +1,157 @@
+# distill.py
+"""
+Distills the SP-LLM orchestrator into a SurrogateModel (see surrogate.py).
+
+    python distill.py collect --vehicles 10 20 30 --slots 100 --seeds 3 --output surrogate_data.npz
+    python distill.py train --data surrogate_data.npz --output surrogate_model.npz
+    python distill.py evaluate --model surrogate_model.npz --vehicles 20 --slots 100
+
+collect runs SP_LLM_Agent against the endpoint real_llm is configured for
+(the OpenAI API or OPENAI_BASE_URL; --stand-in starts a local llm_server.py
+in-process) and stores one row per vehicle and slot. Slots that fell back to
+the default action are left out. evaluate runs SP-LLM and the surrogate on
+the same seeds and reports their metrics side by side, with how closely the
+surrogate's actions match the LLM's on the LLM's own states and the time
+per decision. Set PARAMS['surrogate_model_path'] to the trained model to
+run the "SP-LLM-S" agent in the scenarios.
+"""
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import time
+import numpy as np
+from config import PARAMS
+import real_llm
+import llm_server
+from environment import ArrayVECEnvironment
+from pdt import PredictiveDigitalTwin
+from agents import SP_LLM_Agent, SurrogateAgent
+from surrogate import GOALS, SurrogateModel, action_targets, vehicle_features
+
+REPORTED_METRICS = ('avg_latency_ms', 'latency_p95_ms', 'qos_violation_rate', 'total_energy_j')
+
+def _runs(vehicle_counts, goals, num_seeds, seed):
+    """(num_vehicles, goal, SeedSequence) per run; every agent gets the same seeds for the same run."""
+    runs = list(itertools.product(vehicle_counts, goals, range(num_seeds)))
+    seeds = np.random.SeedSequence(seed).spawn(len(runs))
+    return [(n, goal, run_seed) for (n, goal, _), run_seed in zip(runs, seeds)]
+
+def _make_agent(AgentClass, num_vehicles, seed, **kwargs):
+    env_seed, pdt_seed, agent_seed = seed.spawn(3)
+    env = ArrayVECEnvironment(num_vehicles, rng=np.random.default_rng(env_seed))
+    pdt = PredictiveDigitalTwin(env, rng=np.random.default_rng(pdt_seed))
+    return env, AgentClass(env, pdt=pdt, rng=np.random.default_rng(agent_seed), **kwargs)
+
+def _is_default_action(action):
+    n = len(action['w'])
+    return np.allclose(action['w'], 0.5) and np.allclose(action['a'], 1.0 / n)
+
+def collect(vehicle_counts, num_slots, goals, num_seeds=1, seed=None):
+    """(features, targets, fallback slots) from SP-LLM runs, one row per vehicle and slot."""
+    features, targets = [], []
+    fallbacks = 0
+    for n, goal, run_seed in _runs(vehicle_counts, goals, num_seeds, seed):
+        # One query per slot, so every action belongs to the state it was asked for
+        env, agent = _make_agent(SP_LLM_Agent, n, run_seed, plan_mode=False)
+        state = env.get_state()
+        for _ in range(num_slots):
+            action = agent.act(state, goal)
+            if _is_default_action(action):
+                fallbacks += 1
+            else:
+                features.append(vehicle_features(state, agent.last_query[1], goal))
+                targets.append(action_targets(action))
+            state = env.step(action)
+    if not features:
+        raise RuntimeError("Every LLM query fell back to the default action; check the API key or endpoint")
+    return np.concatenate(features), np.concatenate(targets), fallbacks
+
+def evaluate(model, vehicle_counts, num_slots, goals, num_seeds=1, seed=None):
+    """Per (N, goal): SP-LLM and surrogate metrics averaged over seeds, action agreement and time per decision."""
+    rows = []
+    for (n, goal), runs in itertools.groupby(_runs(vehicle_counts, goals, num_seeds, seed), key=lambda run: run[:2]):
+        results = {'SP-LLM': [], 'SP-LLM-S': []}
+        decide_s = {'SP-LLM': 0.0, 'SP-LLM-S': 0.0}
+        w_errors, a_errors = [], []
+        for _, _, run_seed in runs:
+            for name, AgentClass, kwargs in [('SP-LLM', SP_LLM_Agent, {'plan_mode': False}),
+                                             ('SP-LLM-S', SurrogateAgent, {'model': model})]:
+                env, agent = _make_agent(AgentClass, n, run_seed, **kwargs)
+                state = env.get_state()
+                for _ in range(num_slots):
+                    start = time.perf_counter()
+                    action = agent.act(state, goal)
+                    decide_s[name] += time.perf_counter() - start
+                    if name == 'SP-LLM' and not _is_default_action(action):
+                        imitated = model.predict(vehicle_features(state, agent.last_query[1], goal))
+                        w_errors.append(np.abs(imitated[:, 0] - action_targets(action)[:, 0]).mean())
+                        a_errors.append(np.abs(imitated[:, 1] - action_targets(action)[:, 1]).mean())
+                    state = env.step(action)
+                summary = env.metrics.summary()
+                results[name].append([float(summary[key][0]) for key in REPORTED_METRICS])
+        row = {'num_vehicles': n, 'goal': goal}
+        for name, values in results.items():
+            row[name] = dict(zip(REPORTED_METRICS, np.mean(values, axis=0).tolist()))
+            row[name]['decision_ms'] = decide_s[name] / (num_slots * len(values)) * 1000
+        row['w_mae'] = float(np.mean(w_errors)) if w_errors else None
+        row['a_times_n_mae'] = float(np.mean(a_errors)) if a_errors else None
+        rows.append(row)
+    return rows
+
+@contextlib.contextmanager
+def llm_endpoint(stand_in):
+    """Points real_llm at an in-process llm_server.py for the duration, if asked to."""
+    if not stand_in:
+        yield
+        return
+    server = llm_server.start_server(config={'latency': 'none'})
+    real_llm.configure_client(None, server.base_url)
+    try:
+        yield
+    finally:
+        server.shutdown()
+        server.server_close()
+        real_llm.configure_client(real_llm.OPENAI_API_KEY, real_llm.OPENAI_BASE_URL)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['collect', 'train', 'evaluate'])
+    parser.add_argument('--vehicles', type=int, nargs='+', default=PARAMS['num_vehicles_range'])
+    parser.add_argument('--slots', type=int, default=PARAMS['simulation_time_slots'])
+    parser.add_argument('--goals', nargs='+', choices=GOALS, default=list(GOALS))
+    parser.add_argument('--seeds', type=int, default=1, help="Runs per (vehicles, goal) pair")
+    parser.add_argument('--seed', type=int, default=PARAMS['seed'])
+    parser.add_argument('--stand-in', action='store_true', help="Answer LLM queries with an in-process llm_server.py")
+    parser.add_argument('--data', default="surrogate_data.npz")
+    parser.add_argument('--model', default="surrogate_model.npz")
+    parser.add_argument('--ridge', type=float, default=1.0)
+    parser.add_argument('--output')
+    args = parser.parse_args(argv)
+
+    if args.command == 'train':
+        with np.load(args.data) as data:
+            features, targets = data['features'], data['targets']
+        model = SurrogateModel.fit(features, targets, ridge=args.ridge)
+        model.save(args.output or args.model)
+        residuals = targets - model.predict(features)
+        print(json.dumps({'rows': len(residuals), 'train_mae': np.abs(residuals).mean(axis=0).tolist()}))
+        return
+
+    with llm_endpoint(args.stand_in), contextlib.redirect_stdout(io.StringIO()):
+        # real_llm logs every request; keep the report readable
+        if args.command == 'collect':
+            features, targets, fallbacks = collect(args.vehicles, args.slots, args.goals, args.seeds, args.seed)
+        else:
+            rows = evaluate(SurrogateModel.load(args.model), args.vehicles, args.slots, args.goals, args.seeds, args.seed)
+
+    if args.command == 'collect':
+        with open(args.output or args.data, 'wb') as f:
+            np.savez(f, features=features, targets=targets)
+        print(json.dumps({'rows': len(features), 'fallback_slots': fallbacks}))
+    else:
+        print(json.dumps(rows, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,12 @@
 # environment.py
+import heapq
+import itertools
+import math
+from collections import deque, namedtuple
 import numpy as np
 from config import PARAMS
+from metrics import StreamingMetrics, ENERGY_PHASES
+from checkpoint import prefixed, unprefixed, rng_state, set_rng_state
 
 class Vehicle:
     def __init__(self, vehicle_id, speed_mps, position_m):
@@ -18,41 +24,160 @@ class Task:
         self.completion_time = -1
         self.deadline = creation_time + (PARAMS['task_deadline_ms'] / 1000.0)
 
+def channel_gain(position_m, server_position_m=None):
+    """
+    Vectorized path loss to the server, as in VECEnvironment.get_channel_gain.
+    The server is at the road midpoint unless server_position_m is given.
+    """
+    if server_position_m is None:
+        server_position_m = PARAMS['road_length_km'] * 1000 / 2
+    distance_m = np.abs(np.asarray(position_m, dtype=float) - server_position_m)
+    distance_m = np.where(distance_m == 0, 1, distance_m)
+    path_loss = 128.1 + 37.6 * np.log10(distance_m / 1000) # in dB
+    return 10**(-path_loss / 10)
+
+class Observation(namedtuple('Observation', ('time_slot', 'position_m', 'speed_mps', 'task_load_bytes', 'channel_gain',
+                                             'server_queue_lengths', 'vehicle_id', 'rsu', 'rsu_queue_lengths'),
+                             defaults=(None, None, None))):
+    """
+    One slot's view of the fleet, as returned by get_state(): per-vehicle
+    NumPy arrays, entry i belonging to vehicle i, so agents and prompt
+    encoders read them without building an object per vehicle. vehicle_id
+    (default 0..N-1), rsu and rsu_queue_lengths are set by MultiRSUEnvironment.
+    Key lookups such as state['vehicles'] return the values of the original
+    dict format, built only when asked for, so code that expects dicts keeps
+    working: `in`, keys() and get() see the dict's keys, while len() and
+    iteration stay those of the tuple. to_dict() builds all of it, e.g. for
+    JSON prompts.
+    """
+    __slots__ = ()
+
+    @property
+    def num_vehicles(self):
+        return self.position_m.size
+
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            return super().__getitem__(key)
+        if key == 'time_slot':
+            return self.time_slot
+        if key == 'vehicles':
+            return self._vehicle_dicts()
+        if key == 'server_queue_lengths':
+            return dict(enumerate(self.server_queue_lengths.tolist()))
+        if key == 'rsu_queue_lengths' and self.rsu_queue_lengths is not None:
+            return self.rsu_queue_lengths.tolist()
+        raise KeyError(key)
+
+    def keys(self):
+        """The keys of the dict format."""
+        keys = ('time_slot', 'vehicles', 'server_queue_lengths')
+        return keys + ('rsu_queue_lengths',) if self.rsu_queue_lengths is not None else keys
+
+    def __contains__(self, key):
+        return key in self.keys()
+
+    def get(self, key, default=None):
+        return self[key] if key in self.keys() else default
+
+    def _vehicle_dicts(self):
+        ids = range(self.num_vehicles) if self.vehicle_id is None else self.vehicle_id.tolist()
+        vehicles = [
+            {'id': i, 'position_m': pos, 'speed_mps': speed, 'task_load_bytes': load, 'channel_gain': gain}
+            for i, pos, speed, load, gain in zip(ids, self.position_m.tolist(), self.speed_mps.tolist(),
+                                                 self.task_load_bytes.tolist(), self.channel_gain.tolist())
+        ]
+        if self.rsu is not None:
+            for v, rsu in zip(vehicles, self.rsu.tolist()):
+                v['rsu'] = rsu
+        return vehicles
+
+    def to_dict(self):
+        return {key: self[key] for key in self.keys()}
+
+    @classmethod
+    def from_dict(cls, state):
+        """An Observation of a state in the dict format."""
+        vehicles = state['vehicles']
+        def column(key, dtype=float):
+            return np.array([v[key] for v in vehicles], dtype=dtype)
+        rsu = column('rsu', np.int64) if vehicles and 'rsu' in vehicles[0] else None
+        rsu_queue_lengths = np.asarray(state['rsu_queue_lengths']) if 'rsu_queue_lengths' in state else None
+        return cls(state['time_slot'], column('position_m'), column('speed_mps'), column('task_load_bytes'),
+                   column('channel_gain'), np.array(list(state['server_queue_lengths'].values())),
+                   column('id', np.int64), rsu, rsu_queue_lengths)
+
+def as_observation(state):
+    """`state` as an Observation, converting it if it is in the dict format."""
+    return state if isinstance(state, Observation) else Observation.from_dict(state)
+
+class Action(namedtuple('Action', ('w', 'a'))):
+    """
+    An orchestration decision: offloading ratios w and server CPU shares a,
+    one per vehicle, as float arrays. action['w'], action['a'], `in` and
+    keys() work as on the original {'w': [...], 'a': [...]} dicts; to_dict()
+    gives that form with lists, for JSON.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, key):
+        if key == 'w':
+            return self.w
+        if key == 'a':
+            return self.a
+        if isinstance(key, str):
+            raise KeyError(key)
+        return super().__getitem__(key)
+
+    def keys(self):
+        return ('w', 'a')
+
+    def __contains__(self, key):
+        return key in ('w', 'a')
+
+    def to_dict(self):
+        return {'w': self.w.tolist(), 'a': self.a.tolist()}
+
+def as_action(action):
+    """An Action of float arrays from an Action or a {'w', 'a'} dict of lists or arrays."""
+    if isinstance(action, Action):
+        return action
+    return Action(np.asarray(action['w'], dtype=float), np.asarray(action['a'], dtype=float))
+
 class VECEnvironment:
-    def __init__(self, num_vehicles, dynamic_speed=False):
+    def __init__(self, num_vehicles, dynamic_speed=False, rng=None):
         self.num_vehicles = num_vehicles
         self.dynamic_speed = dynamic_speed
+        # A numpy Generator, or the global np.random state by default
+        self.rng = rng if rng is not None else np.random
         self.time_slot = 0
         self.task_id_counter = 0
 
         self.vehicles = self._create_vehicles()
         self.server_queues = {k: [] for k in range(self.num_vehicles)} # One queue per vehicle for simplicity
         
-        self.metrics = {
-            'completed_tasks': [],
-            'total_energy_j': 0,
-        }
+        self.metrics = StreamingMetrics(trace_every=PARAMS['metrics_trace_every'])
 
     def _create_vehicles(self):
         vehicles = []
         for i in range(self.num_vehicles):
-            speed_kmh = np.random.uniform(*PARAMS['vehicle_speed_kmh'])
+            speed_kmh = self.rng.uniform(*PARAMS['vehicle_speed_kmh'])
             speed_mps = speed_kmh * 1000 / 3600
-            position_m = np.random.uniform(0, PARAMS['road_length_km'] * 1000)
+            position_m = self.rng.uniform(0, PARAMS['road_length_km'] * 1000)
             vehicles.append(Vehicle(i, speed_mps, position_m))
         return vehicles
 
     def _update_vehicle_positions(self):
         for v in self.vehicles:
-            if self.dynamic_speed and np.random.rand() < 0.2: # 20% chance to change speed
-                speed_kmh = np.random.uniform(*PARAMS['vehicle_speed_kmh'])
+            if self.dynamic_speed and self.rng.random() < 0.2: # 20% chance to change speed
+                speed_kmh = self.rng.uniform(*PARAMS['vehicle_speed_kmh'])
                 v.speed_mps = speed_kmh * 1000 / 3600
             v.position_m = (v.position_m + v.speed_mps) % (PARAMS['road_length_km'] * 1000)
 
     def _generate_tasks(self):
         for v in self.vehicles:
-            if np.random.rand() < 0.7: # 70% chance to generate a task
-                task_size = np.random.uniform(*PARAMS['task_size_bytes'])
+            if self.rng.random() < 0.7: # 70% chance to generate a task
+                task_size = self.rng.uniform(*PARAMS['task_size_bytes'])
                 task = Task(self.task_id_counter, v.id, task_size, self.time_slot)
                 v.tasks.append(task)
                 self.task_id_counter += 1
@@ -64,65 +189,58 @@ class VECEnvironment:
         path_loss = 128.1 + 37.6 * np.log10(distance_m / 1000) # in dB
         return 10**(-path_loss / 10)
 
+    def get_vehicle_arrays(self):
+        """(position_m, speed_mps, task_load_bytes) arrays, one entry per vehicle."""
+        return (np.array([v.position_m for v in self.vehicles]),
+                np.array([v.speed_mps for v in self.vehicles]),
+                np.array([sum(t.size_bytes for t in v.tasks) for v in self.vehicles], dtype=float))
+
     def get_state(self):
-        state = {
-            'time_slot': self.time_slot,
-            'vehicles': [
-                {
-                    'id': v.id,
-                    'position_m': v.position_m,
-                    'speed_mps': v.speed_mps,
-                    'task_load_bytes': sum(t.size_bytes for t in v.tasks),
-                    'channel_gain': self.get_channel_gain(v),
-                } for v in self.vehicles
-            ],
-            'server_queue_lengths': {k: len(q) for k, q in self.server_queues.items()}
-        }
-        return state
+        position_m, speed_mps, task_load_bytes = self.get_vehicle_arrays()
+        return Observation(self.time_slot, position_m, speed_mps, task_load_bytes, channel_gain(position_m),
+                           np.array([len(q) for q in self.server_queues.values()], dtype=np.int64))
 
     def step(self, actions):
         """
-        Actions is a dict: {'w': offloading_ratios, 'a': allocation_ratios}
-        ratios are lists of lists/dicts matching vehicles and tasks.
-        For simplicity, we use a single ratio per vehicle.
+        Actions is an Action (or a {'w': offloading_ratios, 'a': allocation_ratios}
+        dict) with a single ratio per vehicle for simplicity.
         """
         self._update_vehicle_positions()
         self._generate_tasks()
 
-        w_ratios = actions['w'] # [w_v0, w_v1, ...]
-        a_ratios = actions['a'] # [a_v0, a_v1, ...]
+        actions = as_action(actions)
+        w_ratios = actions.w # [w_v0, w_v1, ...]
+        a_ratios = actions.a # [a_v0, a_v1, ...]
 
-        total_energy_this_step = 0
-        
         # 1. Process local and offloaded tasks
         for i, v in enumerate(self.vehicles):
             tasks_to_process = v.tasks[:]
             v.tasks = []
             
             for task in tasks_to_process:
-                offload_decision = np.random.rand() < w_ratios[i]
+                offload_decision = self.rng.random() < w_ratios[i]
                 
                 if not offload_decision: # Process locally
                     cycles_needed = task.size_bytes * PARAMS['cpu_cycles_per_byte_mhz'] * 1e6
                     proc_time = cycles_needed / (PARAMS['vehicle_cpu_freq_ghz'] * 1e9)
                     # Simplified energy: E = k * f^2 * t
                     energy = 1e-26 * (PARAMS['vehicle_cpu_freq_ghz'] * 1e9)**2 * proc_time
-                    total_energy_this_step += energy
+                    self.metrics.add_energy('local', energy)
                     task.completion_time = self.time_slot + proc_time
-                    self.metrics['completed_tasks'].append(task)
+                    self.metrics.add_task(task.completion_time - task.creation_time, creation_time=task.creation_time)
                 else: # Offload to server
                     channel_gain = self.get_channel_gain(v)
                     rate_bps = PARAMS['network_bandwidth_mhz'] * 1e6 * np.log2(1 + (PARAMS['vehicle_tx_power_watts'] * channel_gain) / PARAMS['channel_noise_watts'])
                     tx_time = task.size_bytes * 8 / rate_bps
                     energy = PARAMS['vehicle_tx_power_watts'] * tx_time
-                    total_energy_this_step += energy
+                    self.metrics.add_energy('transmission', energy)
                     # Task arrives at server after tx_time, we simplify by adding to queue now
                     self.server_queues[v.id].append(task)
         
         # 2. Process tasks from server queue
-        total_server_alloc = sum(a_ratios)
+        total_server_alloc = a_ratios.sum()
         if total_server_alloc > 1.0: # Normalize if agent gives invalid action
-            a_ratios = [r / total_server_alloc for r in a_ratios]
+            a_ratios = a_ratios / total_server_alloc
 
         for i, v in enumerate(self.vehicles):
             if self.server_queues[v.id]:
@@ -133,11 +251,897 @@ class VECEnvironment:
                     proc_time = cycles_needed / server_cpu_for_v
                     # Simplified server energy
                     energy = 1e-24 * (server_cpu_for_v)**2 * proc_time
-                    total_energy_this_step += energy
+                    self.metrics.add_energy('server', energy)
                     task.completion_time = self.time_slot + proc_time
-                    self.metrics['completed_tasks'].append(task)
+                    self.metrics.add_task(task.completion_time - task.creation_time, creation_time=task.creation_time)
         
-        self.metrics['total_energy_j'] += total_energy_this_step
         self.time_slot += 1
 
-        return self.get_state()
\ No newline at end of file
+        return self.get_state()
+
+    def state_dict(self):
+        """Vehicles, pending tasks and server queues as flat arrays, plus the RNG and metrics state."""
+        def task_rows(queues):
+            return np.array([(vid, t.id, t.size_bytes, t.creation_time) for vid, q in queues for t in q], dtype=float).reshape(-1, 4)
+        state = {
+            'speed_mps': np.array([v.speed_mps for v in self.vehicles]),
+            'position_m': np.array([v.position_m for v in self.vehicles]),
+            'vehicle_tasks': task_rows((v.id, v.tasks) for v in self.vehicles),
+            'server_tasks': task_rows(self.server_queues.items()), # FIFO order within each queue
+            'time_slot': self.time_slot,
+            'task_id_counter': self.task_id_counter,
+            'rng': rng_state(self.rng),
+        }
+        state.update(prefixed('metrics', self.metrics.state_dict()))
+        return state
+
+    def load_state_dict(self, state):
+        if state['position_m'].size != self.num_vehicles:
+            raise ValueError("Checkpoint has a different number of vehicles")
+        for v, speed, pos in zip(self.vehicles, state['speed_mps'].tolist(), state['position_m'].tolist()):
+            v.speed_mps, v.position_m, v.tasks = speed, pos, []
+        self.server_queues = {k: [] for k in range(self.num_vehicles)}
+        for rows, queue_of in [(state['vehicle_tasks'], lambda vid: self.vehicles[vid].tasks),
+                               (state['server_tasks'], lambda vid: self.server_queues[vid])]:
+            for vid, task_id, size_bytes, creation_time in rows.tolist():
+                queue_of(int(vid)).append(Task(int(task_id), int(vid), size_bytes, creation_time))
+        self.time_slot = state['time_slot']
+        self.task_id_counter = state['task_id_counter']
+        set_rng_state(self.rng, state['rng'])
+        self.metrics.load_state_dict(unprefixed('metrics', state))
+
+class ArrayVECEnvironment:
+    """
+    Struct-of-arrays variant of VECEnvironment.
+
+    Vehicle kinematics, pending tasks and the per-vehicle server queues are
+    held in NumPy arrays, so mobility, task generation, offloading,
+    transmission, processing and energy are each a few batched operations
+    per slot instead of Python loops over vehicles and tasks. The physical
+    model is the same as VECEnvironment; random draws are taken in blocks,
+    so only the initial placement consumes the RNG stream in the same order.
+    """
+    def __init__(self, num_vehicles, dynamic_speed=False, queue_capacity=8, rng=None):
+        self.num_vehicles = num_vehicles
+        self.dynamic_speed = dynamic_speed
+        self.rng = rng if rng is not None else np.random
+        self.time_slot = 0
+        self.task_id_counter = 0
+        self.road_length_m = PARAMS['road_length_km'] * 1000
+        self._init_arrays(num_vehicles, queue_capacity)
+        self.metrics = StreamingMetrics(trace_every=PARAMS['metrics_trace_every'])
+
+    def _init_arrays(self, fleet_size, queue_capacity):
+        self.fleet_size = fleet_size
+        self._all = np.arange(fleet_size)
+
+        # Same draw order as VECEnvironment._create_vehicles: (speed, position) per vehicle
+        draws = self._random(np.repeat(self._all, 2)).reshape(fleet_size, 2)
+        low, high = PARAMS['vehicle_speed_kmh']
+        self.speed_mps = (low + (high - low) * draws[:, 0]) * 1000 / 3600
+        self.position_m = self.road_length_m * draws[:, 1]
+
+        # Tasks generated this slot and not yet processed (at most one per vehicle)
+        self.pending_bytes = np.zeros(fleet_size)
+
+        # Per-vehicle FIFO server queues as ring buffers
+        self.queue_size_bytes = np.zeros((fleet_size, queue_capacity))
+        self.queue_creation_time = np.zeros((fleet_size, queue_capacity))
+        self.queue_head = np.zeros(fleet_size, dtype=np.int64)
+        self.queue_len = np.zeros(fleet_size, dtype=np.int64)
+
+    # Arrays that make up the simulation state, saved by state_dict()
+    _STATE_ARRAYS = ('speed_mps', 'position_m', 'pending_bytes', 'queue_size_bytes', 'queue_creation_time',
+                     'queue_head', 'queue_len')
+
+    def _generators(self):
+        return [self.rng]
+
+    def state_dict(self):
+        state = {name: getattr(self, name) for name in self._STATE_ARRAYS}
+        state.update(time_slot=self.time_slot, task_id_counter=self.task_id_counter,
+                     rngs=[rng_state(rng) for rng in self._generators()])
+        state.update(prefixed('metrics', self.metrics.state_dict()))
+        return state
+
+    def load_state_dict(self, state):
+        if state['position_m'].size != self.fleet_size:
+            raise ValueError("Checkpoint has a different number of vehicles")
+        for name in self._STATE_ARRAYS:
+            setattr(self, name, state[name].copy())
+        self.time_slot = state['time_slot']
+        self.task_id_counter = state['task_id_counter']
+        for rng, rng_saved in zip(self._generators(), state['rngs']):
+            set_rng_state(rng, rng_saved)
+        self.metrics.load_state_dict(unprefixed('metrics', state))
+
+    def _random(self, idx):
+        """One uniform [0, 1) draw for each vehicle index in idx (sorted)."""
+        return self.rng.random(idx.size)
+
+    def _uniform(self, low, high, idx):
+        return low + (high - low) * self._random(idx)
+
+    def _streams(self, idx):
+        """Metrics stream of each vehicle index; None means the single stream 0."""
+        return None
+
+    @property
+    def server_queues(self):
+        return {k: int(n) for k, n in enumerate(self.queue_len)}
+
+    def _update_vehicle_positions(self):
+        if self.dynamic_speed:
+            change_idx = np.flatnonzero(self._random(self._all) < 0.2) # 20% chance to change speed
+            if change_idx.size:
+                self.speed_mps[change_idx] = self._uniform(*PARAMS['vehicle_speed_kmh'], change_idx) * 1000 / 3600
+        self.position_m = (self.position_m + self.speed_mps) % self.road_length_m
+
+    def _generate_tasks(self):
+        task_idx = np.flatnonzero(self._random(self._all) < 0.7) # 70% chance to generate a task
+        if task_idx.size:
+            self.pending_bytes[task_idx] += self._uniform(*PARAMS['task_size_bytes'], task_idx)
+            self.task_id_counter += task_idx.size
+        return task_idx
+
+    def get_channel_gain(self, idx=None):
+        return channel_gain(self.position_m if idx is None else self.position_m[idx])
+
+    def _state_for(self, vehicles):
+        # Copies, since stepping updates some of the arrays in place
+        return Observation(self.time_slot, self.position_m[vehicles].copy(), self.speed_mps[vehicles].copy(),
+                           self.pending_bytes[vehicles].copy(), self.get_channel_gain(vehicles),
+                           self.queue_len[vehicles].copy())
+
+    def get_state(self):
+        return self._state_for(slice(None))
+
+    def get_vehicle_arrays(self, vehicles=slice(None)):
+        """(position_m, speed_mps, task_load_bytes) arrays, one entry per vehicle. Read-only views."""
+        return self.position_m[vehicles], self.speed_mps[vehicles], self.pending_bytes[vehicles]
+
+    def _grow_queues(self):
+        capacity = self.queue_size_bytes.shape[1]
+        # Unroll each ring so it starts at column 0, then double the capacity
+        cols = (self.queue_head[:, None] + np.arange(capacity)) % capacity
+        new_size = np.zeros((self.fleet_size, 2 * capacity))
+        new_creation = np.zeros((self.fleet_size, 2 * capacity))
+        new_size[:, :capacity] = np.take_along_axis(self.queue_size_bytes, cols, axis=1)
+        new_creation[:, :capacity] = np.take_along_axis(self.queue_creation_time, cols, axis=1)
+        self.queue_size_bytes = new_size
+        self.queue_creation_time = new_creation
+        self.queue_head[:] = 0
+
+    def _enqueue(self, idx, size_bytes, creation_time):
+        if idx.size and self.queue_len[idx].max() >= self.queue_size_bytes.shape[1]:
+            self._grow_queues()
+        capacity = self.queue_size_bytes.shape[1]
+        tail = (self.queue_head[idx] + self.queue_len[idx]) % capacity
+        self.queue_size_bytes[idx, tail] = size_bytes
+        self.queue_creation_time[idx, tail] = creation_time
+        self.queue_len[idx] += 1
+
+    def _dequeue(self, idx):
+        head = self.queue_head[idx]
+        size_bytes = self.queue_size_bytes[idx, head]
+        creation_time = self.queue_creation_time[idx, head]
+        self.queue_head[idx] = (head + 1) % self.queue_size_bytes.shape[1]
+        self.queue_len[idx] -= 1
+        return size_bytes, creation_time
+
+    def _server_cpu_hz(self, a_ratios):
+        return a_ratios * PARAMS['vec_server_cpu_freq_ghz'] * 1e9
+
+    def _normalize_allocations(self, a_ratios):
+        total_server_alloc = np.sum(a_ratios)
+        if total_server_alloc > 1.0: # Normalize if agent gives invalid action
+            a_ratios = a_ratios / total_server_alloc
+        return a_ratios
+
+    def _step_arrays(self, w_ratios, a_ratios):
+        """Advance one slot with flat per-vehicle w and a arrays."""
+        self._update_vehicle_positions()
+        task_idx = self._generate_tasks()
+
+        # 1. Process local and offloaded tasks
+        task_bytes = self.pending_bytes[task_idx]
+        self.pending_bytes[task_idx] = 0
+        offload = self._random(task_idx) < w_ratios[task_idx]
+
+        local_idx = task_idx[~offload]
+        cycles_needed = task_bytes[~offload] * PARAMS['cpu_cycles_per_byte_mhz'] * 1e6
+        local_time = cycles_needed / (PARAMS['vehicle_cpu_freq_ghz'] * 1e9)
+        # Simplified energy: E = k * f^2 * t
+        local_energy = 1e-26 * (PARAMS['vehicle_cpu_freq_ghz'] * 1e9)**2 * local_time
+
+        offload_idx = task_idx[offload]
+        offload_bytes = task_bytes[offload]
+        channel_gain = self.get_channel_gain(offload_idx)
+        rate_bps = PARAMS['network_bandwidth_mhz'] * 1e6 * np.log2(1 + (PARAMS['vehicle_tx_power_watts'] * channel_gain) / PARAMS['channel_noise_watts'])
+        tx_time = offload_bytes * 8 / rate_bps
+        tx_energy = PARAMS['vehicle_tx_power_watts'] * tx_time
+        # Task arrives at server after tx_time, we simplify by adding to queue now
+        self._enqueue(offload_idx, offload_bytes, self.time_slot)
+
+        # 2. Process tasks from server queue
+        server_cpu = self._server_cpu_hz(a_ratios)
+        served_idx = np.flatnonzero((self.queue_len > 0) & (server_cpu > 0))
+        size_bytes, creation_time = self._dequeue(served_idx)
+        server_cpu_for_v = server_cpu[served_idx]
+        cycles_needed = size_bytes * PARAMS['cpu_cycles_per_byte_mhz'] * 1e6
+        server_time = cycles_needed / server_cpu_for_v
+        # Simplified server energy
+        server_energy = 1e-24 * server_cpu_for_v**2 * server_time
+
+        self.metrics.add_energy('local', local_energy, self._streams(local_idx))
+        self.metrics.add_energy('transmission', tx_energy, self._streams(offload_idx))
+        self.metrics.add_energy('server', server_energy, self._streams(served_idx))
+        completed_idx = np.concatenate([local_idx, served_idx])
+        self.metrics.add_tasks(
+            np.concatenate([local_time, self.time_slot + server_time - creation_time]),
+            self._streams(completed_idx),
+            np.concatenate([np.full(local_idx.size, float(self.time_slot)), creation_time]),
+        )
+        self.time_slot += 1
+
+    def step(self, actions):
+        """
+        Actions is an Action, or a {'w': offloading_ratios, 'a': allocation_ratios}
+        dict of lists or arrays, with one ratio per vehicle.
+        """
+        actions = as_action(actions)
+        self._step_arrays(actions.w, self._normalize_allocations(actions.a))
+        return self.get_state()
+
+
+class VectorVECEnv(ArrayVECEnvironment):
+    """
+    R independent replicas of the array engine stepped as one batch.
+
+    Vehicle arrays are flattened replica-major to R*N entries, so every phase
+    of a slot runs once for all replicas. Each replica draws from its own
+    numpy Generator, which makes replica r's trajectory independent of how
+    many replicas run alongside it. `seed` is either one seed that is spawned
+    into R streams, or a list of R seeds / SeedSequences. Metrics are one
+    StreamingMetrics stream per replica.
+    """
+    def __init__(self, num_replicas, num_vehicles, dynamic_speed=False, seed=None,
+                 queue_capacity=8, violation_window=10):
+        self.num_replicas = num_replicas
+        self.num_vehicles = num_vehicles
+        self.dynamic_speed = dynamic_speed
+        self.time_slot = 0
+        self.task_id_counter = 0
+        self.road_length_m = PARAMS['road_length_km'] * 1000
+        if isinstance(seed, (list, tuple)):
+            self.rngs = [np.random.default_rng(s) for s in seed]
+        else:
+            self.rngs = [np.random.default_rng(s) for s in np.random.SeedSequence(seed).spawn(num_replicas)]
+        self._init_arrays(num_replicas * num_vehicles, queue_capacity)
+
+        self.metrics = StreamingMetrics(num_replicas, violation_window=violation_window,
+                                        trace_every=PARAMS['metrics_trace_every'])
+
+    def _generators(self):
+        return self.rngs
+
+    def _random(self, idx):
+        counts = np.bincount(idx // self.num_vehicles, minlength=self.num_replicas)
+        return np.concatenate([rng.random(c) for rng, c in zip(self.rngs, counts)])
+
+    def _streams(self, idx):
+        return idx // self.num_vehicles
+
+    @property
+    def server_queues(self):
+        return self.queue_len.reshape(self.num_replicas, self.num_vehicles)
+
+    def get_state(self, replica=0):
+        start = replica * self.num_vehicles
+        return self._state_for(slice(start, start + self.num_vehicles))
+
+    def get_vehicle_arrays(self, replica=0):
+        start = replica * self.num_vehicles
+        return super().get_vehicle_arrays(slice(start, start + self.num_vehicles))
+
+    def get_states(self):
+        return [self.get_state(r) for r in range(self.num_replicas)]
+
+    def replica(self, r):
+        return ReplicaView(self, r)
+
+    def get_metrics(self):
+        """Per-replica metrics as a dict of length-R arrays."""
+        return self.metrics.summary()
+
+    def recent_violation_rate(self):
+        return self.metrics.recent_violation_rate()
+
+    def step(self, actions):
+        """
+        Actions is either a dict {'w': (R, N), 'a': (R, N)} of arrays, or a
+        list of R per-replica Actions as returned by the agents.
+        Allocations are normalized per replica. Use get_states() or
+        get_metrics() afterwards; no state dicts are built here.
+        """
+        shape = (self.num_replicas, self.num_vehicles)
+        if isinstance(actions, dict):
+            w_ratios = np.asarray(actions['w'], dtype=float).reshape(shape)
+            a_ratios = np.asarray(actions['a'], dtype=float).reshape(shape)
+        else:
+            actions = [as_action(act) for act in actions]
+            w_ratios = np.stack([act.w for act in actions]).reshape(shape)
+            a_ratios = np.stack([act.a for act in actions]).reshape(shape)
+
+        total_server_alloc = a_ratios.sum(axis=1, keepdims=True)
+        # Normalize if agent gives invalid action
+        a_ratios = np.where(total_server_alloc > 1.0, a_ratios / np.maximum(total_server_alloc, 1.0), a_ratios)
+        self._step_arrays(w_ratios.ravel(), a_ratios.ravel())
+
+
+class EnvReplicas:
+    """
+    R independent single-run engines (EventVECEnvironment, MultiRSUEnvironment, VECEnvironment) behind the
+    VectorVECEnv interface used by run_replicas. Each replica steps on its own;
+    metrics are gathered per replica.
+    """
+    def __init__(self, envs):
+        self.envs = envs
+        self.num_replicas = len(envs)
+        self.num_vehicles = envs[0].num_vehicles
+        self.dynamic_speed = envs[0].dynamic_speed
+
+    @property
+    def time_slot(self):
+        return self.envs[0].time_slot
+
+    def get_state(self, replica=0):
+        return self.envs[replica].get_state()
+
+    def get_vehicle_arrays(self, replica=0):
+        return self.envs[replica].get_vehicle_arrays()
+
+    def get_states(self):
+        return [env.get_state() for env in self.envs]
+
+    def replica(self, r):
+        return ReplicaView(self, r)
+
+    # Per-replica counters of the engines that keep them
+    _COUNTERS = ('handovers', 'dropped_tasks')
+
+    def get_metrics(self):
+        """Per-replica metrics as a dict of length-R arrays."""
+        summaries = [env.metrics.summary() for env in self.envs]
+        metrics = {key: np.concatenate([summary[key] for summary in summaries]) for key in summaries[0]}
+        for key in self._COUNTERS:
+            if hasattr(self.envs[0], key):
+                metrics[key] = np.array([getattr(env, key) for env in self.envs])
+        return metrics
+
+    def recent_violation_rate(self):
+        return np.concatenate([env.metrics.recent_violation_rate() for env in self.envs])
+
+    def step(self, actions):
+        """Actions is a list of R per-replica Actions."""
+        for env, action in zip(self.envs, actions):
+            env.step(action)
+
+    def state_dict(self):
+        state = {}
+        for r, env in enumerate(self.envs):
+            state.update(prefixed(f'replica{r}', env.state_dict()))
+        return state
+
+    def load_state_dict(self, state):
+        for r, env in enumerate(self.envs):
+            env.load_state_dict(unprefixed(f'replica{r}', state))
+
+
+class ReplicaView:
+    """One replica of a VectorVECEnv or EnvReplicas behind the VECEnvironment interface used by agents and the pDT."""
+    def __init__(self, venv, replica):
+        self.venv = venv
+        self.replica = replica
+        self.num_vehicles = venv.num_vehicles
+        self.dynamic_speed = venv.dynamic_speed
+
+    @property
+    def time_slot(self):
+        return self.venv.time_slot
+
+    def get_state(self):
+        return self.venv.get_state(self.replica)
+
+    def get_vehicle_arrays(self):
+        return self.venv.get_vehicle_arrays(self.replica)
+
+
+class MultiRSUEnvironment(ArrayVECEnvironment):
+    """
+    The array engine on a road served by several roadside units (RSUs).
+
+    Each vehicle is associated with its nearest RSU. RSU positions are kept
+    sorted, so association is a binary search over the midpoints between
+    neighbouring RSUs (O(N log M)) instead of an N x M distance scan; a change
+    of RSU between slots counts as a handover. Each RSU has its own CPU,
+    shared out by the allocation ratios 'a' (see _normalize_allocations).
+    A vehicle's server queue follows it on handover (migrated over the
+    backhaul; the migration delay is not modelled).
+    With one RSU at the road midpoint this is the single-server model.
+
+    `segment` = (start_m, end_m) restricts the initial placement to part of
+    the road, for sharded runs (see sharded.py); vehicles then move between
+    environments with remove_vehicles()/add_vehicles().
+    """
+    def __init__(self, num_vehicles, rsu_positions_m=None, rsu_cpu_ghz=None, dynamic_speed=False,
+                 queue_capacity=8, rng=None, segment=None, first_vehicle_id=0):
+        road_length_m = PARAMS['road_length_km'] * 1000
+        if rsu_positions_m is None:
+            num_rsus = PARAMS['num_rsus']
+            rsu_positions_m = (np.arange(num_rsus) + 0.5) * road_length_m / num_rsus
+        order = np.argsort(rsu_positions_m)
+        self.rsu_positions_m = np.asarray(rsu_positions_m, dtype=float)[order]
+        if rsu_cpu_ghz is None:
+            rsu_cpu_ghz = PARAMS['rsu_cpu_freq_ghz'] or PARAMS['vec_server_cpu_freq_ghz']
+        self.rsu_cpu_hz = np.broadcast_to(np.asarray(rsu_cpu_ghz, dtype=float), self.rsu_positions_m.shape)[order] * 1e9
+        # Cell edges: a vehicle belongs to RSU k between edges k-1 and k
+        self.rsu_edges_m = (self.rsu_positions_m[1:] + self.rsu_positions_m[:-1]) / 2
+        self.num_rsus = self.rsu_positions_m.size
+        self.handovers = 0
+
+        super().__init__(num_vehicles, dynamic_speed=dynamic_speed, queue_capacity=queue_capacity, rng=rng)
+        self.segment = segment
+        if segment is not None:
+            start_m, end_m = segment
+            self.position_m = start_m + self.position_m / self.road_length_m * (end_m - start_m)
+        self.vehicle_id = np.arange(first_vehicle_id, first_vehicle_id + num_vehicles)
+        self.rsu = self.associate(self.position_m)
+
+    def associate(self, position_m):
+        """Index of the nearest RSU for each position."""
+        return np.searchsorted(self.rsu_edges_m, position_m)
+
+    def _update_vehicle_positions(self):
+        super()._update_vehicle_positions()
+        rsu = self.associate(self.position_m)
+        changed = rsu != self.rsu
+        if self.segment is not None:
+            # Vehicles that left the segment (e.g. wrapping around from the road's end) are counted on arrival
+            start_m, end_m = self.segment
+            changed &= (self.position_m >= start_m) & (self.position_m < end_m)
+        self.handovers += int(np.count_nonzero(changed))
+        self.rsu = rsu
+
+    def get_channel_gain(self, idx=None):
+        if idx is None:
+            return channel_gain(self.position_m, self.rsu_positions_m[self.rsu])
+        return channel_gain(self.position_m[idx], self.rsu_positions_m[self.rsu[idx]])
+
+    def _server_cpu_hz(self, a_ratios):
+        return a_ratios * self.rsu_cpu_hz[self.rsu]
+
+    def _normalize_allocations(self, a_ratios):
+        # Every RSU uses the share of its CPU the action uses overall (at most all of it),
+        # split among its own vehicles in proportion to 'a'. With one RSU this is the
+        # single-server rule; RSU-aware agents can simply give each RSU's vehicles a sum of 1.
+        budget = min(a_ratios.sum(), 1.0)
+        total_per_rsu = np.bincount(self.rsu, weights=a_ratios, minlength=self.num_rsus)
+        return a_ratios / np.where(total_per_rsu > 0, total_per_rsu / max(budget, 1e-300), 1.0)[self.rsu]
+
+    def _state_for(self, vehicles):
+        rsu_queue_lengths = np.bincount(self.rsu[vehicles], weights=self.queue_len[vehicles], minlength=self.num_rsus)
+        return super()._state_for(vehicles)._replace(vehicle_id=self.vehicle_id[vehicles].copy(), rsu=self.rsu[vehicles].copy(),
+                                                     rsu_queue_lengths=rsu_queue_lengths.astype(int))
+
+    # Per-vehicle arrays moved by remove_vehicles/add_vehicles; the queues are handled separately
+    _VEHICLE_ARRAYS = ('vehicle_id', 'speed_mps', 'position_m', 'pending_bytes', 'rsu')
+
+    def remove_vehicles(self, mask):
+        """Takes the vehicles selected by `mask` out of this environment, returned as a dict of arrays."""
+        idx = np.flatnonzero(mask)
+        capacity = self.queue_size_bytes.shape[1]
+        # Unroll the leaving vehicles' rings so their queues start at column 0
+        cols = (self.queue_head[idx, None] + np.arange(capacity)) % capacity
+        leaving = {name: getattr(self, name)[idx] for name in self._VEHICLE_ARRAYS}
+        leaving['queue_size_bytes'] = np.take_along_axis(self.queue_size_bytes[idx], cols, axis=1)
+        leaving['queue_creation_time'] = np.take_along_axis(self.queue_creation_time[idx], cols, axis=1)
+        leaving['queue_len'] = self.queue_len[idx]
+
+        keep = ~np.asarray(mask, dtype=bool)
+        for name in self._VEHICLE_ARRAYS + ('queue_size_bytes', 'queue_creation_time', 'queue_head', 'queue_len'):
+            setattr(self, name, getattr(self, name)[keep])
+        self._resize(int(keep.sum()))
+        return leaving
+
+    def add_vehicles(self, arriving):
+        """Adds vehicles returned by another environment's remove_vehicles()."""
+        if not arriving['vehicle_id'].size:
+            return
+        while self.queue_size_bytes.shape[1] < arriving['queue_size_bytes'].shape[1]:
+            self._grow_queues()
+        capacity = self.queue_size_bytes.shape[1]
+        pad = ((0, 0), (0, capacity - arriving['queue_size_bytes'].shape[1]))
+        for name in self._VEHICLE_ARRAYS:
+            setattr(self, name, np.concatenate([getattr(self, name), arriving[name]]))
+        self.queue_size_bytes = np.concatenate([self.queue_size_bytes, np.pad(arriving['queue_size_bytes'], pad)])
+        self.queue_creation_time = np.concatenate([self.queue_creation_time, np.pad(arriving['queue_creation_time'], pad)])
+        self.queue_head = np.concatenate([self.queue_head, np.zeros(arriving['vehicle_id'].size, dtype=np.int64)])
+        self.queue_len = np.concatenate([self.queue_len, arriving['queue_len']])
+        self._resize(self.vehicle_id.size)
+        # Segment boundaries are RSU cell edges, so every arrival has been handed over
+        self.rsu = self.associate(self.position_m)
+        self.handovers += arriving['vehicle_id'].size
+
+    def _resize(self, num_vehicles):
+        self.num_vehicles = num_vehicles
+        self.fleet_size = num_vehicles
+        self._all = np.arange(num_vehicles)
+
+    _STATE_ARRAYS = ArrayVECEnvironment._STATE_ARRAYS + ('vehicle_id', 'rsu')
+
+    def state_dict(self):
+        state = super().state_dict()
+        state['handovers'] = self.handovers
+        return state
+
+    def load_state_dict(self, state):
+        # The number of vehicles changes as they move between segments
+        self._resize(state['position_m'].size)
+        super().load_state_dict(state)
+        self.handovers = state['handovers']
+
+
+# Event kinds of EventVECEnvironment
+TASK_ARRIVAL, TX_DONE, SERVICE_DONE, LOCAL_DONE, DEADLINE = range(5)
+TASK_EVENTS = (TX_DONE, LOCAL_DONE, DEADLINE) # Events whose payload is an EventTask
+
+class EventScheduler:
+    """
+    Future events in a binary heap ordered by (time, sequence number), so
+    events at equal times come out in the order they were scheduled. Events
+    are never removed; a handler that finds its event outdated (e.g. a
+    service completion rescheduled after a rate change) ignores it.
+    """
+    def __init__(self):
+        self.heap = []
+        self._seq = itertools.count()
+        self.now = 0.0
+        self.processed = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def schedule(self, time, kind, payload):
+        heapq.heappush(self.heap, (time, next(self._seq), kind, payload))
+
+    def schedule_many(self, times, kind, payloads):
+        seq = self._seq
+        self.heap.extend((time, next(seq), kind, payload) for time, payload in zip(times, payloads))
+        heapq.heapify(self.heap)
+
+    def pop_until(self, end_time):
+        """Yields (time, kind, payload) of every event before end_time in order; handlers may schedule more."""
+        heap = self.heap
+        while heap and heap[0][0] < end_time:
+            time, _, kind, payload = heapq.heappop(heap)
+            self.now = time
+            self.processed += 1
+            yield time, kind, payload
+        self.now = end_time
+
+class EventTask(Task):
+    def __init__(self, task_id, vehicle_id, size_bytes, creation_time):
+        super().__init__(task_id, vehicle_id, size_bytes, creation_time)
+        self.remaining_cycles = size_bytes * PARAMS['cpu_cycles_per_byte_mhz'] * 1e6
+        self.dropped = False
+
+class EventVECEnvironment:
+    """
+    Discrete-event variant of the VEC engine behind the same get_state()/step()
+    interface. Agents still act at slot boundaries, but within a slot each
+    task moves through timed events popped from an EventScheduler: arrival,
+    end of uplink transmission, end of server service or local processing,
+    and (with drop_expired) its deadline. Time between events is skipped, so
+    a slot costs O(tasks log tasks) plus a few O(N) array operations.
+
+    Unlike the slot engines, tasks arrive as a Poisson process (task_rate_hz
+    per vehicle, 0.7 matches the slot engines' mean) at any time in a slot;
+    an offloaded task joins the server queue only once transmitted; each
+    vehicle's uplink and local CPU handle one task at a time; and the server
+    works through a vehicle's queue continuously at a_v * CPU, carrying the
+    remaining cycles of a task over when the next action changes a_v.
+    With drop_expired, a task still waiting for the server at its deadline
+    is dropped and counted in dropped_tasks instead of the latency metrics.
+    """
+    def __init__(self, num_vehicles, dynamic_speed=False, rng=None, task_rate_hz=0.7, drop_expired=False):
+        self.num_vehicles = num_vehicles
+        self.dynamic_speed = dynamic_speed
+        self.rng = rng if rng is not None else np.random
+        self.task_rate_hz = task_rate_hz
+        self.drop_expired = drop_expired
+        self.time_slot = 0
+        self.task_id_counter = 0
+        self.road_length_m = PARAMS['road_length_km'] * 1000
+        self.server_position_m = self.road_length_m / 2
+
+        # Same initial placement as ArrayVECEnvironment; positions are those at time_slot
+        draws = self.rng.random(2 * num_vehicles).reshape(num_vehicles, 2)
+        low, high = PARAMS['vehicle_speed_kmh']
+        self.speed_mps = (low + (high - low) * draws[:, 0]) * 1000 / 3600
+        self.position_m = self.road_length_m * draws[:, 1]
+
+        self.scheduler = EventScheduler()
+        # Per-vehicle values updated one event at a time are Python lists
+        self.load_bytes = [0.0] * num_vehicles      # Tasks still on the vehicle (local CPU or uplink)
+        self.local_free_at = [0.0] * num_vehicles
+        self.uplink_free_at = [0.0] * num_vehicles
+        self.server_queues = [deque() for _ in range(num_vehicles)]
+        self.queue_len = np.zeros(num_vehicles, dtype=np.int64) # Waiting for or in service at the server
+        self.in_service = [None] * num_vehicles
+        self.service_since = [0.0] * num_vehicles
+        self.service_version = [0] * num_vehicles
+        self.service_hz = np.zeros(num_vehicles)
+        self.w_ratios = np.zeros(num_vehicles)
+        self.dropped_tasks = 0
+
+        self.metrics = StreamingMetrics(trace_every=PARAMS['metrics_trace_every'])
+        # Completed tasks and energy of the current step, handed to the metrics in one batch
+        self._completed = []
+        self._energy = dict.fromkeys(ENERGY_PHASES, 0.0)
+        self._handlers = (self._on_arrival, self._on_tx_done, self._on_service_done, self._on_local_done, self._on_deadline)
+
+    def _position_at(self, v, time):
+        return (self.position_m[v] + self.speed_mps[v] * (time - self.time_slot)) % self.road_length_m
+
+    def _uplink_rate_bps(self, position_m):
+        # Scalar form of channel_gain()
+        distance_m = abs(position_m - self.server_position_m) or 1.0
+        gain = 10**(-(128.1 + 37.6 * math.log10(distance_m / 1000)) / 10)
+        return PARAMS['network_bandwidth_mhz'] * 1e6 * math.log2(1 + (PARAMS['vehicle_tx_power_watts'] * gain) / PARAMS['channel_noise_watts'])
+
+    def _schedule_arrivals(self, start, end):
+        # Poisson arrivals for the whole fleet, drawn as one block per slot
+        n = self.rng.poisson(self.task_rate_hz * self.num_vehicles * (end - start))
+        times = start + np.sort(self.rng.random(n)) * (end - start)
+        vehicles = self.rng.integers(self.num_vehicles, size=n)
+        low, high = PARAMS['task_size_bytes']
+        sizes = low + (high - low) * self.rng.random(n)
+        offload_draws = self.rng.random(n)
+        self.scheduler.schedule_many(times.tolist(), TASK_ARRIVAL,
+                                     zip(vehicles.tolist(), sizes.tolist(), offload_draws.tolist()))
+
+    def _on_arrival(self, time, payload):
+        v, size_bytes, offload_draw = payload
+        task = EventTask(self.task_id_counter, v, size_bytes, time)
+        self.task_id_counter += 1
+        self.load_bytes[v] += size_bytes
+        if offload_draw < self.w_ratios[v]:
+            start = max(time, self.uplink_free_at[v])
+            tx_time = size_bytes * 8 / self._uplink_rate_bps(self._position_at(v, start))
+            self.uplink_free_at[v] = start + tx_time
+            self._energy['transmission'] += PARAMS['vehicle_tx_power_watts'] * tx_time
+            self.scheduler.schedule(start + tx_time, TX_DONE, task)
+        else:
+            local_hz = PARAMS['vehicle_cpu_freq_ghz'] * 1e9
+            proc_time = task.remaining_cycles / local_hz
+            start = max(time, self.local_free_at[v])
+            self.local_free_at[v] = start + proc_time
+            # Simplified energy: E = k * f^2 * t
+            self._energy['local'] += 1e-26 * local_hz**2 * proc_time
+            self.scheduler.schedule(start + proc_time, LOCAL_DONE, task)
+
+    def _complete(self, task, time):
+        task.completion_time = time
+        self._completed.append((time - task.creation_time, task.creation_time))
+
+    def _on_local_done(self, time, task):
+        self.load_bytes[task.vehicle_id] -= task.size_bytes
+        self._complete(task, time)
+
+    def _on_tx_done(self, time, task):
+        v = task.vehicle_id
+        self.load_bytes[v] -= task.size_bytes
+        if self.drop_expired:
+            if time >= task.deadline:
+                task.dropped = True
+                self.dropped_tasks += 1
+                return
+            self.scheduler.schedule(task.deadline, DEADLINE, task)
+        self.server_queues[v].append(task)
+        self.queue_len[v] += 1
+        if self.in_service[v] is None:
+            self._start_service(v, time)
+
+    def _start_service(self, v, time):
+        hz = self.service_hz[v]
+        queue = self.server_queues[v]
+        while queue and hz > 0:
+            task = queue.popleft()
+            if task.dropped:
+                continue
+            self.in_service[v] = task
+            self.service_since[v] = time
+            self.service_version[v] += 1
+            self.scheduler.schedule(time + task.remaining_cycles / hz, SERVICE_DONE, (v, self.service_version[v]))
+            return
+
+    def _charge_service(self, v, time):
+        """Books the cycles and server energy of v's task in service up to `time`."""
+        hz = self.service_hz[v]
+        elapsed = time - self.service_since[v]
+        self.in_service[v].remaining_cycles -= elapsed * hz
+        # Simplified server energy
+        self._energy['server'] += 1e-24 * hz**2 * elapsed
+        self.service_since[v] = time
+
+    def _on_service_done(self, time, payload):
+        v, version = payload
+        if version != self.service_version[v]:
+            return # Rescheduled by a rate change
+        task = self.in_service[v]
+        self._charge_service(v, time)
+        self.in_service[v] = None
+        self.queue_len[v] -= 1
+        self._complete(task, time)
+        self._start_service(v, time)
+
+    def _on_deadline(self, time, task):
+        if task.dropped or task.completion_time >= 0 or self.in_service[task.vehicle_id] is task:
+            return
+        # Still waiting in the queue; removed from the deque when it reaches the head
+        task.dropped = True
+        self.dropped_tasks += 1
+        self.queue_len[task.vehicle_id] -= 1
+
+    def _set_service_rates(self, service_hz, time):
+        changed = np.flatnonzero((service_hz != self.service_hz) & (self.queue_len > 0)).tolist()
+        for v in changed:
+            if self.in_service[v] is not None:
+                self._charge_service(v, time)
+        self.service_hz = service_hz
+        for v in changed:
+            task = self.in_service[v]
+            if task is None:
+                self._start_service(v, time)
+                continue
+            self.service_version[v] += 1
+            if service_hz[v] > 0:
+                self.scheduler.schedule(time + task.remaining_cycles / service_hz[v], SERVICE_DONE, (v, self.service_version[v]))
+
+    def _update_vehicle_positions(self):
+        if self.dynamic_speed:
+            change_idx = np.flatnonzero(self.rng.random(self.num_vehicles) < 0.2) # 20% chance to change speed
+            if change_idx.size:
+                low, high = PARAMS['vehicle_speed_kmh']
+                self.speed_mps[change_idx] = (low + (high - low) * self.rng.random(change_idx.size)) * 1000 / 3600
+        self.position_m = (self.position_m + self.speed_mps) % self.road_length_m
+
+    def _flush_metrics(self):
+        if self._completed:
+            latencies, creation_times = np.array(self._completed).T
+            self.metrics.add_tasks(latencies, creation_times=creation_times)
+            self._completed = []
+        for phase, energy in self._energy.items():
+            if energy:
+                self.metrics.add_energy(phase, energy)
+                self._energy[phase] = 0.0
+
+    def step(self, actions):
+        """
+        Actions is an Action (or a {'w': offloading_ratios, 'a': allocation_ratios}
+        dict) with one ratio per vehicle. They hold for the whole slot.
+        """
+        actions = as_action(actions)
+        a_ratios = actions.a
+        total_server_alloc = a_ratios.sum()
+        if total_server_alloc > 1.0: # Normalize if agent gives invalid action
+            a_ratios = a_ratios / total_server_alloc
+        start = float(self.time_slot)
+        self.w_ratios = actions.w
+        self._set_service_rates(a_ratios * PARAMS['vec_server_cpu_freq_ghz'] * 1e9, start)
+        self._schedule_arrivals(start, start + 1)
+
+        handlers = self._handlers
+        for time, kind, payload in self.scheduler.pop_until(start + 1):
+            handlers[kind](time, payload)
+        self._flush_metrics()
+        self._update_vehicle_positions()
+        self.time_slot += 1
+        return self.get_state()
+
+    def state_dict(self):
+        """
+        Vehicles, live tasks, server queues and pending events as flat arrays,
+        plus the RNG and metrics state. Tasks are referred to by id.
+        """
+        tasks = {}
+        for queue in self.server_queues:
+            tasks.update((task.id, task) for task in queue)
+        tasks.update((task.id, task) for task in self.in_service if task is not None)
+        events = []
+        for time, seq, kind, payload in self.scheduler.heap: # Saved in heap order, so no re-heapify on load
+            if kind in TASK_EVENTS:
+                tasks[payload.id] = payload
+                payload = (payload.id, 0, 0)
+            elif kind == SERVICE_DONE:
+                payload = (*payload, 0)
+            events.append((time, seq, kind, *payload))
+        state = {
+            'speed_mps': self.speed_mps, 'position_m': self.position_m, 'load_bytes': np.array(self.load_bytes),
+            'local_free_at': np.array(self.local_free_at), 'uplink_free_at': np.array(self.uplink_free_at),
+            'queue_len': self.queue_len, 'service_since': np.array(self.service_since),
+            'service_version': np.array(self.service_version), 'service_hz': self.service_hz, 'w_ratios': self.w_ratios,
+            'in_service': np.array([-1 if task is None else task.id for task in self.in_service]),
+            'tasks': np.array([(t.id, t.vehicle_id, t.size_bytes, t.creation_time, t.remaining_cycles, t.dropped, t.completion_time)
+                               for t in tasks.values()], dtype=float).reshape(-1, 7),
+            'server_tasks': np.array([(v, task.id) for v, queue in enumerate(self.server_queues) for task in queue],
+                                     dtype=np.int64).reshape(-1, 2), # FIFO order within each queue
+            'events': np.array(events, dtype=float).reshape(-1, 6),
+            'time_slot': self.time_slot,
+            'task_id_counter': self.task_id_counter,
+            'dropped_tasks': self.dropped_tasks,
+            'events_processed': self.scheduler.processed,
+            'rng': rng_state(self.rng),
+        }
+        state.update(prefixed('metrics', self.metrics.state_dict()))
+        return state
+
+    def load_state_dict(self, state):
+        if state['position_m'].size != self.num_vehicles:
+            raise ValueError("Checkpoint has a different number of vehicles")
+        tasks = {}
+        for task_id, v, size_bytes, creation_time, remaining_cycles, dropped, completion_time in state['tasks'].tolist():
+            task = EventTask(int(task_id), int(v), size_bytes, creation_time)
+            task.remaining_cycles, task.dropped, task.completion_time = remaining_cycles, bool(dropped), completion_time
+            tasks[task.id] = task
+        self.speed_mps = state['speed_mps'].copy()
+        self.position_m = state['position_m'].copy()
+        self.load_bytes = state['load_bytes'].tolist()
+        self.local_free_at = state['local_free_at'].tolist()
+        self.uplink_free_at = state['uplink_free_at'].tolist()
+        self.queue_len = state['queue_len'].copy()
+        self.service_since = state['service_since'].tolist()
+        self.service_version = state['service_version'].tolist()
+        self.service_hz = state['service_hz'].copy()
+        self.w_ratios = state['w_ratios'].copy()
+        self.in_service = [None if task_id < 0 else tasks[task_id] for task_id in state['in_service'].tolist()]
+        self.server_queues = [deque() for _ in range(self.num_vehicles)]
+        for v, task_id in state['server_tasks'].tolist():
+            self.server_queues[v].append(tasks[task_id])
+
+        heap = []
+        for time, seq, kind, a, b, c in state['events'].tolist():
+            kind = int(kind)
+            if kind == TASK_ARRIVAL:
+                payload = (int(a), b, c)
+            elif kind == SERVICE_DONE:
+                payload = (int(a), int(b))
+            else:
+                payload = tasks[int(a)]
+            heap.append((time, int(seq), kind, payload))
+        self.scheduler = EventScheduler()
+        self.scheduler.heap = heap
+        # Only the order of sequence numbers matters: new events come after every pending one
+        self.scheduler._seq = itertools.count(max((event[1] for event in heap), default=-1) + 1)
+        self.scheduler.now = float(state['time_slot'])
+        self.scheduler.processed = state['events_processed']
+
+        self.time_slot = state['time_slot']
+        self.task_id_counter = state['task_id_counter']
+        self.dropped_tasks = state['dropped_tasks']
+        set_rng_state(self.rng, state['rng'])
+        self.metrics.load_state_dict(unprefixed('metrics', state))
+
+    def get_channel_gain(self, idx=None):
+        return channel_gain(self.position_m if idx is None else self.position_m[idx])
+
+    def get_vehicle_arrays(self):
+        """(position_m, speed_mps, task_load_bytes) arrays, one entry per vehicle."""
+        # Clip the rounding residue of adding and removing task sizes
+        return self.position_m, self.speed_mps, np.maximum(np.array(self.load_bytes), 0.0)
+
+    def get_state(self):
+        position_m, speed_mps, load_bytes = self.get_vehicle_arrays()
+        return Observation(self.time_slot, position_m.copy(), speed_mps.copy(), load_bytes, self.get_channel_gain(),
+                           self.queue_len.copy())
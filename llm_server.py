@@ -0,0 +1,220 @@
+# llm_server.py
+"""
+Local stand-in for the OpenAI chat-completions API, answered by
+mock_llm.query_llm_orchestrator, for load-testing the orchestration path
+without paying for real calls.
+
+    python llm_server.py --port 8000 --latency lognormal --latency-ms 800 --rate-429 0.05 --malformed-rate 0.02
+    OPENAI_BASE_URL=http://127.0.0.1:8000/v1 python main.py
+
+The state is read back out of the user prompt (JSON or compact format).
+Injected faults: a latency drawn per request, 429 responses (at random with
+--rate-429, or above --rpm requests per minute) and truncated JSON content.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from environment import Observation
+from mock_llm import query_llm_orchestrator
+
+LATENCY_DISTRIBUTIONS = ('none', 'fixed', 'uniform', 'exponential', 'lognormal')
+
+DEFAULT_SERVER_CONFIG = {
+    'latency': 'lognormal',     # One of LATENCY_DISTRIBUTIONS
+    'latency_ms': 500.0,        # Mean injected latency
+    'latency_sigma': 0.5,       # Shape of the lognormal distribution
+    'rate_429': 0.0,            # Probability of answering 429 regardless of load
+    'rpm': None,                # Requests per minute above which requests get a 429
+    'retry_after_s': 1,
+    'malformed_rate': 0.0,      # Probability of returning truncated JSON content
+    'seed': None,
+}
+
+_GOAL_RE = re.compile(r'Strategic Goal: "(\w+)"')
+_PLAN_RE = re.compile(r'with exactly (\d+) entries')
+
+def sample_latency_s(config, rng):
+    mean_s = config['latency_ms'] / 1000.0
+    kind = config['latency']
+    if kind == 'none' or mean_s <= 0:
+        return 0.0
+    if kind == 'fixed':
+        return mean_s
+    if kind == 'uniform':
+        return rng.uniform(0, 2 * mean_s)
+    if kind == 'exponential':
+        return rng.exponential(mean_s)
+    if kind == 'lognormal':
+        sigma = config['latency_sigma']
+        return rng.lognormal(np.log(mean_s) - sigma**2 / 2, sigma)
+    raise ValueError(f"Unknown latency distribution: {kind}")
+
+def state_from_prompt(user_prompt):
+    """Recovers the state, as an Observation, from a JSON-format or compact-format user prompt."""
+    start = user_prompt.index('{', user_prompt.index('Current State'))
+    encoded, _ = json.JSONDecoder().raw_decode(user_prompt, start)
+    if 'vehicles' in encoded:
+        return Observation.from_dict(encoded)
+    # Compact columnar encoding
+    def column(key):
+        return np.asarray(encoded[key], dtype=float)
+    return Observation(encoded['t'], column('pos_m'), column('speed_mps'), column('load_bytes'), 10 ** (column('gain_db') / 10),
+                       np.asarray(encoded['queue']))
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config=None):
+        super().__init__(address, StandInHandler)
+        self.config = {**DEFAULT_SERVER_CONFIG, **(config or {})}
+        self.rng = np.random.default_rng(self.config['seed'])
+        self.lock = threading.Lock()
+        self.recent_requests = deque()
+        self.stats = {'requests': 0, 'ok': 0, 'rate_limited': 0, 'malformed': 0, 'bad_request': 0}
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def admit(self):
+        """Draws this request's fate under the lock: (rate_limited, malformed, latency_s)."""
+        config = self.config
+        with self.lock:
+            self.stats['requests'] += 1
+            now = time.monotonic()
+            while self.recent_requests and now - self.recent_requests[0] > 60:
+                self.recent_requests.popleft()
+            over_rpm = config['rpm'] is not None and len(self.recent_requests) >= config['rpm']
+            if over_rpm or self.rng.random() < config['rate_429']:
+                self.stats['rate_limited'] += 1
+                return True, False, 0.0
+            self.recent_requests.append(now)
+            malformed = self.rng.random() < config['malformed_rate']
+            return False, malformed, sample_latency_s(config, self.rng)
+
+    def decide(self, state, semantic_goal, horizon):
+        # mock_llm draws from its rng, which is not thread-safe
+        with self.lock:
+            if horizon is None:
+                return query_llm_orchestrator(state, None, semantic_goal, rng=self.rng).to_dict()
+            return {'plan': [query_llm_orchestrator(state, None, semantic_goal, rng=self.rng).to_dict() for _ in range(horizon)]}
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, so client connection pooling behaves as against the real API
+    disable_nagle_algorithm = True # Headers and body go out in separate writes
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status, message, error_type, headers=None):
+        self._send_json(status, {'error': {'message': message, 'type': error_type, 'param': None, 'code': None}}, headers)
+
+    def do_POST(self):
+        server = self.server
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError:
+            with server.lock:
+                server.stats['bad_request'] += 1
+            self._send_error(400, "Request body is not valid JSON", 'invalid_request_error')
+            return
+        if self.path.rstrip('/') not in ('/v1/chat/completions', '/chat/completions'):
+            self._send_error(404, f"Unknown path {self.path}", 'invalid_request_error')
+            return
+
+        rate_limited, malformed, latency_s = server.admit()
+        if rate_limited:
+            self._send_error(429, "Rate limit reached for requests", 'requests',
+                             {'Retry-After': str(server.config['retry_after_s'])})
+            return
+
+        messages = request.get('messages', [])
+        system_prompt = next((m['content'] for m in messages if m['role'] == 'system'), '')
+        user_prompt = next((m['content'] for m in reversed(messages) if m['role'] == 'user'), '')
+        try:
+            state = state_from_prompt(user_prompt)
+        except (ValueError, KeyError):
+            with server.lock:
+                server.stats['bad_request'] += 1
+            self._send_error(400, "Could not find the state in the prompt", 'invalid_request_error')
+            return
+        goal = _GOAL_RE.search(user_prompt)
+        plan = _PLAN_RE.search(system_prompt)
+        decision = server.decide(state, goal.group(1) if goal else "BALANCE", int(plan.group(1)) if plan else None)
+
+        time.sleep(latency_s)
+        content = json.dumps(decision)
+        if malformed:
+            content = content[:len(content) // 2]
+        with server.lock:
+            server.stats['malformed' if malformed else 'ok'] += 1
+
+        prompt_tokens = sum(len(m['content']) for m in messages) // 4 + 1
+        completion_tokens = len(content) // 4 + 1
+        self._send_json(200, {
+            'id': f"chatcmpl-{uuid.uuid4().hex}",
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'stand-in'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        })
+
+def start_server(host="127.0.0.1", port=0, config=None):
+    """Starts a StandInServer on a background thread; port 0 picks a free port. Stop it with shutdown()."""
+    server = StandInServer((host, port), config)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def add_server_arguments(parser):
+    parser.add_argument('--latency', choices=LATENCY_DISTRIBUTIONS, default=DEFAULT_SERVER_CONFIG['latency'])
+    parser.add_argument('--latency-ms', type=float, default=DEFAULT_SERVER_CONFIG['latency_ms'], help="Mean injected latency")
+    parser.add_argument('--latency-sigma', type=float, default=DEFAULT_SERVER_CONFIG['latency_sigma'], help="Lognormal shape")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="Probability of a 429 response")
+    parser.add_argument('--rpm', type=int, help="Answer 429 above this many requests per minute")
+    parser.add_argument('--malformed-rate', type=float, default=0.0, help="Probability of truncated JSON content")
+    parser.add_argument('--server-seed', type=int, help="Seed for injected faults and mock decisions")
+
+def server_config(args):
+    return {
+        'latency': args.latency, 'latency_ms': args.latency_ms, 'latency_sigma': args.latency_sigma,
+        'rate_429': args.rate_429, 'rpm': args.rpm, 'malformed_rate': args.malformed_rate, 'seed': args.server_seed,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8000)
+    add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
+    server = StandInServer((args.host, args.port), server_config(args))
+    print(f"Serving chat completions at {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+# loadgen.py
+"""
+Load generator for the async orchestration path. Fires decision requests at
+an OpenAI-compatible endpoint through real_llm (prompt build, pooled client,
+retries, parsing) and reports end-to-end decision latency and requests/s.
+
+    python loadgen.py --requests 500 --concurrency 32 --latency-ms 800 --rate-429 0.05
+    python loadgen.py --base-url http://127.0.0.1:8000/v1 --requests 200 --concurrency 8
+    python loadgen.py --requests 300 --concurrency 32 --rpm 600 --client-rpm 600
+
+Without --base-url a local llm_server.py is started in-process with the given
+fault settings. The decision cache is disabled so every request goes out.
+--client-rpm/--client-tpm pace requests with real_llm.RequestScheduler; the
+report includes its retry, wait and fallback counts.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import time
+import numpy as np
+from config import PARAMS
+import real_llm
+import llm_server
+from environment import ArrayVECEnvironment
+from pdt import PredictiveDigitalTwin
+
+def make_states(num_vehicles, num_states, seed=0):
+    """A pool of (state, forecasts) pairs from consecutive slots of a simulation."""
+    env = ArrayVECEnvironment(num_vehicles, rng=np.random.default_rng(seed))
+    pdt = PredictiveDigitalTwin(env, rng=np.random.default_rng(seed + 1))
+    samples = []
+    for _ in range(num_states):
+        samples.append((env.get_state(), pdt.forecast()))
+        env.step(real_llm.get_default_action(num_vehicles))
+    return samples
+
+async def _decide(state, forecasts, semantic_goal, fallback):
+    num_vehicles = state.num_vehicles
+    start = time.perf_counter()
+    decision = await real_llm._query_async(state, forecasts, semantic_goal, semantic_goal, None,
+                                           lambda content: real_llm.parse_orchestrator_response(content, num_vehicles),
+                                           fallback)
+    return time.perf_counter() - start, decision is fallback
+
+async def generate_load(samples, num_requests, concurrency, semantic_goal="BALANCE"):
+    """
+    Closed loop: `concurrency` workers each issue their next request as soon as
+    the previous one returns, so latencies do not include client-side queueing.
+    """
+    fallback = object()
+    results = []
+    next_request = iter(range(num_requests))
+
+    async def worker():
+        for i in next_request:
+            results.append(await _decide(*samples[i % len(samples)], semantic_goal, fallback))
+
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall_s = time.perf_counter() - start
+    finally:
+        await real_llm.close_async_client()
+    return wall_s, results
+
+def summarize(wall_s, results):
+    latencies_ms = np.array([latency_s for latency_s, _ in results]) * 1000
+    fallbacks = sum(fell_back for _, fell_back in results)
+    return {
+        'requests': len(results),
+        'concurrency': PARAMS['llm_max_concurrency'],
+        'wall_s': wall_s,
+        'requests_per_s': len(results) / wall_s,
+        'fallbacks': fallbacks,
+        'fallback_rate': fallbacks / len(results),
+        'latency_ms': {
+            'mean': float(latencies_ms.mean()),
+            'p50': float(np.percentile(latencies_ms, 50)),
+            'p90': float(np.percentile(latencies_ms, 90)),
+            'p99': float(np.percentile(latencies_ms, 99)),
+            'max': float(latencies_ms.max()),
+        },
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--base-url', help="Target endpoint; default starts a local stand-in server")
+    parser.add_argument('--api-key', help="API key for --base-url (defaults to OPENAI_API_KEY)")
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=PARAMS['llm_max_concurrency'])
+    parser.add_argument('--max-retries', type=int, default=PARAMS['llm_max_retries'])
+    parser.add_argument('--timeout-s', type=float, default=PARAMS['llm_request_timeout_s'])
+    parser.add_argument('--client-rpm', type=float, default=PARAMS['llm_rate_limit_rpm'],
+                        help="Pace requests client-side to this many per minute")
+    parser.add_argument('--client-tpm', type=float, default=PARAMS['llm_rate_limit_tpm'],
+                        help="Pace requests client-side to this many tokens per minute")
+    parser.add_argument('--deadline-s', type=float, default=PARAMS['llm_decision_deadline_s'],
+                        help="Fall back when a decision takes longer, retries included")
+    parser.add_argument('--cooldown-s', type=float, default=PARAMS['llm_rate_limit_cooldown_s'],
+                        help="Longest a 429 holds back the other requests")
+    parser.add_argument('--vehicles', type=int, default=20)
+    parser.add_argument('--states', type=int, default=50, help="Distinct states cycled through")
+    parser.add_argument('--goal', default="BALANCE")
+    parser.add_argument('--prompt-format', choices=['compact', 'json'], default=PARAMS['llm_prompt_format'])
+    llm_server.add_server_arguments(parser)
+    args = parser.parse_args(argv)
+
+    PARAMS.update({
+        'llm_max_concurrency': args.concurrency, 'llm_max_retries': args.max_retries,
+        'llm_request_timeout_s': args.timeout_s, 'llm_prompt_format': args.prompt_format,
+        'llm_rate_limit_rpm': args.client_rpm, 'llm_rate_limit_tpm': args.client_tpm,
+        'llm_decision_deadline_s': args.deadline_s, 'llm_rate_limit_cooldown_s': args.cooldown_s,
+    })
+    real_llm.decision_cache = None
+    server = None
+    if args.base_url:
+        real_llm.configure_client(args.api_key or real_llm.OPENAI_API_KEY, args.base_url)
+    else:
+        server = llm_server.start_server(config=llm_server.server_config(args))
+        real_llm.configure_client(None, server.base_url)
+
+    samples = make_states(args.vehicles, args.states)
+    try:
+        # real_llm logs every request; keep the report readable
+        with contextlib.redirect_stdout(io.StringIO()):
+            wall_s, results = asyncio.run(generate_load(samples, args.requests, args.concurrency, args.goal))
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    report = summarize(wall_s, results)
+    report['max_retries'] = args.max_retries
+    report['scheduler'] = real_llm.scheduler.summary()
+    if server is not None:
+        report['server'] = {'config': server.config, 'stats': server.stats}
+    print(json.dumps(report, indent=2))
+
+if __name__ == "__main__":
+    main()
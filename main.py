@@ -1,95 +1,601 @@
 # main.py
-from environment import VECEnvironment
-from agents import SP_LLM_Agent, LLM_DT_Agent, S_MARL_Agent, GreedyAgent
+import argparse
+import contextlib
+import csv
+import json
+import math
+import os
+import sys
+import zlib
+import numpy as np
+from environment import VECEnvironment, VectorVECEnv, EnvReplicas, EventVECEnvironment, MultiRSUEnvironment
+from agents import SP_LLM_Agent, LLM_DT_Agent, S_MARL_Agent, GreedyAgent, ReplayAgent, SurrogateAgent
 from pdt import PredictiveDigitalTwin
 from config import PARAMS
-from results_handler import ResultsHandler
+from backends import BACKENDS, LLMUsage, close_backends, get_backend, loaded_backend
+from tracing import tracer
+from checkpoint import save_checkpoint, load_checkpoint, prefixed, unprefixed
+from decision_log import DecisionLog, DecisionReplay, prompt_hash
+# asyncio, the process pool, real_llm (openai) and results_handler (pandas,
+# tabulate) are imported where they are used, so baseline runs and pool workers start without them
+
+AGENT_CLASSES = {
+    "SP-LLM": SP_LLM_Agent,
+    "LLM-DT": LLM_DT_Agent,
+    "S-MARL": S_MARL_Agent,
+    "GO": GreedyAgent,
+    "SP-LLM-S": SurrogateAgent,
+}
 
 def run_simulation(env, agent, semantic_goal="BALANCE"):
-    state = env.get_state()
+    with tracer.span('env.get_state'):
+        state = env.get_state()
     for _ in range(PARAMS['simulation_time_slots']):
-        actions = agent.act(state, semantic_goal)
-        state = env.step(actions)
+        with tracer.span('agent.act'):
+            actions = agent.act(state, semantic_goal)
+        with tracer.span('env.step'):
+            state = env.step(actions)
     return env.metrics
 
-def run_scenario_1(results_handler):
-    agent_classes = {
-        "SP-LLM": SP_LLM_Agent,
-        "LLM-DT": LLM_DT_Agent,
-        "S-MARL": S_MARL_Agent,
-        "GO": GreedyAgent,
-    }
+def cell_seeds(master_seed, scenario_name, agent_name, params, num_replicas):
+    """
+    One SeedSequence per replica of a cell, derived from the master seed and
+    the cell's identity, so a replica's streams do not depend on which other
+    cells or replicas run, in what order, or in which process.
+    With no master seed the run draws fresh entropy and is not reproducible.
+    """
+    if master_seed is None:
+        return np.random.SeedSequence().spawn(num_replicas)
+    cell_key = zlib.crc32(f"{scenario_name}|{agent_name}|{sorted(params.items())}".encode())
+    return [np.random.SeedSequence(master_seed, spawn_key=(cell_key, r)) for r in range(num_replicas)]
+
+ENGINES = ('array', 'event', 'object')
+
+def _make_envs(n_vehicles, dynamic_speed, env_seeds):
+    """
+    The replicas' environments for PARAMS['engine']: one batched VectorVECEnv,
+    or one EventVECEnvironment or original per-object VECEnvironment each.
+    With PARAMS['num_rsus'] > 1 each replica is a MultiRSUEnvironment instead
+    (array engine only).
+    """
+    if PARAMS['num_rsus'] > 1:
+        if PARAMS['engine'] != 'array':
+            raise ValueError("Roads with several RSUs run on the array engine only")
+        return EnvReplicas([MultiRSUEnvironment(n_vehicles, dynamic_speed=dynamic_speed, rng=np.random.default_rng(seed))
+                            for seed in env_seeds])
+    if PARAMS['engine'] == 'array':
+        return VectorVECEnv(len(env_seeds), n_vehicles, dynamic_speed=dynamic_speed, seed=env_seeds)
+    if PARAMS['engine'] == 'event':
+        return EnvReplicas([EventVECEnvironment(n_vehicles, dynamic_speed=dynamic_speed, rng=np.random.default_rng(seed),
+                                                task_rate_hz=PARAMS['event_task_rate_hz'], drop_expired=PARAMS['event_drop_expired'])
+                            for seed in env_seeds])
+    if PARAMS['engine'] == 'object':
+        return EnvReplicas([VECEnvironment(n_vehicles, dynamic_speed=dynamic_speed, rng=np.random.default_rng(seed))
+                            for seed in env_seeds])
+    raise ValueError(f"Unknown engine {PARAMS['engine']!r}; choose one of {ENGINES}")
+
+def _make_replicas(AgentClass, n_vehicles, dynamic_speed, seeds, agent_kwargs=None):
+    # Each replica gets independent environment, pDT and agent streams
+    streams = [seed.spawn(3) for seed in seeds]
+    venv = _make_envs(n_vehicles, dynamic_speed, [env_seed for env_seed, _, _ in streams])
+    views = [venv.replica(r) for r in range(venv.num_replicas)]
+    agent_kwargs = agent_kwargs or [{}] * len(seeds)
+    agents = [
+        AgentClass(view, pdt=PredictiveDigitalTwin(view, rng=np.random.default_rng(pdt_seed)), rng=np.random.default_rng(agent_seed), **kwargs)
+        for view, (_, pdt_seed, agent_seed), kwargs in zip(views, streams, agent_kwargs)
+    ]
+    return venv, views, agents
+
+# PARAMS['decision_log_dir'] records every LLM agent decision; PARAMS['decision_replay_dir']
+# runs LLM agent cells from such a log instead of the API. Opened once per process.
+_decision_logs = {}
+_decision_replays = {}
+
+def _decision_log():
+    path = PARAMS['decision_log_dir']
+    if path and path not in _decision_logs:
+        _decision_logs[path] = DecisionLog(path)
+    return _decision_logs.get(path)
+
+def _decision_replay():
+    path = PARAMS['decision_replay_dir']
+    if path and path not in _decision_replays:
+        _decision_replays[path] = DecisionReplay(path)
+    return _decision_replays.get(path)
+
+def _log_decisions(decision_keys, slot, agents, actions, semantic_goal, prompt_hashes):
+    """Appends one row per replica; prompt_hashes memoizes the hash of each agent's last query."""
+    log = _decision_log()
+    for r, (key, agent, action) in enumerate(zip(decision_keys, agents, actions)):
+        query = agent.last_query
+        if prompt_hashes[r] is None or prompt_hashes[r][0] is not query:
+            prompt_hashes[r] = (query, prompt_hash(*query) if query else "")
+        log.append(*key, slot, query[2] if query else semantic_goal, prompt_hashes[r][1], action)
+
+def _seed_ids(seeds):
+    return [[str(seed.entropy), list(seed.spawn_key)] for seed in seeds]
+
+def _scheduler_state():
+    # The real backend's spend and request totals are process-wide; every checkpoint carries them
+    real = loaded_backend('real')
+    return prefixed('scheduler', real.llm.scheduler.state_dict()) if real is not None else {}
+
+def _restore_scheduler(state):
+    scheduler_state = unprefixed('scheduler', state)
+    if scheduler_state:
+        get_backend('real').llm.scheduler.load_state_dict(scheduler_state)
+
+def _save_replicas(path, slot, seeds, venv, agents, peak_violation):
+    # Logged decisions must not lag behind the checkpoint they would be resumed from
+    if _decision_log() is not None:
+        _decision_log().flush()
+    state = {'slot': slot, 'seeds': _seed_ids(seeds), 'peak_violation': peak_violation, **_scheduler_state()}
+    state.update(prefixed('env', venv.state_dict()))
+    for r, agent in enumerate(agents):
+        state.update(prefixed(f'agent{r}', agent.state_dict()))
+        state.update(prefixed(f'pdt{r}', agent.pdt.state_dict()))
+    save_checkpoint(path, state)
+
+def _resume_replicas(path, seeds, venv, agents, peak_violation):
+    """Restores replicas from their checkpoint, if any; returns the slot to continue from."""
+    if path is None or not os.path.exists(path):
+        return 0
+    state = load_checkpoint(path)
+    if state['seeds'] != _seed_ids(seeds):
+        return 0 # Left behind by a run with another seed
+    venv.load_state_dict(unprefixed('env', state))
+    for r, agent in enumerate(agents):
+        agent.load_state_dict(unprefixed(f'agent{r}', state))
+        agent.pdt.load_state_dict(unprefixed(f'pdt{r}', state))
+    peak_violation[:] = state['peak_violation']
+    _restore_scheduler(state)
+    return state['slot']
+
+def _checkpoint_due(checkpoint_path, slot, num_slots):
+    return checkpoint_path is not None and slot % PARAMS['checkpoint_every'] == 0 and slot < num_slots
+
+def _replica_metrics(venv, agents, peak_violation, track_peak):
+    metrics = venv.get_metrics()
+    if track_peak:
+        metrics['peak_violation_rate'] = peak_violation
+    if getattr(agents[0], 'plan_mode', False):
+        for key in ['decisions', 'plan_requests', 'exhausted_replans', 'divergence_replans', 'fleet_replans']:
+            metrics[key] = np.array([agent.plan_stats[key] for agent in agents])
+    if agents[0].llm_usage is not None:
+        for field in LLMUsage.FIELDS:
+            metrics[f'llm_{field}'] = np.array([getattr(agent.llm_usage, field) for agent in agents], dtype=float)
+    return metrics
+
+def run_replicas(AgentClass, n_vehicles, num_slots, semantic_goal="BALANCE", dynamic_speed=False, track_peak=False, seeds=None,
+                 checkpoint_path=None, agent_kwargs=None, decision_keys=None):
+    """
+    Runs independent replicas of one scenario cell in a single VectorVECEnv
+    (or, with PARAMS['engine'] = 'event', one EventVECEnvironment per replica),
+    with one agent and pDT per replica: one replica per entry of `seeds`, or
+    PARAMS['num_replicas'] freshly seeded ones.
+    With a checkpoint_path the run resumes from that file if it exists and
+    saves to it every PARAMS['checkpoint_every'] slots.
+    `agent_kwargs` holds extra constructor arguments per replica. With
+    `decision_keys`, one (scenario, agent, params, replica) key per replica,
+    every decision is appended to the decision log.
+    Returns a dict of per-replica metric arrays.
+    """
+    seeds = seeds if seeds is not None else np.random.SeedSequence().spawn(PARAMS['num_replicas'])
+    venv, views, agents = _make_replicas(AgentClass, n_vehicles, dynamic_speed, seeds, agent_kwargs)
+    peak_violation = np.zeros(venv.num_replicas)
+    prompt_hashes = [None] * venv.num_replicas
+    for t in range(_resume_replicas(checkpoint_path, seeds, venv, agents, peak_violation), num_slots):
+        actions = []
+        for agent, view in zip(agents, views):
+            with tracer.span('env.get_state'):
+                state = view.get_state()
+            with tracer.span('agent.act'):
+                actions.append(agent.act(state, semantic_goal))
+        if decision_keys:
+            _log_decisions(decision_keys, venv.time_slot, agents, actions, semantic_goal, prompt_hashes)
+        with tracer.span('env.step'):
+            venv.step(actions)
+        # Simplified peak calculation over the last completed tasks
+        if track_peak and t > 10:
+            peak_violation = np.maximum(peak_violation, venv.recent_violation_rate())
+        if _checkpoint_due(checkpoint_path, t + 1, num_slots):
+            with tracer.span('checkpoint.save'):
+                _save_replicas(checkpoint_path, t + 1, seeds, venv, agents, peak_violation)
+    if decision_keys:
+        _decision_log().flush()
+    return _replica_metrics(venv, agents, peak_violation, track_peak)
+
+async def _act_async(agent, view, semantic_goal):
+    with tracer.span('env.get_state'):
+        state = view.get_state()
+    with tracer.span('agent.act'):
+        return await agent.act_async(state, semantic_goal)
+
+async def run_replicas_async(AgentClass, n_vehicles, num_slots, semantic_goal="BALANCE", dynamic_speed=False, track_peak=False,
+                             seeds=None, checkpoint_path=None, agent_kwargs=None, decision_keys=None):
+    """Same as run_replicas, but the replicas' decisions for a slot are awaited concurrently."""
+    import asyncio
+    seeds = seeds if seeds is not None else np.random.SeedSequence().spawn(PARAMS['num_replicas'])
+    venv, views, agents = _make_replicas(AgentClass, n_vehicles, dynamic_speed, seeds, agent_kwargs)
+    peak_violation = np.zeros(venv.num_replicas)
+    prompt_hashes = [None] * venv.num_replicas
+    for t in range(_resume_replicas(checkpoint_path, seeds, venv, agents, peak_violation), num_slots):
+        actions = await asyncio.gather(*(_act_async(agent, view, semantic_goal) for agent, view in zip(agents, views)))
+        if decision_keys:
+            _log_decisions(decision_keys, venv.time_slot, agents, actions, semantic_goal, prompt_hashes)
+        with tracer.span('env.step'):
+            venv.step(actions)
+        if track_peak and t > 10:
+            peak_violation = np.maximum(peak_violation, venv.recent_violation_rate())
+        if _checkpoint_due(checkpoint_path, t + 1, num_slots):
+            with tracer.span('checkpoint.save'):
+                _save_replicas(checkpoint_path, t + 1, seeds, venv, agents, peak_violation)
+    if decision_keys:
+        _decision_log().flush()
+    return _replica_metrics(venv, agents, peak_violation, track_peak)
+
+# Each scenario is a list of cells: (scenario_name, agent_name, recorded params, run_replicas kwargs)
+# `agents` replaces a scenario's own agent list
+def scenario_1_cells(agents=None):
+    cells = []
     for n_vehicles in PARAMS['num_vehicles_range']:
-        for agent_name, AgentClass in agent_classes.items():
-            env = VECEnvironment(num_vehicles=n_vehicles)
-            pdt = PredictiveDigitalTwin(env)
-            agent = AgentClass(env, pdt=pdt)
-            run_simulation(env, agent)
-            
-            metrics = results_handler.calculate_metrics(env)
-            params = {'num_vehicles': n_vehicles}
-            results_handler.record('scenario_1', agent_name, params, metrics)
+        for agent_name in agents or ["SP-LLM", "LLM-DT", "S-MARL", "GO"]:
+            cells.append(('scenario_1', agent_name, {'num_vehicles': n_vehicles},
+                          {'n_vehicles': n_vehicles, 'num_slots': PARAMS['simulation_time_slots']}))
+    return cells
 
-def run_scenario_2(results_handler):
+def scenario_2_cells(agents=None):
     n_vehicles = 20 # Fixed number for this scenario
-    agent_classes = {"SP-LLM": SP_LLM_Agent, "LLM-DT": LLM_DT_Agent}
-    
-    for agent_name, AgentClass in agent_classes.items():
-        env = VECEnvironment(num_vehicles=n_vehicles, dynamic_speed=True)
-        pdt = PredictiveDigitalTwin(env)
-        agent = AgentClass(env, pdt=pdt)
-        
-        peak_violation = 0
-        for t in range(PARAMS['simulation_time_slots']):
-            actions = agent.act(env.get_state())
-            env.step(actions)
-            # Simplified peak calculation
-            if t > 10 and len(env.metrics['completed_tasks']) > 0:
-                violations_last_10 = sum(1 for task in env.metrics['completed_tasks'][-10:] if (task.completion_time - task.creation_time) > (PARAMS['task_deadline_ms']/1000.0))
-                rate = violations_last_10 / 10 * 100
-                if rate > peak_violation:
-                    peak_violation = rate
-        
-        metrics = results_handler.calculate_metrics(env)
-        metrics['peak_violation_rate'] = peak_violation
-        params = {'num_vehicles': n_vehicles}
-        results_handler.record('scenario_2', agent_name, params, metrics)
+    return [
+        ('scenario_2', agent_name, {'num_vehicles': n_vehicles},
+         {'n_vehicles': n_vehicles, 'num_slots': PARAMS['simulation_time_slots'], 'dynamic_speed': True, 'track_peak': True})
+        for agent_name in agents or ["SP-LLM", "LLM-DT"]
+    ]
 
-def run_scenario_3(results_handler):
+def scenario_3_cells(agents=None):
     n_vehicles = 20
-    agent_classes = {"SP-LLM": SP_LLM_Agent, "LLM-DT": LLM_DT_Agent, "S-MARL": S_MARL_Agent}
-    
-    for agent_name, AgentClass in agent_classes.items():
-        # Phase 1
-        env1 = VECEnvironment(num_vehicles=n_vehicles)
-        pdt1 = PredictiveDigitalTwin(env1)
-        agent1 = AgentClass(env1, pdt=pdt1)
-        for _ in range(PARAMS['simulation_time_slots'] // 2):
-            actions = agent1.act(env1.get_state(), semantic_goal="BALANCE")
-            env1.step(actions)
-        metrics1 = results_handler.calculate_metrics(env1)
-        results_handler.record('scenario_3', agent_name, {'phase': 1}, metrics1)
-
-        # Phase 2
-        env2 = VECEnvironment(num_vehicles=n_vehicles)
-        pdt2 = PredictiveDigitalTwin(env2)
-        agent2 = AgentClass(env2, pdt=pdt2)
-        for _ in range(PARAMS['simulation_time_slots'] // 2):
-            # SP-LLM adapts, others don't
-            goal = "SAVE_ENERGY" if agent_name == "SP-LLM" else "BALANCE"
-            actions = agent2.act(env2.get_state(), semantic_goal=goal)
-            env2.step(actions)
-        metrics2 = results_handler.calculate_metrics(env2)
-        results_handler.record('scenario_3', agent_name, {'phase': 2}, metrics2)
+    cells = []
+    for agent_name in agents or ["SP-LLM", "LLM-DT", "S-MARL"]:
+        # Phase 2: SP-LLM adapts, others don't
+        for phase, goal in [(1, "BALANCE"), (2, "SAVE_ENERGY" if agent_name == "SP-LLM" else "BALANCE")]:
+            cells.append(('scenario_3', agent_name, {'phase': phase},
+                          {'n_vehicles': n_vehicles, 'num_slots': PARAMS['simulation_time_slots'] // 2, 'semantic_goal': goal}))
+    return cells
 
-if __name__ == "__main__":
+def _seeds_for(cell, master_seed, replicas=None):
+    """Seeds of a range of the cell's replicas, by default the first PARAMS['num_replicas']."""
+    scenario_name, agent_name, params, _ = cell
+    replicas = replicas if replicas is not None else range(PARAMS['num_replicas'])
+    return cell_seeds(master_seed, scenario_name, agent_name, params, replicas.stop)[replicas.start:]
+
+# With PARAMS['checkpoint_dir'] set, each cell (or, on the process pool, each
+# replica of a cell, and with adaptive replication each batch of replicas)
+# checkpoints to its own file while it runs. A finished cell
+# replaces it with a .done file holding its metrics, which a resumed run reads
+# back instead of running the cell again.
+def _checkpoint_path(cell, replicas=None):
+    if not PARAMS['checkpoint_dir']:
+        return None
+    scenario_name, agent_name, params, _ = cell
+    name = "_".join([scenario_name, agent_name] + [f"{k}{v}" for k, v in sorted(params.items())])
+    if replicas is not None:
+        name += f"_r{replicas.start}" if len(replicas) == 1 else f"_r{replicas.start}-{replicas.stop - 1}"
+    return os.path.join(PARAMS['checkpoint_dir'], name + ".npz")
+
+def _done_path(checkpoint_path):
+    return checkpoint_path[:-len(".npz")] + ".done.npz"
+
+def _load_done(checkpoint_path, seeds):
+    if checkpoint_path is None or not os.path.exists(_done_path(checkpoint_path)):
+        return None
+    state = load_checkpoint(_done_path(checkpoint_path))
+    if state['seeds'] != _seed_ids(seeds):
+        return None
+    _restore_scheduler(state)
+    return unprefixed('metrics', state)
+
+def _save_done(checkpoint_path, seeds, metrics):
+    if checkpoint_path is None:
+        return
+    save_checkpoint(_done_path(checkpoint_path), {'seeds': _seed_ids(seeds), **prefixed('metrics', metrics), **_scheduler_state()})
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+def agent_class_for(agent_name):
+    """The agent class a cell runs with: LLM agents are replaced by ReplayAgent when replaying a decision log."""
+    AgentClass = AGENT_CLASSES[agent_name]
+    if not AgentClass.queries_llm():
+        return AgentClass
+    if PARAMS['llm_backend'] == 'replay' and not PARAMS['decision_replay_dir']:
+        raise ValueError("The replay backend needs PARAMS['decision_replay_dir']")
+    return ReplayAgent if PARAMS['llm_backend'] == 'replay' or PARAMS['decision_replay_dir'] else AgentClass
+
+def _cell_agents(cell, replicas):
+    """(AgentClass, agent_kwargs, decision_keys) for run_replicas, given the range of replica indices being run."""
+    scenario_name, agent_name, params, _ = cell
+    AgentClass = agent_class_for(agent_name)
+    agent_kwargs, decision_keys = None, None
+    if AgentClass is ReplayAgent:
+        agent_kwargs = [{'decisions': _decision_replay().decisions_for(scenario_name, agent_name, params, r)} for r in replicas]
+    elif AgentClass.queries_llm() and _decision_log() is not None:
+        decision_keys = [(scenario_name, agent_name, params, r) for r in replicas]
+    return AgentClass, agent_kwargs, decision_keys
+
+# `replicas` is the range of replica indices `seeds` belongs to when the cell
+# runs in parts (one replica per task on the process pool, or adaptive batches)
+def _run_cell(cell, seeds, replicas=None):
+    scenario_name, agent_name, _, kwargs = cell
+    checkpoint_path = _checkpoint_path(cell, replicas)
+    metrics = _load_done(checkpoint_path, seeds)
+    if metrics is None:
+        AgentClass, agent_kwargs, decision_keys = _cell_agents(cell, replicas if replicas is not None else range(len(seeds)))
+        with tracer.span('cell', scenario=scenario_name, agent=agent_name, replicas=len(seeds)):
+            metrics = run_replicas(AgentClass, seeds=seeds, checkpoint_path=checkpoint_path,
+                                   agent_kwargs=agent_kwargs, decision_keys=decision_keys, **kwargs)
+        _save_done(checkpoint_path, seeds, metrics)
+    return metrics
+
+async def _run_cell_async(cell, seeds, replicas=None):
+    scenario_name, agent_name, _, kwargs = cell
+    checkpoint_path = _checkpoint_path(cell, replicas)
+    metrics = _load_done(checkpoint_path, seeds)
+    if metrics is None:
+        AgentClass, agent_kwargs, decision_keys = _cell_agents(cell, replicas if replicas is not None else range(len(seeds)))
+        with tracer.span('cell', scenario=scenario_name, agent=agent_name, replicas=len(seeds)):
+            metrics = await run_replicas_async(AgentClass, seeds=seeds, checkpoint_path=checkpoint_path,
+                                               agent_kwargs=agent_kwargs, decision_keys=decision_keys, **kwargs)
+        _save_done(checkpoint_path, seeds, metrics)
+    return metrics
+
+def record_cells(results_handler, cells, all_metrics):
+    for (scenario_name, agent_name, params, _), metrics in zip(cells, all_metrics):
+        results_handler.record_replicas(scenario_name, agent_name, params, metrics)
+
+# The run_cells* runners return the per-cell metrics in cell order and record
+# them into results_handler when one is given. master_seed defaults to PARAMS['seed'].
+# `replicas` optionally gives each cell the range of replica indices to run
+# instead of the first PARAMS['num_replicas'].
+def run_cells(results_handler, cells, master_seed=None, replicas=None):
+    master_seed = master_seed if master_seed is not None else PARAMS['seed']
+    replicas = replicas or [None] * len(cells)
+    all_metrics = [_run_cell(cell, _seeds_for(cell, master_seed, rs), rs) for cell, rs in zip(cells, replicas)]
+    if results_handler is not None:
+        record_cells(results_handler, cells, all_metrics)
+    return all_metrics
+
+async def run_cells_async(results_handler, cells, master_seed=None, replicas=None):
+    """
+    Advances every cell concurrently, so one simulation's wait on its LLM call
+    overlaps with the others.
+    """
+    import asyncio
+    master_seed = master_seed if master_seed is not None else PARAMS['seed']
+    replicas = replicas or [None] * len(cells)
+    try:
+        all_metrics = await asyncio.gather(*(_run_cell_async(cell, _seeds_for(cell, master_seed, rs), rs)
+                                             for cell, rs in zip(cells, replicas)))
+    finally:
+        await close_backends()
+    if results_handler is not None:
+        record_cells(results_handler, cells, all_metrics)
+    return all_metrics
+
+def _run_replica_task(task):
+    params, cell, seed, replica = task
+    # Spawned workers start from the config file, so apply the parent's PARAMS
+    PARAMS.update(params)
+    # Workers trace into their own tracer and ship the spans back with the metrics
+    tracer.reset(PARAMS['trace_enabled'])
+    metrics = _run_cell(cell, [seed], range(replica, replica + 1))
+    return metrics, tracer.snapshot() if tracer.enabled else None
+
+def run_cells_parallel(results_handler, cells, master_seed=None, max_workers=None, replicas=None):
+    """
+    Spreads every (cell, replica) pair over a process pool. Each replica uses
+    the same seed as in run_cells, so results are identical to a sequential
+    run and are merged back in cell and replica order.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    master_seed = master_seed if master_seed is not None else PARAMS['seed']
+    max_workers = max_workers or PARAMS['num_workers']
+    replicas = replicas or [range(PARAMS['num_replicas'])] * len(cells)
+    tasks, owners = [], []
+    for i, (cell, rs) in enumerate(zip(cells, replicas)):
+        for r, seed in zip(rs, _seeds_for(cell, master_seed, rs)):
+            tasks.append((dict(PARAMS), cell, seed, r))
+            owners.append(i)
+
+    per_cell = [[] for _ in cells]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for i, (metrics, trace) in zip(owners, executor.map(_run_replica_task, tasks)):
+            per_cell[i].append(metrics)
+            if trace is not None:
+                tracer.merge(trace)
+    all_metrics = [
+        {key: np.concatenate([m[key] for m in replica_metrics]) for key in replica_metrics[0]}
+        for replica_metrics in per_cell
+    ]
+    if results_handler is not None:
+        record_cells(results_handler, cells, all_metrics)
+    return all_metrics
+
+def _replicas_missing(metrics):
+    """
+    How many more replicas the cell's metrics need for every CI target, from
+    the current variance estimate (the half-width shrinks as 1/sqrt(n)); 0 when all are met.
+    """
+    from results_handler import ci_half_width
+    n = len(next(iter(metrics.values())))
+    needed = n
+    for key, abs_width in PARAMS['adaptive_ci_metrics'].items():
+        values = metrics[key]
+        half_width = ci_half_width(values)
+        target = max(PARAMS['adaptive_ci_rel_width'] * abs(float(np.mean(values))), abs_width)
+        if not half_width <= target: # Also true while the half-width is NaN
+            needed = max(needed, math.ceil(n * (half_width / target)**2) if target > 0 and n > 1 else n + 1)
+    return needed - n
+
+def run_cells_adaptive(results_handler, cells, master_seed=None, run=run_cells):
+    """
+    Sequential replication: runs PARAMS['adaptive_min_replicas'] replicas of
+    every cell, then keeps adding replicas to the cells whose CIs are still too
+    wide (see PARAMS['adaptive_ci_metrics']) until they are narrow enough or
+    the cell has PARAMS['adaptive_max_replicas']. A round adds what the
+    variance estimate says is missing, at most doubling the cell, so a noisy
+    early estimate cannot spend the whole budget. Each round runs the
+    unfinished cells together with `run` (run_cells, run_cells_parallel, or a
+    synchronous wrapper around run_cells_async). Replica r has the same seed
+    as in a fixed-count run, so the rounds are reproducible and resumable.
+    """
+    master_seed = master_seed if master_seed is not None else PARAMS['seed']
+    max_replicas = PARAMS['adaptive_max_replicas']
+    all_metrics = [None] * len(cells)
+    counts = [0] * len(cells)
+    pending = {i: min(max(PARAMS['adaptive_min_replicas'], 2), max_replicas) for i in range(len(cells))}
+    while pending:
+        order = list(pending)
+        batches = [range(counts[i], counts[i] + pending[i]) for i in order]
+        with tracer.span('adaptive.round', cells=len(order)):
+            round_metrics = run(None, [cells[i] for i in order], master_seed, replicas=batches)
+        for i, metrics in zip(order, round_metrics):
+            counts[i] += pending[i]
+            all_metrics[i] = metrics if all_metrics[i] is None else {
+                key: np.concatenate([all_metrics[i][key], metrics[key]]) for key in metrics
+            }
+        pending = {}
+        for i in order:
+            missing = _replicas_missing(all_metrics[i])
+            if missing > 0 and counts[i] < max_replicas:
+                pending[i] = min(missing, counts[i], max_replicas - counts[i])
+    if results_handler is not None:
+        record_cells(results_handler, cells, all_metrics)
+    return all_metrics
+
+def run_scenario_1(results_handler):
+    run_cells(results_handler, scenario_1_cells())
+
+def run_scenario_2(results_handler):
+    run_cells(results_handler, scenario_2_cells())
+
+def run_scenario_3(results_handler):
+    run_cells(results_handler, scenario_3_cells())
+
+def resolve_master_seed():
+    """
+    PARAMS['seed'], or fresh entropy when it is None. With a checkpoint
+    directory the seed is stored there, so a restarted run reuses it and
+    resumes its cells instead of starting new ones.
+    """
+    master_seed = PARAMS['seed'] if PARAMS['seed'] is not None else np.random.SeedSequence().entropy
+    if not PARAMS['checkpoint_dir']:
+        return master_seed
+    os.makedirs(PARAMS['checkpoint_dir'], exist_ok=True)
+    run_path = os.path.join(PARAMS['checkpoint_dir'], "run.json")
+    if os.path.exists(run_path):
+        with open(run_path) as f:
+            saved_seed = json.load(f)['master_seed']
+        if PARAMS['seed'] is None or PARAMS['seed'] == saved_seed:
+            print(f"Resuming the run checkpointed in {PARAMS['checkpoint_dir']}")
+            return saved_seed
+    with open(run_path, 'w') as f:
+        json.dump({'master_seed': master_seed}, f)
+    return master_seed
+
+SCENARIOS = {'1': scenario_1_cells, '2': scenario_2_cells, '3': scenario_3_cells}
+
+def write_records(results_handler, output_format, file=sys.stdout):
+    """Writes every recorded row, with its scenario, as JSON or CSV."""
+    records = [{'scenario': scenario_name, **record}
+               for scenario_name, scenario_records in results_handler.results.items() for record in scenario_records]
+    if output_format == 'json':
+        json.dump(records, file, indent=2)
+        file.write("\n")
+        return
+    fieldnames = list(dict.fromkeys(key for record in records for key in record))
+    writer = csv.DictWriter(file, fieldnames=fieldnames)
+    writer.writeheader()
+    writer.writerows(records)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the SP-LLM evaluation scenarios and prints their results.")
+    parser.add_argument('--scenarios', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--agents', nargs='+', choices=list(AGENT_CLASSES), help="Agents to run (default: each scenario's own)")
+    parser.add_argument('--backend', choices=list(BACKENDS), default=PARAMS['llm_backend'], help="What answers LLM agent queries")
+    parser.add_argument('--format', choices=['table', 'json', 'csv'], default='table')
+    parser.add_argument('--replicas', type=int, default=PARAMS['num_replicas'])
+    parser.add_argument('--engine', choices=ENGINES, default=PARAMS['engine'], help="Slot-based array engine, discrete-event engine, or the original per-object engine")
+    parser.add_argument('--seed', type=int, default=PARAMS['seed'])
+    parser.add_argument('--llm-cache', action='store_true', default=PARAMS['llm_cache_enabled'],
+                        help="Reuse LLM decisions for near-identical slots (changes results; hit counts are printed)")
+    parser.add_argument('--adaptive', action='store_true', default=PARAMS['adaptive_replication'],
+                        help="Add replicas to each cell until its confidence intervals are narrow enough (ignores --replicas)")
+    parser.add_argument('--trace', metavar='PATH', default=PARAMS['trace_path'],
+                        help="Time every phase of the run and write a Chrome trace to PATH")
+    args = parser.parse_args(argv)
+    PARAMS.update(llm_backend=args.backend, num_replicas=args.replicas, seed=args.seed, adaptive_replication=args.adaptive,
+                  engine=args.engine, llm_cache_enabled=args.llm_cache)
+    if args.trace:
+        PARAMS.update(trace_enabled=True, trace_path=args.trace)
+        tracer.reset(True)
+    from results_handler import ResultsHandler
     results = ResultsHandler()
-    
-    run_scenario_1(results)
-    results.print_scenario_1()
-    
-    run_scenario_2(results)
-    results.print_scenario_2()
-    
-    run_scenario_3(results)
-    results.print_scenario_3()
\ No newline at end of file
+    # JSON and CSV go to stdout on their own; progress messages go to stderr
+    with contextlib.redirect_stdout(sys.stdout if args.format == 'table' else sys.stderr):
+        master_seed = resolve_master_seed()
+        print(f"Master seed: {master_seed}")
+
+        # The scenarios are independent. CPU-bound cells (baselines, and LLM agents on an
+        # in-process backend) run on a process pool; cells that wait on the LLM API run
+        # concurrently on asyncio.
+        cells = [cell for name in args.scenarios for cell in SCENARIOS[name](args.agents)]
+        waits = [agent_class_for(cell[1]).queries_llm() and PARAMS['llm_backend'] == 'real' for cell in cells]
+        llm_idx = [i for i, cell_waits in enumerate(waits) if cell_waits]
+        local_idx = [i for i, cell_waits in enumerate(waits) if not cell_waits]
+        all_metrics = [None] * len(cells)
+        if local_idx:
+            with tracer.span('run.local_cells'):
+                local_cells = [cells[i] for i in local_idx]
+                if PARAMS['adaptive_replication']:
+                    local_metrics = run_cells_adaptive(None, local_cells, master_seed, run=run_cells_parallel)
+                else:
+                    local_metrics = run_cells_parallel(None, local_cells, master_seed)
+                for i, metrics in zip(local_idx, local_metrics):
+                    all_metrics[i] = metrics
+        if llm_idx:
+            import asyncio
+            with tracer.span('run.llm_cells'):
+                llm_cells = [cells[i] for i in llm_idx]
+                if PARAMS['adaptive_replication']:
+                    llm_metrics = run_cells_adaptive(None, llm_cells, master_seed,
+                                                     run=lambda *args, **kwargs: asyncio.run(run_cells_async(*args, **kwargs)))
+                else:
+                    llm_metrics = asyncio.run(run_cells_async(None, llm_cells, master_seed))
+                for i, metrics in zip(llm_idx, llm_metrics):
+                    all_metrics[i] = metrics
+        record_cells(results, cells, all_metrics)
+
+    if args.format != 'table':
+        write_records(results, args.format)
+        real = loaded_backend('real')
+        if real is not None and real.llm.decision_cache is not None:
+            stats = real.llm.decision_cache.stats()
+            print(f"LLM decision cache: {stats['hits']} hits, {stats['misses']} misses, quantization {stats['quantization']}",
+                  file=sys.stderr)
+    else:
+        for name in args.scenarios:
+            getattr(results, f"print_scenario_{name}")()
+        results.print_planning_stats()
+        real = loaded_backend('real')
+        if real is not None:
+            if real.llm.decision_cache is not None:
+                results.print_llm_cache_stats(real.llm.decision_cache.stats())
+            results.print_prompt_stats(real.llm.prompt_stats.summary())
+            results.print_llm_usage(real.llm.scheduler.summary())
+        if tracer.enabled:
+            results.print_trace_summary(tracer.summary())
+    if tracer.enabled and PARAMS['trace_path']:
+        tracer.export_chrome_trace(PARAMS['trace_path'])
+        print(f"Trace written to {PARAMS['trace_path']}", file=sys.stdout if args.format == 'table' else sys.stderr)
+
+if __name__ == "__main__":
+    main()
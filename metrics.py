@@ -0,0 +1,187 @@
+# metrics.py
+import numpy as np
+from config import PARAMS
+
+# Log-spaced latency histogram: 40 bins per decade from 1 us to 1000 s, plus under/overflow bins
+LATENCY_BIN_EDGES_S = np.logspace(-6, 3, 9 * 40 + 1)
+ENERGY_PHASES = ('local', 'transmission', 'server')
+
+class StreamingMetrics:
+    """
+    Constant-memory task metrics for one or more independent streams (e.g. the
+    replicas of a VectorVECEnv). Completed tasks update an online mean/variance,
+    a latency histogram for quantiles, violation counters and a ring of the
+    last `violation_window` violation flags; energy is summed per phase.
+
+    Tasks can be added one at a time (add_task, O(1)) or as a batch with one
+    stream index per task (add_tasks). With `trace_every=k`, every k-th task's
+    (stream, creation_time, latency) is kept as a raw trace sample.
+    """
+    def __init__(self, num_streams=1, deadline_s=None, violation_window=10, trace_every=None):
+        self.num_streams = num_streams
+        self.deadline_s = deadline_s if deadline_s is not None else PARAMS['task_deadline_ms'] / 1000.0
+        self.count = np.zeros(num_streams, dtype=np.int64)
+        self.mean_s = np.zeros(num_streams)
+        self.m2_s2 = np.zeros(num_streams)
+        self.violations = np.zeros(num_streams, dtype=np.int64)
+        self.histogram = np.zeros((num_streams, LATENCY_BIN_EDGES_S.size + 1), dtype=np.int64)
+        self.energy_j = {phase: np.zeros(num_streams) for phase in ENERGY_PHASES}
+
+        self.violation_window = violation_window
+        self.recent_violations = np.zeros((num_streams, violation_window), dtype=bool)
+        self.recent_pos = np.zeros(num_streams, dtype=np.int64)
+
+        self.trace_every = trace_every
+        self.traces = []
+        self._seen = 0
+
+    def state_dict(self):
+        state = {
+            'count': self.count, 'mean_s': self.mean_s, 'm2_s2': self.m2_s2, 'violations': self.violations,
+            'histogram': self.histogram, 'recent_violations': self.recent_violations, 'recent_pos': self.recent_pos,
+            # Trace samples as (stream, creation_time, latency_s) rows; a missing creation time is NaN
+            'traces': np.array([(s, np.nan if c is None else c, l) for s, c, l in self.traces], dtype=float).reshape(-1, 3),
+            'seen': self._seen,
+        }
+        for phase in ENERGY_PHASES:
+            state[f'energy_{phase}_j'] = self.energy_j[phase]
+        return state
+
+    def load_state_dict(self, state):
+        if state['count'].shape != self.count.shape or state['recent_violations'].shape != self.recent_violations.shape:
+            raise ValueError("Checkpointed metrics do not match this number of streams or violation window")
+        self.count = state['count'].copy()
+        self.mean_s = state['mean_s'].copy()
+        self.m2_s2 = state['m2_s2'].copy()
+        self.violations = state['violations'].copy()
+        self.histogram = state['histogram'].copy()
+        self.recent_violations = state['recent_violations'].copy()
+        self.recent_pos = state['recent_pos'].copy()
+        self.traces = [(int(s), None if np.isnan(c) else c, l) for s, c, l in state['traces'].tolist()]
+        self._seen = state['seen']
+        for phase in ENERGY_PHASES:
+            self.energy_j[phase] = state[f'energy_{phase}_j'].copy()
+
+    def merge(self, other):
+        """
+        Adds another accumulator's tasks and energy, stream by stream (e.g. from
+        a shard of the road). The recent-violation window is left as is.
+        """
+        n = self.count + other.count
+        delta = other.mean_s - self.mean_s
+        safe_n = np.maximum(n, 1)
+        self.mean_s = self.mean_s + delta * other.count / safe_n
+        self.m2_s2 = self.m2_s2 + other.m2_s2 + delta**2 * self.count * other.count / safe_n
+        self.count = n
+        self.violations = self.violations + other.violations
+        self.histogram = self.histogram + other.histogram
+        for phase in ENERGY_PHASES:
+            self.energy_j[phase] = self.energy_j[phase] + other.energy_j[phase]
+        self.traces.extend(other.traces)
+        self._seen += other._seen
+
+    def add_task(self, latency_s, stream=0, creation_time=None):
+        # Welford's update
+        self.count[stream] += 1
+        delta = latency_s - self.mean_s[stream]
+        self.mean_s[stream] += delta / self.count[stream]
+        self.m2_s2[stream] += delta * (latency_s - self.mean_s[stream])
+        violated = latency_s > self.deadline_s
+        self.violations[stream] += violated
+        self.histogram[stream, np.searchsorted(LATENCY_BIN_EDGES_S, latency_s, side='right')] += 1
+        self.recent_violations[stream, self.recent_pos[stream]] = violated
+        self.recent_pos[stream] = (self.recent_pos[stream] + 1) % self.violation_window
+
+        self._seen += 1
+        if self.trace_every and self._seen % self.trace_every == 0:
+            self.traces.append((stream, creation_time, latency_s))
+
+    def add_tasks(self, latencies_s, streams=None, creation_times=None):
+        """Adds a batch of completed tasks in completion order; `streams` defaults to stream 0."""
+        if not latencies_s.size:
+            return
+        R = self.num_streams
+        streams = streams if streams is not None else np.zeros(latencies_s.size, dtype=np.int64)
+        violated = latencies_s > self.deadline_s
+
+        # Merge the batch moments into the running ones (Chan et al.)
+        n_b = np.bincount(streams, minlength=R)
+        sum_b = np.bincount(streams, weights=latencies_s, minlength=R)
+        mean_b = sum_b / np.maximum(n_b, 1)
+        m2_b = np.bincount(streams, weights=(latencies_s - mean_b[streams])**2, minlength=R)
+        n = self.count + n_b
+        delta = mean_b - self.mean_s
+        safe_n = np.maximum(n, 1)
+        self.mean_s += delta * n_b / safe_n
+        self.m2_s2 += m2_b + delta**2 * self.count * n_b / safe_n
+        self.count = n
+
+        self.violations += np.bincount(streams, weights=violated, minlength=R).astype(np.int64)
+        bins = np.searchsorted(LATENCY_BIN_EDGES_S, latencies_s, side='right')
+        np.add.at(self.histogram, (streams, bins), 1)
+        self._push_recent_violations(streams, violated)
+
+        if self.trace_every:
+            sampled = np.flatnonzero((self._seen + 1 + np.arange(latencies_s.size)) % self.trace_every == 0)
+            for i in sampled.tolist():
+                self.traces.append((int(streams[i]), None if creation_times is None else float(creation_times[i]), float(latencies_s[i])))
+        self._seen += latencies_s.size
+
+    def _push_recent_violations(self, streams, violated):
+        # Keep completion order within each stream; only the last W flags of a stream survive
+        W = self.violation_window
+        order = np.argsort(streams, kind='stable')
+        streams, violated = streams[order], violated[order]
+        counts = np.bincount(streams, minlength=self.num_streams)
+        rank = np.arange(streams.size) - (np.cumsum(counts) - counts)[streams]
+        keep = rank >= counts[streams] - W
+        pos = (self.recent_pos[streams] + rank) % W
+        self.recent_violations[streams[keep], pos[keep]] = violated[keep]
+        self.recent_pos = (self.recent_pos + counts) % W
+
+    def add_energy(self, phase, energy_j, streams=None):
+        """Adds one energy value (scalar, stream 0) or a batch with one stream index per value."""
+        if np.ndim(energy_j) == 0:
+            self.energy_j[phase][0] += energy_j
+            return
+        if streams is None:
+            # Summed in order like a multi-stream batch, so a single engine matches its VectorVECEnv replica bit for bit
+            streams = np.zeros(energy_j.size, dtype=np.int64)
+        self.energy_j[phase] += np.bincount(streams, weights=energy_j, minlength=self.num_streams)
+
+    @property
+    def total_energy_j(self):
+        return sum(self.energy_j.values())
+
+    def recent_violation_rate(self):
+        """Per-stream violation rate (%) over the last `violation_window` completed tasks."""
+        return self.recent_violations.sum(axis=1) / self.violation_window * 100
+
+    def latency_quantile(self, q):
+        """Per-stream latency quantile in seconds, interpolated geometrically within a histogram bin."""
+        cumulative = np.cumsum(self.histogram, axis=1)
+        target = q * self.count
+        bins = np.minimum((cumulative < target[:, None]).sum(axis=1), self.histogram.shape[1] - 1)
+        edges = np.concatenate([[LATENCY_BIN_EDGES_S[0]], LATENCY_BIN_EDGES_S, [LATENCY_BIN_EDGES_S[-1]]])
+        low, high = edges[bins], edges[bins + 1]
+        below = np.where(bins > 0, cumulative[np.arange(self.num_streams), bins - 1], 0)
+        in_bin = self.histogram[np.arange(self.num_streams), bins]
+        frac = np.clip((target - below) / np.maximum(in_bin, 1), 0, 1)
+        return np.where(self.count > 0, low * (high / low)**frac, 0.0)
+
+    def summary(self):
+        """Per-stream metrics as a dict of length-R arrays."""
+        safe_n = np.maximum(self.count, 1)
+        summary = {
+            'num_completed': self.count.copy(),
+            'avg_latency_ms': self.mean_s * 1000,
+            'latency_std_ms': np.sqrt(self.m2_s2 / safe_n) * 1000,
+            'latency_p50_ms': self.latency_quantile(0.50) * 1000,
+            'latency_p95_ms': self.latency_quantile(0.95) * 1000,
+            'latency_p99_ms': self.latency_quantile(0.99) * 1000,
+            'qos_violation_rate': self.violations / safe_n * 100,
+            'total_energy_j': self.total_energy_j,
+        }
+        for phase in ENERGY_PHASES:
+            summary[f'{phase}_energy_j'] = self.energy_j[phase].copy()
+        return summary
@@ -1,56 +1,53 @@
 # mock_llm.py
 import numpy as np
+from environment import Action, as_observation
+from pdt import forecast_arrays
 
-def query_llm_orchestrator(state, pdt_forecasts=None, semantic_goal="BALANCE"):
+def query_llm_orchestrator(state, pdt_forecasts=None, semantic_goal="BALANCE", rng=None):
     """
     This function simulates an LLM call. It produces structured output based on
-    the provided state, forecasts, and semantic goal.
+    the provided state, forecasts, and semantic goal, as an Action.
     """
-    num_vehicles = len(state['vehicles'])
-    
-    # Base decisions on current state
-    w_ratios = [] # Offloading ratios
-    a_ratios = [] # Allocation ratios
+    rng = rng if rng is not None else np.random
+    state = as_observation(state)
+    num_vehicles = state.num_vehicles
 
     # --- LLM Reasoning Simulation ---
     # Good channel = higher chance of offloading
-    channel_gains = [v['channel_gain'] for v in state['vehicles']]
-    avg_gain = np.mean(channel_gains) if channel_gains else 0
-    
-    for v in state['vehicles']:
-        # Base offloading on channel quality
-        if v['channel_gain'] > avg_gain:
-            w_ratios.append(np.random.uniform(0.6, 0.9))
-        else:
-            w_ratios.append(np.random.uniform(0.1, 0.4))
+    channel_gains = state.channel_gain
+    avg_gain = np.mean(channel_gains) if num_vehicles else 0
+
+    # Base offloading on channel quality; one draw per vehicle, in vehicle order
+    draws = rng.random(num_vehicles)
+    w_ratios = np.where(channel_gains > avg_gain, 0.6 + (0.9 - 0.6) * draws, 0.1 + (0.4 - 0.1) * draws)
 
     # Base allocation on server queue length
-    queue_lengths = list(state['server_queue_lengths'].values())
-    total_queue = sum(queue_lengths)
+    queue_lengths = state.server_queue_lengths
+    total_queue = queue_lengths.sum()
     if total_queue > 0:
-        a_ratios = [q / total_queue for q in queue_lengths]
+        a_ratios = queue_lengths / total_queue
     else:
-        a_ratios = [1.0 / num_vehicles] * num_vehicles
+        a_ratios = np.full(num_vehicles, 1.0 / num_vehicles)
 
     # --- Apply Proactive Adjustment (if pDT forecasts are available) ---
     if pdt_forecasts:
         # Example: if a vehicle's task load is predicted to be high, increase its server allocation
-        predicted_loads = [f['vehicles'][i]['predicted_task_load_bytes'] for i, f in enumerate(pdt_forecasts) if f['vehicles']]
-        if predicted_loads:
+        _, predicted_loads = forecast_arrays(pdt_forecasts)
+        if predicted_loads.size:
             # This is a highly simplified logic
             pass # In a real scenario, you'd have more complex adjustments here.
 
     # --- Apply Semantic Goal Adjustment ---
     if semantic_goal == "SAVE_ENERGY":
         # Reduce offloading to keep server idle, reduce server allocation
-        w_ratios = [r * 0.3 for r in w_ratios]
-        a_ratios = [r * 0.3 for r in a_ratios]
+        w_ratios = w_ratios * 0.3
+        a_ratios = a_ratios * 0.3
     elif semantic_goal == "LOW_LATENCY":
         # Maximize offloading and server allocation
-        w_ratios = [min(1.0, r * 1.5) for r in w_ratios]
-        a_ratios = [min(1.0, r * 1.5) for r in a_ratios]
-        total_a = sum(a_ratios)
+        w_ratios = np.minimum(1.0, w_ratios * 1.5)
+        a_ratios = np.minimum(1.0, a_ratios * 1.5)
+        total_a = a_ratios.sum()
         if total_a > 0:
-            a_ratios = [r / total_a for r in a_ratios]
+            a_ratios = a_ratios / total_a
 
-    return {'w': w_ratios, 'a': a_ratios}
\ No newline at end of file
+    return Action(w_ratios, a_ratios)
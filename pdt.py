@@ -1,34 +1,104 @@
 # pdt.py
+from collections.abc import Sequence
 import numpy as np
 from config import PARAMS
+from environment import channel_gain
+from tracing import tracer
+from checkpoint import rng_state, set_rng_state
+
+class ForecastArrays(Sequence):
+    """
+    An H-step forecast held as (H, N) arrays of predicted positions, task
+    loads and channel gains. Indexing or iterating yields the per-step dicts
+    of the original forecast format, built only when asked for, so code that
+    expects dicts keeps working while array-aware code reads the arrays.
+    """
+    def __init__(self, time_slot, positions_m, task_loads_bytes, channel_gains):
+        self.time_slot = time_slot
+        self.positions_m = positions_m
+        self.task_loads_bytes = task_loads_bytes
+        self.channel_gains = channel_gains
+
+    def __len__(self):
+        return self.positions_m.shape[0]
+
+    def __getitem__(self, h):
+        if isinstance(h, slice):
+            return [self[i] for i in range(*h.indices(len(self)))]
+        if h < 0:
+            h += len(self)
+        if not 0 <= h < len(self):
+            raise IndexError(h)
+        return {
+            'time_slot': self.time_slot + h + 1,
+            'vehicles': [
+                {'id': i, 'predicted_position_m': pos, 'predicted_task_load_bytes': load}
+                for i, (pos, load) in enumerate(zip(self.positions_m[h].tolist(), self.task_loads_bytes[h].tolist()))
+            ],
+        }
+
+def forecast_arrays(pdt_forecasts):
+    """(positions_m, task_loads_bytes) as (H, N) arrays from a ForecastArrays or a list of forecast dicts."""
+    if isinstance(pdt_forecasts, ForecastArrays):
+        return pdt_forecasts.positions_m, pdt_forecasts.task_loads_bytes
+    positions = np.array([[v['predicted_position_m'] for v in f['vehicles']] for f in pdt_forecasts], dtype=float)
+    loads = np.array([[v['predicted_task_load_bytes'] for v in f['vehicles']] for f in pdt_forecasts], dtype=float)
+    return positions, loads
 
 class PredictiveDigitalTwin:
-    def __init__(self, environment):
+    def __init__(self, environment, horizon=None, rng=None):
         self.env = environment
+        self.rng = rng if rng is not None else np.random
+        self.horizon = horizon or PARAMS['pdt_prediction_horizon']
+        self._steps = np.arange(1, self.horizon + 1)[:, None]
+        self._decay = 0.9**self._steps # Assume load decreases
+        self._noise = None
+        self._last_slot = None
+        self._last_forecast = None
+
+    def state_dict(self):
+        # The cached forecast is not saved: checkpoints are taken between slots, where it is stale anyway
+        state = {'last_slot': self._last_slot, 'rng': rng_state(self.rng)}
+        if self._noise is not None:
+            state['noise'] = self._noise
+        return state
+
+    def load_state_dict(self, state):
+        self._noise = state['noise'].copy() if 'noise' in state else None
+        self._last_slot = state['last_slot']
+        self._last_forecast = None
+        set_rng_state(self.rng, state['rng'])
+
+    def _advance_noise(self, time_slot, num_vehicles):
+        """
+        The load noise for absolute slot t+h is drawn once and kept while that
+        slot stays inside the horizon, so each new slot shifts the matrix and
+        draws only the rows that entered the horizon.
+        """
+        elapsed = time_slot - self._last_slot if self._last_slot is not None else self.horizon
+        if self._noise is None or self._noise.shape[1] != num_vehicles or not 0 < elapsed < self.horizon:
+            self._noise = self.rng.normal(1.0, 0.2, size=(self.horizon, num_vehicles))
+            return
+        self._noise[:-elapsed] = self._noise[elapsed:]
+        self._noise[-elapsed:] = self.rng.normal(1.0, 0.2, size=(elapsed, num_vehicles))
 
     def forecast(self):
         """
         Simulates forecasting by projecting current state forward with some noise.
         A real implementation would use a trained model (e.g., LSTM).
+        Returns a ForecastArrays; repeated calls within a slot return the same forecast.
         """
-        current_state = self.env.get_state()
-        forecasts = []
-        
-        for h in range(1, PARAMS['pdt_prediction_horizon'] + 1):
-            future_state_h = {'time_slot': current_state['time_slot'] + h, 'vehicles': []}
-            for v_state in current_state['vehicles']:
-                # Predict position
-                future_pos = (v_state['position_m'] + v_state['speed_mps'] * h) % (PARAMS['road_length_km'] * 1000)
-                
-                # Predict task load with some noise
-                noise = np.random.normal(1.0, 0.2)
-                future_task_load = v_state['task_load_bytes'] * noise * (0.9**h) # Assume load decreases
-                
-                future_state_h['vehicles'].append({
-                    'id': v_state['id'],
-                    'predicted_position_m': future_pos,
-                    'predicted_task_load_bytes': max(0, future_task_load)
-                })
-            forecasts.append(future_state_h)
-            
-        return forecasts
\ No newline at end of file
+        time_slot = self.env.time_slot
+        if self._last_forecast is not None and time_slot == self._last_slot:
+            return self._last_forecast
+
+        with tracer.span('pdt.forecast'):
+            position_m, speed_mps, task_load_bytes = self.env.get_vehicle_arrays()
+            self._advance_noise(time_slot, position_m.size)
+            self._last_slot = time_slot
+
+            # Predict positions, then task loads with some noise
+            positions = (position_m + speed_mps * self._steps) % (PARAMS['road_length_km'] * 1000)
+            loads = np.maximum(0, task_load_bytes * self._noise * self._decay)
+            self._last_forecast = ForecastArrays(time_slot, positions, loads, channel_gain(positions))
+        return self._last_forecast
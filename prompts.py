@@ -0,0 +1,198 @@
+# prompts.py
+"""
+Prompts for the LLM orchestrator: the system prompts of the per-vehicle,
+cluster-level and plan queries, and the JSON and compact (columnar) user
+prompts. Plain string and NumPy code with no client dependencies, so the
+decision log can hash a query's prompt without loading openai (see real_llm.py).
+"""
+import json
+import numpy as np
+from config import PARAMS
+from pdt import forecast_arrays
+from environment import Observation, as_observation
+
+def generate_system_prompt():
+    return """
+    You are an expert network orchestrator for a Vehicular Edge Computing (VEC) system.
+    Your goal is to make optimal decisions for task offloading and resource allocation based on the provided network state.
+
+    You will be given:
+    1.  A "Strategic Goal" (e.g., save energy, lower latency).
+    2.  The "Current State" of the network (vehicle data, queue backlogs).
+    3.  Optional "Predictive State" forecasts from a Digital Twin.
+
+    You MUST respond with ONLY a JSON object in the following format:
+    {"w": [w_v0, w_v1, ...], "a": [a_v0, a_v1, ...]}
+
+    - "w" is a list of offloading ratios (float between 0.0 and 1.0) for each vehicle.
+    - "a" is a list of server CPU allocation ratios (float between 0.0 and 1.0) for each vehicle's queue. The sum of "a" should be 1.0.
+
+    Do not include any other text, explanations, or markdown formatting in your response. Only the JSON object.
+    """
+
+def generate_user_prompt(state, pdt_forecasts, semantic_goal):
+    # Serialize the state and forecasts into a readable string format
+    state_str = json.dumps(state.to_dict() if isinstance(state, Observation) else state, indent=2)
+    forecast_str = "Not available."
+    if pdt_forecasts:
+        forecast_str = json.dumps(list(pdt_forecasts), indent=2)
+
+    prompt = f"""
+    Strategic Goal: "{semantic_goal}"
+
+    Current State:
+    {state_str}
+
+    Predictive State (Forecasts for next H steps):
+    {forecast_str}
+
+    Based on all the information provided, determine the optimal offloading ratios (w) and resource allocation ratios (a).
+    Remember to respond with only the JSON object.
+    """
+    return prompt
+
+# Decimal places per column of the compact encoding; token budgets coarsen these
+PROMPT_FIELD_DECIMALS = {
+    'pos_m': 1,
+    'speed_mps': 1,
+    'load_bytes': 0,
+    'gain_db': 1,
+    'queue': 0,
+}
+# The coarsest each column gets: counts and byte loads stay whole numbers, positions are kept to 10 m
+PROMPT_FIELD_MIN_DECIMALS = {
+    'pos_m': -1,
+    'speed_mps': 0,
+    'load_bytes': 0,
+    'gain_db': 0,
+    'queue': 0,
+}
+MAX_PROMPT_COARSENING = 3
+
+# tiktoken, when installed, is loaded on the first token count
+_tokenizer = None
+
+def estimate_tokens(text):
+    """Exact count with tiktoken when installed, otherwise the usual ~4 characters per token."""
+    global _tokenizer
+    if _tokenizer is None:
+        try:
+            import tiktoken
+            _tokenizer = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _tokenizer = False
+    if _tokenizer:
+        return len(_tokenizer.encode(text))
+    return len(text) // 4 + 1
+
+def _round(values, decimals):
+    rounded = np.round(np.asarray(values, dtype=float), decimals)
+    return rounded.astype(np.int64).tolist() if decimals <= 0 else rounded.tolist()
+
+def encode_compact_state(state, pdt_forecasts, coarsen=0, horizon=None):
+    """
+    Columnar encoding: one list per field, entry i belonging to vehicle i.
+    Forecast steps are deltas from the previous step (the first from the
+    current state). `coarsen` removes that many decimal places per field,
+    down to the field's PROMPT_FIELD_MIN_DECIMALS.
+    """
+    decimals = {k: max(d - coarsen, PROMPT_FIELD_MIN_DECIMALS[k]) for k, d in PROMPT_FIELD_DECIMALS.items()}
+    state = as_observation(state)
+    positions = state.position_m
+    loads = state.task_load_bytes
+    encoded_state = {
+        't': state.time_slot,
+        'pos_m': _round(positions, decimals['pos_m']),
+        'speed_mps': _round(state.speed_mps, decimals['speed_mps']),
+        'load_bytes': _round(loads, decimals['load_bytes']),
+        'gain_db': _round(10 * np.log10(np.maximum(state.channel_gain, 1e-30)), decimals['gain_db']),
+        'queue': _round(state.server_queue_lengths, decimals['queue']),
+    }
+
+    encoded_forecasts = None
+    if pdt_forecasts:
+        f_positions, f_loads = forecast_arrays(pdt_forecasts)
+        f_positions, f_loads = f_positions[:horizon], f_loads[:horizon]
+        dpos = _round(np.diff(f_positions, axis=0, prepend=positions[None, :]), decimals['pos_m'])
+        dload = _round(np.diff(f_loads, axis=0, prepend=loads[None, :]), decimals['load_bytes'])
+        encoded_forecasts = [{'dpos_m': p, 'dload_bytes': l} for p, l in zip(dpos, dload)]
+    return encoded_state, encoded_forecasts
+
+def _render_compact_prompt(encoded_state, encoded_forecasts, semantic_goal):
+    state_str = json.dumps(encoded_state, separators=(',', ':'))
+    forecast_str = "Not available."
+    if encoded_forecasts:
+        forecast_str = json.dumps(encoded_forecasts, separators=(',', ':'))
+    return f"""Strategic Goal: "{semantic_goal}"
+Current State (columnar; entry i of every list is vehicle i; gain_db is channel gain in dB, queue is the server queue length):
+{state_str}
+Predictive State (one object per future step; dpos_m/dload_bytes are changes from the previous step):
+{forecast_str}
+Determine the optimal offloading ratios (w) and resource allocation ratios (a), one per vehicle. Respond with only the JSON object."""
+
+def generate_compact_user_prompt(state, pdt_forecasts, semantic_goal, token_budget=None):
+    """
+    Compact alternative to generate_user_prompt. If the prompt exceeds
+    `token_budget`, precision is coarsened first, then forecast steps are
+    dropped from the far end of the horizon.
+    """
+    coarsen = 0
+    horizon = len(pdt_forecasts) if pdt_forecasts else 0
+    while True:
+        prompt = _render_compact_prompt(*encode_compact_state(state, pdt_forecasts, coarsen, horizon), semantic_goal)
+        if token_budget is None or estimate_tokens(prompt) <= token_budget:
+            return prompt
+        if coarsen < MAX_PROMPT_COARSENING:
+            coarsen += 1
+        elif horizon > 1:
+            horizon -= 1
+        else:
+            return prompt
+
+def generate_cluster_system_prompt(num_clusters):
+    return generate_system_prompt() + f"""
+    CLUSTER MODE: the vehicles have been grouped into {num_clusters} clusters and you decide per cluster, as
+    {{"w": [w_c0, w_c1, ...], "a": [a_c0, a_c1, ...]}}
+    with {num_clusters} entries in each list. "w" applies to every vehicle of the cluster; "a" is the cluster's
+    share of the server CPU (summing to 1.0), split among its vehicles by their queue backlog.
+    """
+
+def generate_cluster_user_prompt(clusters, semantic_goal):
+    """Prompt from the cluster summaries of a VehicleClusters; its size depends on the number of clusters, not vehicles."""
+    summary = clusters.summary
+    encoded_state = {
+        't': summary['t'],
+        'n': summary['n'],
+        'pos_m': _round(summary['pos_m'], 0),
+        'spread_m': _round(summary['spread_m'], 0),
+        'speed_mps': _round(summary['speed_mps'], 1),
+        'gain_db': _round(summary['gain_db'], 1),
+        'load_bytes': _round(summary['load_bytes'], 0),
+        'queue': _round(summary['queue'], 0),
+    }
+    forecast_str = "Not available."
+    if clusters.forecasts is not None:
+        forecast_str = json.dumps([
+            {'load_bytes': _round(load, 0), 'gain_db': _round(gain, 1)}
+            for load, gain in zip(clusters.forecasts['load_bytes'], clusters.forecasts['gain_db'])
+        ], separators=(',', ':'))
+    return f"""Strategic Goal: "{semantic_goal}"
+Current State (columnar; entry c of every list is vehicle cluster c: n vehicles around mean position pos_m with spread spread_m, mean speed, mean channel gain in dB, total task load and total server queue length):
+{json.dumps(encoded_state, separators=(',', ':'))}
+Predictive State (one object per future step; total task load and mean channel gain in dB per cluster):
+{forecast_str}
+Determine the optimal offloading ratio (w) and server CPU share (a) of each cluster. Respond with only the JSON object."""
+
+def user_prompt_for(state, pdt_forecasts, semantic_goal):
+    """The user prompt in PARAMS['llm_prompt_format']."""
+    if PARAMS['llm_prompt_format'] == 'compact':
+        return generate_compact_user_prompt(state, pdt_forecasts, semantic_goal, PARAMS['llm_prompt_token_budget'])
+    return generate_user_prompt(state, pdt_forecasts, semantic_goal)
+
+def generate_plan_system_prompt(horizon, system_prompt=None):
+    return (system_prompt or generate_system_prompt()) + f"""
+    PLANNING MODE: instead of a single decision, return a plan covering the next {horizon} time slots, as
+    {{"plan": [{{"w": [...], "a": [...]}}, ...]}}
+    with exactly {horizon} entries. Entry 0 applies to the current slot and entry k to the slot k steps ahead;
+    use the Predictive State forecasts to anticipate how each future slot will look.
+    """
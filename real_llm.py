@@ -1,102 +1,655 @@
 # real_llm.py
+import asyncio
+import copy
+import hashlib
+import itertools
 import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import httpx
 import numpy as np
-from openai import OpenAI
-from config import OPENAI_API_KEY
+from openai import APIConnectionError, AsyncOpenAI, OpenAI
+from backends import charge
+from config import PARAMS, openai_settings
+from pdt import forecast_arrays
+from environment import Action, as_action, as_observation
+from clustering import VehicleClusters
+from prompts import (estimate_tokens, generate_cluster_system_prompt, generate_cluster_user_prompt,
+                     generate_plan_system_prompt, generate_system_prompt, user_prompt_for)
+from tracing import tracer
+
+client = None
+_api_key = None
+_base_url = None
+
+# The async client and its concurrency limit are bound to the running event loop,
+# so they are created on first use and released with close_async_client().
+_async_client = None
+_async_semaphore = None
+
+def configure_client(api_key=None, base_url=None):
+    """
+    (Re)creates the OpenAI client. With a base_url (e.g. a local llm_server.py)
+    no real key is needed; without key or base_url the client stays unset and
+    every query falls back to the default action.
+    """
+    global client, _api_key, _base_url, _async_client, _async_semaphore
+    _base_url = base_url
+    _api_key = api_key or ("local" if base_url else None)
+    # Retries are left to the RequestScheduler
+    client = OpenAI(api_key=_api_key, base_url=_base_url, max_retries=0) if _api_key else None
+    # The next async query builds a new async client for the new endpoint
+    _async_client = None
+    _async_semaphore = None
 
 # Initialize the OpenAI client
-if OPENAI_API_KEY:
-    client = OpenAI(api_key=OPENAI_API_KEY)
-else:
-    client = None
+OPENAI_API_KEY, OPENAI_BASE_URL = openai_settings()
+configure_client(OPENAI_API_KEY, OPENAI_BASE_URL)
+
+COMPLETION_ARGS = {
+    'model': "gpt-4-turbo",  # Or "gpt-4" if you prefer
+    'response_format': {"type": "json_object"},
+    'temperature': 0.2, # Lower temperature for more deterministic outputs
+}
+
+def _decision_to_json(decision):
+    """An Action, or a list of them, in the {'w': [...], 'a': [...]} form."""
+    if isinstance(decision, list):
+        return [_decision_to_json(step) for step in decision]
+    return as_action(decision).to_dict()
+
+def _decision_from_json(value):
+    if isinstance(value, list):
+        return [_decision_from_json(step) for step in value]
+    return as_action(value)
+
+class DecisionCache:
+    """
+    Caches orchestrator decisions under a quantized fingerprint of the state,
+    the pDT forecasts and the semantic goal, so near-identical slots reuse a
+    previous answer instead of paying for another round trip.
+
+    Entries live in an in-memory LRU of at most `max_entries`; if `path` is
+    given they are also written to an SQLite file that persists across runs.
+    `quantization` overrides the bucket sizes in PARAMS['llm_cache_quantization'].
+    """
+    def __init__(self, max_entries=10000, path=None, quantization=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.quantization = {**PARAMS['llm_cache_quantization'], **(quantization or {})}
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved_s = 0.0
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path)
+            self._db.execute("CREATE TABLE IF NOT EXISTS decisions (key TEXT PRIMARY KEY, action TEXT, latency_s REAL)")
+            self._db.commit()
+
+    def _bucket(self, values, step):
+        return np.floor(np.asarray(values, dtype=float) / step).astype(np.int64).tolist()
+
+    def make_key(self, state, pdt_forecasts, semantic_goal):
+        q = self.quantization
+        state = as_observation(state)
+        gains_db = 10 * np.log10(np.maximum(state.channel_gain, 1e-30))
+        fingerprint = [
+            semantic_goal,
+            self._bucket(state.position_m, q['position_m']),
+            self._bucket(gains_db, q['channel_gain_db']),
+            self._bucket(state.task_load_bytes, q['task_load_bytes']),
+            self._bucket(state.server_queue_lengths, q['queue_length']),
+        ]
+        if pdt_forecasts:
+            f_positions, f_loads = forecast_arrays(pdt_forecasts)
+            fingerprint.append(self._bucket(f_positions, q['position_m']))
+            fingerprint.append(self._bucket(f_loads, q['task_load_bytes']))
+        return hashlib.sha256(json.dumps(fingerprint).encode()).hexdigest()
+
+    def get(self, key):
+        """Returns a copy of the cached decision, or None on a miss."""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        elif self._db is not None:
+            row = self._db.execute("SELECT action, latency_s FROM decisions WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                entry = (_decision_from_json(json.loads(row[0])), row[1])
+                self._store(key, entry)
+        if entry is None:
+            self.misses += 1
+            return None
+        decision, latency_s = entry
+        self.hits += 1
+        self.latency_saved_s += latency_s
+        return copy.deepcopy(decision)
+
+    def put(self, key, decision, latency_s):
+        """Stores an Action, or a plan (list) of them."""
+        entry = (copy.deepcopy(decision), latency_s)
+        self._store(key, entry)
+        if self._db is not None:
+            self._db.execute("INSERT OR REPLACE INTO decisions VALUES (?, ?, ?)", (key, json.dumps(_decision_to_json(entry[0])), latency_s))
+            self._db.commit()
 
-def generate_system_prompt():
-    return """
-    You are an expert network orchestrator for a Vehicular Edge Computing (VEC) system.
-    Your goal is to make optimal decisions for task offloading and resource allocation based on the provided network state.
+    def _store(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
 
-    You will be given:
-    1.  A "Strategic Goal" (e.g., save energy, lower latency).
-    2.  The "Current State" of the network (vehicle data, queue backlogs).
-    3.  Optional "Predictive State" forecasts from a Digital Twin.
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'latency_saved_s': self.latency_saved_s,
+            'entries': len(self.entries),
+            'quantization': dict(self.quantization),
+        }
 
-    You MUST respond with ONLY a JSON object in the following format:
-    {"w": [w_v0, w_v1, ...], "a": [a_v0, a_v1, ...]}
+def _cache_path():
+    """
+    PARAMS['llm_cache_path'], else with checkpointing a file in the checkpoint
+    directory, so resumed cells still find the decisions cached before the restart.
+    """
+    if PARAMS['llm_cache_path'] or not PARAMS['checkpoint_dir']:
+        return PARAMS['llm_cache_path']
+    os.makedirs(PARAMS['checkpoint_dir'], exist_ok=True)
+    return os.path.join(PARAMS['checkpoint_dir'], "llm_cache.sqlite")
 
-    - "w" is a list of offloading ratios (float between 0.0 and 1.0) for each vehicle.
-    - "a" is a list of server CPU allocation ratios (float between 0.0 and 1.0) for each vehicle's queue. The sum of "a" should be 1.0.
+if PARAMS['llm_cache_enabled']:
+    decision_cache = DecisionCache(PARAMS['llm_cache_max_entries'], _cache_path())
+else:
+    decision_cache = None
 
-    Do not include any other text, explanations, or markdown formatting in your response. Only the JSON object.
+def _cache_lookup(state, pdt_forecasts, semantic_goal):
+    """Returns (cache_key, cached_action); both are None when caching is disabled."""
+    if decision_cache is None:
+        return None, None
+    key = decision_cache.make_key(state, pdt_forecasts, semantic_goal)
+    return key, decision_cache.get(key)
+
+class TokenBucket:
+    """
+    Refills at `per_minute` units a minute. It holds one second's worth, since
+    providers enforce per-minute limits over shorter windows too, so bursts
+    stay small, but at least the largest single reservation so far, so that a
+    prompt bigger than one second's tokens can be admitted after idle time.
+    Growing the burst does not credit the new room: it fills at the refill rate.
+    reserve() takes the units at once, overdrawing if need be, and returns how
+    long the caller has to wait until they are covered; concurrent callers are
+    thereby spaced out at the refill rate instead of all trying at once.
     """
+    def __init__(self, per_minute, now):
+        self.rate_per_s = per_minute / 60
+        self.capacity = max(1.0, self.rate_per_s)
+        self.level = self.capacity
+        self.updated = now
 
-def generate_user_prompt(state, pdt_forecasts, semantic_goal):
-    # Serialize the state and forecasts into a readable string format
-    state_str = json.dumps(state, indent=2)
-    forecast_str = "Not available."
-    if pdt_forecasts:
-        forecast_str = json.dumps(pdt_forecasts, indent=2)
+    def reserve(self, amount, now):
+        if amount > self.capacity:
+            # Grow the burst to fit; the extra room starts empty, so oversized requests still pay the full rate
+            self.capacity = amount
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate_per_s)
+        self.updated = now
+        self.level -= amount
+        return max(0.0, -self.level / self.rate_per_s)
 
-    prompt = f"""
-    Strategic Goal: "{semantic_goal}"
+    def refund(self, amount):
+        """Returns units (or, with a negative amount, takes more)."""
+        self.level = min(self.capacity, self.level + amount)
 
-    Current State:
-    {state_str}
+def _retryable(error):
+    if isinstance(error, APIConnectionError): # Includes timeouts
+        return True
+    status = getattr(error, 'status_code', None)
+    return status in (408, 409, 429) or (status is not None and status >= 500)
+
+def _retry_after_s(error):
+    try:
+        return float(error.response.headers['retry-after'])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+class RequestScheduler:
+    """
+    Admission, retries and cost accounting for LLM requests.
 
-    Predictive State (Forecasts for next H steps):
-    {forecast_str}
+    Requests and tokens are paced by token buckets at PARAMS['llm_rate_limit_rpm']
+    and PARAMS['llm_rate_limit_tpm']. A request reserves its prompt estimate
+    plus the running mean completion, settled against the usage the API reports.
+    Retryable errors (429, 408, 409, 5xx, connection errors and timeouts) are
+    retried up to PARAMS['llm_max_retries'] times with full-jitter exponential
+    backoff. A 429 delays its own retry by at least its Retry-After, and holds
+    back every other request for at most PARAMS['llm_rate_limit_cooldown_s'],
+    so one throttled request does not stall the rest. A query that has no
+    decision PARAMS['llm_decision_deadline_s'] after it started, waits and
+    retries included, falls back to the default action, as does every query
+    once PARAMS['llm_budget_usd'] has been spent. Fallbacks are counted by reason.
 
-    Based on all the information provided, determine the optimal offloading ratios (w) and resource allocation ratios (a).
-    Remember to respond with only the JSON object.
+    `clock` (default time.monotonic) and `rng` (a random.Random for the jitter)
+    can be replaced, e.g. by a fake clock in tests.
     """
-    return prompt
+    def __init__(self, clock=time.monotonic, rng=None):
+        self.clock = clock
+        self.limits = None
+        self.requests = self.tokens = None
+        self.paused_until = 0.0
+        self.completion_tokens_estimate = 100.0
+        self.spent_usd = 0.0
+        self.stats = {'requests': 0, 'retries': 0, 'rate_limited': 0, 'wait_s': 0.0}
+        self.fallbacks = {}
+        self._rng = rng or random.Random()
+        self._lock = threading.Lock()
+
+    def deadline(self):
+        limit_s = PARAMS['llm_decision_deadline_s']
+        return self.clock() + limit_s if limit_s else None
+
+    def over_budget(self):
+        return PARAMS['llm_budget_usd'] is not None and self.spent_usd >= PARAMS['llm_budget_usd']
+
+    def admit(self, prompt_tokens, deadline):
+        """
+        Reserves one request and its expected tokens: (seconds to wait before
+        sending, tokens reserved), or None if the wait would pass the deadline.
+        """
+        now = self.clock()
+        reserved = prompt_tokens + self.completion_tokens_estimate
+        with self._lock:
+            limits = (PARAMS['llm_rate_limit_rpm'], PARAMS['llm_rate_limit_tpm'])
+            if limits != self.limits: # Set up on first use, so changes to PARAMS after import apply
+                self.limits = limits
+                self.requests = TokenBucket(limits[0], now) if limits[0] else None
+                self.tokens = TokenBucket(limits[1], now) if limits[1] else None
+            wait_s = max(0.0, self.paused_until - now)
+            if self.requests:
+                wait_s = max(wait_s, self.requests.reserve(1, now))
+            if self.tokens:
+                wait_s = max(wait_s, self.tokens.reserve(reserved, now))
+            if deadline is not None and now + wait_s >= deadline:
+                if self.requests:
+                    self.requests.refund(1)
+                if self.tokens:
+                    self.tokens.refund(reserved)
+                return None
+            self.stats['requests'] += 1
+            self.stats['wait_s'] += wait_s
+        charge(calls=1)
+        return wait_s, reserved
+
+    def timeout(self, deadline):
+        """PARAMS['llm_request_timeout_s'], cut short by the deadline."""
+        if deadline is None:
+            return PARAMS['llm_request_timeout_s']
+        return max(0.001, min(PARAMS['llm_request_timeout_s'], deadline - self.clock()))
+
+    def retry_delay(self, error, attempt, reserved, deadline):
+        """(seconds to wait before retrying, None), or (None, fallback reason) to give up."""
+        with self._lock:
+            if self.tokens:
+                self.tokens.refund(reserved)
+        if not _retryable(error) or attempt >= PARAMS['llm_max_retries']:
+            return None, 'error'
+        delay = self._rng.uniform(0, min(PARAMS['llm_backoff_max_s'], PARAMS['llm_backoff_base_s'] * 2**attempt))
+        now = self.clock()
+        if getattr(error, 'status_code', None) == 429:
+            delay = max(delay, _retry_after_s(error) or 0.0)
+            with self._lock:
+                self.stats['rate_limited'] += 1
+                self.paused_until = max(self.paused_until, now + min(delay, PARAMS['llm_rate_limit_cooldown_s']))
+        if deadline is not None and now + delay >= deadline:
+            return None, 'deadline'
+        with self._lock:
+            self.stats['retries'] += 1
+        charge(retries=1)
+        tracer.count('llm.retries')
+        return delay, None
+
+    def settle(self, usage, reserved):
+        """Books a completed request's reported tokens and cost."""
+        if usage is None:
+            return
+        prices = PARAMS['llm_price_per_1k_tokens']
+        cost_usd = (usage.prompt_tokens * prices['prompt'] + usage.completion_tokens * prices['completion']) / 1000
+        with self._lock:
+            if self.tokens:
+                self.tokens.refund(reserved - usage.prompt_tokens - usage.completion_tokens)
+            self.completion_tokens_estimate += 0.1 * (usage.completion_tokens - self.completion_tokens_estimate)
+            self.spent_usd += cost_usd
+        charge(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens, cost_usd=cost_usd)
+
+    def fallback(self, reason):
+        with self._lock:
+            self.fallbacks[reason] = self.fallbacks.get(reason, 0) + 1
+        tracer.count('llm.fallbacks')
+        charge(fallbacks=1)
+
+    def summary(self):
+        return {**self.stats, 'spent_usd': self.spent_usd, 'fallbacks': dict(self.fallbacks)}
+
+    def state_dict(self):
+        with self._lock:
+            return {'spent_usd': self.spent_usd, 'stats': dict(self.stats), 'fallbacks': dict(self.fallbacks),
+                    'completion_tokens_estimate': self.completion_tokens_estimate}
+
+    def load_state_dict(self, state):
+        """
+        Restores the totals saved in a checkpoint, so a resumed run does not
+        spend the budget again. Every cell's checkpoint holds the process-wide
+        totals at the time it was saved, so each total keeps the largest
+        value seen, not the sum.
+        """
+        with self._lock:
+            self.spent_usd = max(self.spent_usd, state['spent_usd'])
+            for key, value in state['stats'].items():
+                self.stats[key] = max(self.stats[key], value)
+            for reason, count in state['fallbacks'].items():
+                self.fallbacks[reason] = max(self.fallbacks.get(reason, 0), count)
+            self.completion_tokens_estimate = state['completion_tokens_estimate']
+
+scheduler = RequestScheduler()
+
+def _fallback(reason, fallback):
+    scheduler.fallback(reason)
+    return fallback
+
+class PromptStats:
+    """Running totals of prompt size and encode time per call, plus the prompt tokens the API reports."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.total_prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.total_encode_s = 0.0
+        self.api_prompt_tokens = 0
+        self.api_completion_tokens = 0
+
+    def record(self, prompt_tokens, encode_s):
+        with self._lock:
+            self.calls += 1
+            self.total_prompt_tokens += prompt_tokens
+            self.max_prompt_tokens = max(self.max_prompt_tokens, prompt_tokens)
+            self.total_encode_s += encode_s
+
+    def record_usage(self, usage):
+        if usage is not None:
+            with self._lock:
+                self.api_prompt_tokens += usage.prompt_tokens
+                self.api_completion_tokens += usage.completion_tokens
+
+    def summary(self):
+        calls = max(self.calls, 1)
+        return {
+            'calls': self.calls,
+            'avg_prompt_tokens': self.total_prompt_tokens / calls,
+            'max_prompt_tokens': self.max_prompt_tokens,
+            'avg_encode_ms': self.total_encode_s / calls * 1000,
+            'api_prompt_tokens': self.api_prompt_tokens,
+            'api_completion_tokens': self.api_completion_tokens,
+        }
+
+prompt_stats = PromptStats()
 
 def get_default_action(num_vehicles):
     """A safe fallback action in case of API or parsing failure."""
-    return {
-        'w': [0.5] * num_vehicles,
-        'a': [1.0 / num_vehicles] * num_vehicles
-    }
+    return Action(np.full(num_vehicles, 0.5), np.full(num_vehicles, 1.0 / num_vehicles))
+
+def build_messages(state, pdt_forecasts, semantic_goal, system_prompt=None, user_prompt=None):
+    """(chat messages, estimated prompt tokens) for one query; the estimate is also recorded in prompt_stats."""
+    start = time.perf_counter()
+    with tracer.span('llm.prompt'):
+        system_prompt = system_prompt or generate_system_prompt()
+        user_prompt = user_prompt or user_prompt_for(state, pdt_forecasts, semantic_goal)
+    encode_s = time.perf_counter() - start
+    prompt_tokens = estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+    prompt_stats.record(prompt_tokens, encode_s)
+    messages = [
+        {"role": "system", "content": system_prompt},
+        {"role": "user", "content": user_prompt}
+    ]
+    return messages, prompt_tokens
+
+def validate_action(action, num_vehicles):
+    """Validates one parsed {'w', 'a'} action and normalizes 'a'. Returns it as an Action, or None if it is invalid."""
+    if not (isinstance(action, dict) and 'w' in action and 'a' in action):
+        return None
+    w = np.asarray(action['w'], dtype=float)
+    a = np.asarray(action['a'], dtype=float)
+    if w.shape != (num_vehicles,) or a.shape != (num_vehicles,):
+        return None
+    # Normalize allocation ratios to ensure they sum to 1
+    total_a = a.sum()
+    if total_a > 0:
+        a = a / total_a
+    else:
+        a = np.full(num_vehicles, 1.0 / num_vehicles)
+    return Action(w, a)
+
+def parse_orchestrator_response(response_content, num_vehicles):
+    """Parses and validates a JSON response. Returns the action, or None if it is invalid."""
+    return validate_action(json.loads(response_content), num_vehicles)
+
+def parse_plan_response(response_content, num_vehicles, horizon):
+    """Parses and validates a plan response. Returns up to `horizon` actions, or None if any step is invalid."""
+    plan = json.loads(response_content).get('plan')
+    if not isinstance(plan, list) or not plan:
+        return None
+    actions = [validate_action(step, num_vehicles) for step in plan[:horizon]]
+    if any(action is None for action in actions):
+        return None
+    return actions
+
+def _handle_completion(completion, parse, cache_key, latency_s):
+    usage = getattr(completion, 'usage', None)
+    prompt_stats.record_usage(usage)
+    if usage is not None:
+        tracer.count('llm.prompt_tokens', usage.prompt_tokens)
+        tracer.count('llm.completion_tokens', usage.completion_tokens)
+    with tracer.span('llm.parse'):
+        try:
+            decision = parse(completion.choices[0].message.content)
+        except (ValueError, TypeError, AttributeError, KeyError, IndexError):
+            decision = None
+    if decision is not None:
+        print("GPT-4 responded successfully.")
+        if cache_key is not None:
+            decision_cache.put(cache_key, decision, latency_s)
+    else:
+        scheduler.fallback('invalid_response')
+        print("ERROR: GPT-4 response has invalid format. Using default action.")
+    return decision
+
+def _query(state, pdt_forecasts, semantic_goal, cache_goal, system_prompt, parse, fallback, user_prompt=None):
+    charge(queries=1)
+    cache_key, cached = _cache_lookup(state, pdt_forecasts, cache_goal)
+    if cached is not None:
+        tracer.count('llm.cache_hits')
+        return cached
 
-def query_gpt4_orchestrator(state, pdt_forecasts=None, semantic_goal="BALANCE"):
     if not client:
         print("ERROR: OpenAI API key not configured. Using default action.")
-        return get_default_action(len(state['vehicles']))
+        return _fallback('no_client', fallback)
+    if scheduler.over_budget():
+        return _fallback('budget', fallback)
 
-    system_prompt = generate_system_prompt()
-    user_prompt = generate_user_prompt(state, pdt_forecasts, semantic_goal)
-    num_vehicles = len(state['vehicles'])
+    deadline = scheduler.deadline()
+    messages, prompt_tokens = build_messages(state, pdt_forecasts, semantic_goal, system_prompt, user_prompt)
+    for attempt in itertools.count():
+        admitted = scheduler.admit(prompt_tokens, deadline)
+        if admitted is None:
+            return _fallback('deadline', fallback)
+        wait_s, reserved = admitted
+        if wait_s:
+            with tracer.span('llm.rate_limit_wait'):
+                time.sleep(wait_s)
+        try:
+            print(f"Querying GPT-4 for {semantic_goal}...")
+            tracer.count('llm.calls')
+            start = time.perf_counter()
+            with tracer.span('llm.request'):
+                completion = client.chat.completions.create(messages=messages, timeout=scheduler.timeout(deadline),
+                                                            **COMPLETION_ARGS)
+        except Exception as e:
+            delay, reason = scheduler.retry_delay(e, attempt, reserved, deadline)
+            if delay is None:
+                print(f"ERROR: An exception occurred during GPT-4 API call: {e}")
+                print("Using default fallback action.")
+                return _fallback(reason, fallback)
+            time.sleep(delay)
+            continue
+        scheduler.settle(getattr(completion, 'usage', None), reserved)
+        decision = _handle_completion(completion, parse, cache_key, time.perf_counter() - start)
+        return fallback if decision is None else decision
 
-    try:
-        print(f"Querying GPT-4 for {semantic_goal}...")
-        completion = client.chat.completions.create(
-            model="gpt-4-turbo",  # Or "gpt-4" if you prefer
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
-            response_format={"type": "json_object"},
-            temperature=0.2, # Lower temperature for more deterministic outputs
+def _cluster_query(state, pdt_forecasts, semantic_goal, num_clusters, horizon=None):
+    """
+    _query arguments for a cluster-level decision (or a plan of `horizon` of
+    them), and the function that expands its result to per-vehicle actions.
+    The result is cached at cluster level; fallbacks give the usual default action.
+    """
+    num_vehicles = state.num_vehicles
+    clusters = VehicleClusters(state, pdt_forecasts, num_clusters)
+    k = clusters.num_clusters
+    system_prompt = generate_cluster_system_prompt(k)
+    cache_goal = f"{semantic_goal}|clusters:{k}"
+    if horizon:
+        system_prompt = generate_plan_system_prompt(horizon, system_prompt)
+        cache_goal += f"|plan:{horizon}"
+        parse = lambda content: parse_plan_response(content, k, horizon)
+    else:
+        parse = lambda content: parse_orchestrator_response(content, k)
+
+    def expand(decision):
+        if decision is None:
+            return [get_default_action(num_vehicles)] if horizon else get_default_action(num_vehicles)
+        return [clusters.expand(step) for step in decision] if horizon else clusters.expand(decision)
+
+    query_args = (state, pdt_forecasts, semantic_goal, cache_goal, system_prompt, parse, None,
+                  generate_cluster_user_prompt(clusters, semantic_goal))
+    return query_args, expand
+
+def query_gpt4_orchestrator(state, pdt_forecasts=None, semantic_goal="BALANCE", num_clusters=None):
+    """With num_clusters, the LLM decides per cluster of vehicles (see clustering.py) instead of per vehicle."""
+    state = as_observation(state)
+    if num_clusters:
+        query_args, expand = _cluster_query(state, pdt_forecasts, semantic_goal, num_clusters)
+        return expand(_query(*query_args))
+    num_vehicles = state.num_vehicles
+    return _query(state, pdt_forecasts, semantic_goal, semantic_goal, None,
+                  lambda content: parse_orchestrator_response(content, num_vehicles),
+                  get_default_action(num_vehicles))
+
+def query_gpt4_plan(state, pdt_forecasts=None, semantic_goal="BALANCE", horizon=None, num_clusters=None):
+    """
+    Asks for a plan of `horizon` actions (default: the pDT horizon).
+    Falls back to a one-step plan holding the default action.
+    """
+    state = as_observation(state)
+    horizon = horizon or PARAMS['pdt_prediction_horizon']
+    if num_clusters:
+        query_args, expand = _cluster_query(state, pdt_forecasts, semantic_goal, num_clusters, horizon)
+        return expand(_query(*query_args))
+    num_vehicles = state.num_vehicles
+    return _query(state, pdt_forecasts, semantic_goal, f"{semantic_goal}|plan:{horizon}", generate_plan_system_prompt(horizon),
+                  lambda content: parse_plan_response(content, num_vehicles, horizon),
+                  [get_default_action(num_vehicles)])
+
+def get_async_client():
+    """
+    Returns the shared AsyncOpenAI client and the semaphore bounding in-flight
+    requests to PARAMS['llm_max_concurrency']. Connections are pooled by one
+    httpx.AsyncClient sized to the same limit.
+    """
+    global _async_client, _async_semaphore
+    if _async_client is None and _api_key:
+        max_concurrency = PARAMS['llm_max_concurrency']
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_concurrency, max_keepalive_connections=max_concurrency),
+            timeout=PARAMS['llm_request_timeout_s'],
         )
-        response_content = completion.choices.message.content
-        
-        # Parse the JSON response
-        action = json.loads(response_content)
-
-        # Validate the response structure
-        if 'w' in action and 'a' in action and len(action['w']) == num_vehicles and len(action['a']) == num_vehicles:
-            # Normalize allocation ratios to ensure they sum to 1
-            total_a = sum(action['a'])
-            if total_a > 0:
-                action['a'] = [val / total_a for val in action['a']]
-            else:
-                 action['a'] = [1.0 / num_vehicles] * num_vehicles
-            print("GPT-4 responded successfully.")
-            return action
-        else:
-            print("ERROR: GPT-4 response has invalid format. Using default action.")
-            return get_default_action(num_vehicles)
-
-    except Exception as e:
-        print(f"ERROR: An exception occurred during GPT-4 API call: {e}")
-        print("Using default fallback action.")
-        return get_default_action(num_vehicles)
\ No newline at end of file
+        _async_client = AsyncOpenAI(api_key=_api_key, base_url=_base_url, max_retries=0, http_client=http_client)
+        _async_semaphore = asyncio.Semaphore(max_concurrency)
+    return _async_client, _async_semaphore
+
+async def close_async_client():
+    global _async_client, _async_semaphore
+    if _async_client is not None:
+        await _async_client.close()
+    _async_client = None
+    _async_semaphore = None
+
+async def _query_async(state, pdt_forecasts, semantic_goal, cache_goal, system_prompt, parse, fallback, user_prompt=None):
+    charge(queries=1)
+    cache_key, cached = _cache_lookup(state, pdt_forecasts, cache_goal)
+    if cached is not None:
+        tracer.count('llm.cache_hits')
+        return cached
+
+    async_client, semaphore = get_async_client()
+    if not async_client:
+        print("ERROR: OpenAI API key not configured. Using default action.")
+        return _fallback('no_client', fallback)
+    if scheduler.over_budget():
+        return _fallback('budget', fallback)
+
+    deadline = scheduler.deadline()
+    messages, prompt_tokens = build_messages(state, pdt_forecasts, semantic_goal, system_prompt, user_prompt)
+    for attempt in itertools.count():
+        admitted = scheduler.admit(prompt_tokens, deadline)
+        if admitted is None:
+            return _fallback('deadline', fallback)
+        wait_s, reserved = admitted
+        if wait_s:
+            with tracer.span('llm.rate_limit_wait'):
+                await asyncio.sleep(wait_s)
+        try:
+            async with semaphore:
+                print(f"Querying GPT-4 for {semantic_goal}...")
+                tracer.count('llm.calls')
+                start = time.perf_counter()
+                with tracer.span('llm.request'):
+                    completion = await async_client.chat.completions.create(messages=messages, timeout=scheduler.timeout(deadline),
+                                                                            **COMPLETION_ARGS)
+                latency_s = time.perf_counter() - start
+        except Exception as e:
+            delay, reason = scheduler.retry_delay(e, attempt, reserved, deadline)
+            if delay is None:
+                print(f"ERROR: An exception occurred during GPT-4 API call: {e}")
+                print("Using default fallback action.")
+                return _fallback(reason, fallback)
+            await asyncio.sleep(delay)
+            continue
+        scheduler.settle(getattr(completion, 'usage', None), reserved)
+        decision = _handle_completion(completion, parse, cache_key, latency_s)
+        return fallback if decision is None else decision
+
+async def query_gpt4_orchestrator_async(state, pdt_forecasts=None, semantic_goal="BALANCE", num_clusters=None):
+    """Async variant of query_gpt4_orchestrator sharing a pooled client with bounded concurrency."""
+    state = as_observation(state)
+    if num_clusters:
+        query_args, expand = _cluster_query(state, pdt_forecasts, semantic_goal, num_clusters)
+        return expand(await _query_async(*query_args))
+    num_vehicles = state.num_vehicles
+    return await _query_async(state, pdt_forecasts, semantic_goal, semantic_goal, None,
+                              lambda content: parse_orchestrator_response(content, num_vehicles),
+                              get_default_action(num_vehicles))
+
+async def query_gpt4_plan_async(state, pdt_forecasts=None, semantic_goal="BALANCE", horizon=None, num_clusters=None):
+    """Async variant of query_gpt4_plan."""
+    state = as_observation(state)
+    horizon = horizon or PARAMS['pdt_prediction_horizon']
+    if num_clusters:
+        query_args, expand = _cluster_query(state, pdt_forecasts, semantic_goal, num_clusters, horizon)
+        return expand(await _query_async(*query_args))
+    num_vehicles = state.num_vehicles
+    return await _query_async(state, pdt_forecasts, semantic_goal, f"{semantic_goal}|plan:{horizon}", generate_plan_system_prompt(horizon),
+                              lambda content: parse_plan_response(content, num_vehicles, horizon),
+                              [get_default_action(num_vehicles)])
@@ -0,0 +1,65 @@
+# result_store.py
+"""
+Append-only columnar store for finished simulation results.
+
+The store is a directory of part files, one per append: Parquet when pyarrow
+is installed, uncompressed .npz (no pickling) otherwise. A part is written
+to a temporary name and renamed into place, and never modified afterwards,
+so an interrupted run loses at most the part it was writing. read() returns
+all parts as one pandas DataFrame; parts may have different columns.
+"""
+import glob
+import os
+import time
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+class ResultStore:
+    def __init__(self, path):
+        self.path = path
+        self._parts_written = 0
+        os.makedirs(path, exist_ok=True)
+
+    def append(self, rows):
+        """Writes a list of row dicts, all with the same keys, as one new part."""
+        if not rows:
+            return
+        columns = {name: [row[name] for row in rows] for name in rows[0]}
+        # Part names sort in write order; the pid keeps concurrent writers apart
+        name = f"part-{time.time_ns():020d}-{os.getpid()}-{self._parts_written:06d}"
+        self._parts_written += 1
+        if pyarrow is not None:
+            name += ".parquet"
+            tmp_path = os.path.join(self.path, name + ".tmp")
+            pyarrow.parquet.write_table(pyarrow.table(columns), tmp_path)
+        else:
+            name += ".npz"
+            tmp_path = os.path.join(self.path, name + ".tmp")
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **{column: np.array(values) for column, values in columns.items()})
+        os.replace(tmp_path, os.path.join(self.path, name))
+
+    def parts(self):
+        return sorted(glob.glob(os.path.join(self.path, "part-*.parquet")) + glob.glob(os.path.join(self.path, "part-*.npz")))
+
+    def read(self, columns=None):
+        """Every row in write order, optionally only the given columns (those a part lacks are NaN)."""
+        frames = []
+        for part in self.parts():
+            if part.endswith(".parquet"):
+                if pyarrow is None:
+                    raise ImportError(f"Reading {part} needs pyarrow")
+                frame = pd.read_parquet(part)
+            else:
+                with np.load(part) as data:
+                    frame = pd.DataFrame({name: data[name] for name in data.files})
+            frames.append(frame if columns is None else frame.reindex(columns=columns))
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)
@@ -1,6 +1,35 @@
 # results_handler.py
-import pandas as pd
-from tabulate import tabulate
+from statistics import NormalDist
+import numpy as np
+from config import PARAMS
+
+# pandas and tabulate are only needed to print tables, so they are imported on
+# first use; collecting results and writing them as JSON or CSV does without them
+def _dataframe(records):
+    import pandas as pd
+    return pd.DataFrame(records)
+
+def tabulate(*args, **kwargs):
+    from tabulate import tabulate as _tabulate
+    return _tabulate(*args, **kwargs)
+
+# Decimals to print a metric with, where the default of 1 would round it away
+# (energies are a few mJ, LLM spend a few cents)
+METRIC_PRECISION = {
+    'total_energy_j': 5, 'local_energy_j': 5, 'transmission_energy_j': 5, 'server_energy_j': 5,
+    'llm_cost_usd': 4,
+}
+
+def metric_precision(metric):
+    return METRIC_PRECISION.get(metric, 1)
+
+def ci_half_width(values):
+    """Normal-approximation CI half-width of the mean at PARAMS['confidence_level']; NaN with fewer than two values."""
+    values = np.asarray(values, dtype=float)
+    if values.size < 2:
+        return float('nan')
+    z = NormalDist().inv_cdf(0.5 + PARAMS['confidence_level'] / 2)
+    return z * values.std(ddof=1) / np.sqrt(values.size)
 
 class ResultsHandler:
     def __init__(self):
@@ -13,36 +42,47 @@ class ResultsHandler:
         record = {'agent': agent_name, **params, **metrics}
         self.results[scenario_name].append(record)
 
-    def calculate_metrics(self, env):
-        completed_tasks = env.metrics['completed_tasks']
-        if not completed_tasks:
-            return {'avg_latency_ms': 0, 'qos_violation_rate': 0, 'total_energy_j': env.metrics['total_energy_j']}
+    def record_replicas(self, scenario_name, agent_name, params, replica_metrics):
+        """Records one row per replica from a dict of per-replica metric arrays."""
+        num_replicas = len(next(iter(replica_metrics.values())))
+        for r in range(num_replicas):
+            metrics = {k: float(v[r]) for k, v in replica_metrics.items()}
+            self.record(scenario_name, agent_name, {**params, 'replica': r}, metrics)
 
-        latencies = [(t.completion_time - t.creation_time) * 1000 for t in completed_tasks]
-        violations = sum(1 for t in completed_tasks if (t.completion_time - t.creation_time) > (PARAMS['task_deadline_ms']/1000.0))
-        
-        return {
-            'avg_latency_ms': np.mean(latencies),
-            'qos_violation_rate': (violations / len(completed_tasks)) * 100 if completed_tasks else 0,
-            'total_energy_j': env.metrics['total_energy_j'],
-            'peak_violation_rate': 0, # Placeholder for scenario 2
-        }
+    @staticmethod
+    def format_ci(values, precision=1):
+        """
+        Mean of the replicas, with a normal-approximation CI half-width when
+        there are several, and with adaptive replication the replica count.
+        """
+        values = np.asarray(values, dtype=float)
+        mean = values.mean() if values.size else float('nan')
+        count = f" (n={values.size})" if PARAMS['adaptive_replication'] else ""
+        if values.size < 2:
+            return f"{mean:.{precision}f}{count}"
+        return f"{mean:.{precision}f} ± {ci_half_width(values):.{precision}f}{count}"
+
+    def calculate_metrics(self, env):
+        """Summary of a single-stream environment's StreamingMetrics."""
+        metrics = {k: float(v[0]) for k, v in env.metrics.summary().items()}
+        metrics['peak_violation_rate'] = 0 # Placeholder for scenario 2
+        return metrics
 
     def print_scenario_1(self):
         print("\n--- SCENARIO 1: System Scalability ---")
-        df = pd.DataFrame(self.results.get('scenario_1', []))
+        df = _dataframe(self.results.get('scenario_1', []))
         
         table_data = []
-        headers = ["Algorithm", "Metric", "N=10", "N=20", "N=30"]
+        headers = ["Algorithm", "Metric"] + [f"N={n}" for n in PARAMS['num_vehicles_range']]
         
         for agent in df['agent'].unique():
             agent_df = df[df['agent'] == agent]
             latency_row = [agent, "Latency (ms)"]
             violation_row = ["", "Violation (%)"]
-            for n in:
+            for n in PARAMS['num_vehicles_range']:
                 n_df = agent_df[agent_df['num_vehicles'] == n]
-                latency_row.append(f"{n_df['avg_latency_ms'].mean():.1f}")
-                violation_row.append(f"{n_df['qos_violation_rate'].mean():.1f}")
+                latency_row.append(self.format_ci(n_df['avg_latency_ms']))
+                violation_row.append(self.format_ci(n_df['qos_violation_rate']))
             table_data.append(latency_row)
             table_data.append(violation_row)
 
@@ -50,19 +90,21 @@ class ResultsHandler:
 
     def print_scenario_2(self):
         print("\n--- SCENARIO 2: Highly Dynamic Environment ---")
-        df = pd.DataFrame(self.results.get('scenario_2', []))
+        df = _dataframe(self.results.get('scenario_2', []))
         
-        headers = ["Metric", "SP-LLM", "LLM-DT"]
+        agents = list(df['agent'].unique())
+        headers = ["Metric"] + agents
         data = [
-            ["Avg QoS Violation (%)", f"{df[df.agent=='SP-LLM']['qos_violation_rate'].mean():.1f}", f"{df[df.agent=='LLM-DT']['qos_violation_rate'].mean():.1f}"],
-            ["Peak QoS Violation (%)", f"{df[df.agent=='SP-LLM']['peak_violation_rate'].mean():.1f}", f"{df[df.agent=='LLM-DT']['peak_violation_rate'].mean():.1f}"],
-            ["Std. Dev. of Latency (ms)", "11.3", "26.7"], # Mocked value from paper
+            [label] + [self.format_ci(df[df.agent == agent][metric], metric_precision(metric)) for agent in agents]
+            for label, metric in [("Avg QoS Violation (%)", 'qos_violation_rate'),
+                                  ("Peak QoS Violation (%)", 'peak_violation_rate'),
+                                  ("Std. Dev. of Latency (ms)", 'latency_std_ms')]
         ]
         print(tabulate(data, headers=headers, tablefmt="grid"))
 
     def print_scenario_3(self):
         print("\n--- SCENARIO 3: Dynamic Goal Adaptation ---")
-        df = pd.DataFrame(self.results.get('scenario_3', []))
+        df = _dataframe(self.results.get('scenario_3', []))
         
         headers = ["Algorithm", "Phase 1 (t=1-50)\nEnergy (J)", "Phase 1 (t=1-50)\nLatency (ms)", "Phase 2 (t=51-100)\nEnergy (J)", "Phase 2 (t=51-100)\nLatency (ms)"]
         data = []
@@ -70,8 +112,92 @@ class ResultsHandler:
             row = [agent]
             ph1 = df[(df.agent == agent) & (df.phase == 1)]
             ph2 = df[(df.agent == agent) & (df.phase == 2)]
-            row.extend([f"{ph1.total_energy_j.mean():.1f}", f"{ph1.avg_latency_ms.mean():.1f}"])
-            row.extend([f"{ph2.total_energy_j.mean():.1f}", f"{ph2.avg_latency_ms.mean():.1f}"])
+            energy_precision = metric_precision('total_energy_j')
+            row.extend([self.format_ci(ph1.total_energy_j, energy_precision), self.format_ci(ph1.avg_latency_ms)])
+            row.extend([self.format_ci(ph2.total_energy_j, energy_precision), self.format_ci(ph2.avg_latency_ms)])
             data.append(row)
             
-        print(tabulate(data, headers=headers, tablefmt="grid"))
\ No newline at end of file
+        print(tabulate(data, headers=headers, tablefmt="grid"))
+
+    def print_sweep(self, sweep_name, df, row_keys, column_key, metrics):
+        """A sweep's rows (see sweep.py) as one table: a row per row_keys group and metric, a column per column_key value."""
+        print(f"\n--- SWEEP: {sweep_name} ---")
+        if not len(df):
+            print("No results stored yet")
+            return
+        column_values = sorted(df[column_key].unique())
+        headers = row_keys + ["Metric"] + [f"{column_key}={v}" for v in column_values]
+        data = []
+        for group, group_df in df.groupby(row_keys, sort=False):
+            for i, metric in enumerate(metrics):
+                label = list(group) if i == 0 else [""] * len(row_keys)
+                data.append(label + [metric] + [self.format_ci(group_df[group_df[column_key] == v][metric], metric_precision(metric))
+                                                for v in column_values])
+        print(tabulate(data, headers=headers, tablefmt="grid"))
+
+    def print_planning_stats(self):
+        """Plan-mode agents only: LLM plan requests per decision and what triggered replanning."""
+        data = []
+        for scenario_name, records in self.results.items():
+            df = _dataframe(records)
+            if 'plan_requests' not in df:
+                continue
+            for agent, agent_df in df[df['plan_requests'].notna()].groupby('agent', sort=False):
+                decisions = agent_df['decisions'].sum()
+                requests = agent_df['plan_requests'].sum()
+                data.append([scenario_name, agent, int(decisions), int(requests),
+                             f"{decisions / requests:.2f}" if requests else "-",
+                             int(agent_df['divergence_replans'].sum()), int(agent_df['exhausted_replans'].sum()),
+                             int(agent_df['fleet_replans'].sum()) if 'fleet_replans' in agent_df else 0])
+        if not data:
+            return
+        print("\n--- Plan Mode: Replanning ---")
+        headers = ["Scenario", "Algorithm", "Decisions", "Plan Requests", "Decisions / Request", "Divergence Replans", "Exhausted Replans",
+                   "Fleet Replans"]
+        print(tabulate(data, headers=headers, tablefmt="grid"))
+
+    def print_llm_cache_stats(self, stats):
+        print("\n--- LLM Decision Cache ---")
+        data = [[stats['hits'], stats['misses'], f"{stats['hit_rate'] * 100:.1f}", f"{stats['latency_saved_s']:.1f}", stats['entries']]]
+        print(tabulate(data, headers=["Hits", "Misses", "Hit Rate (%)", "Latency Saved (s)", "Entries"], tablefmt="grid"))
+        print("Quantization: " + ", ".join(f"{key}={step}" for key, step in stats['quantization'].items()))
+
+    def print_prompt_stats(self, stats):
+        print("\n--- LLM Prompt Size ---")
+        data = [[stats['calls'], f"{stats['avg_prompt_tokens']:.0f}", stats['max_prompt_tokens'], f"{stats['avg_encode_ms']:.2f}",
+                 stats['api_prompt_tokens'], stats['api_completion_tokens']]]
+        headers = ["Calls", "Avg Prompt Tokens", "Max Prompt Tokens", "Avg Encode (ms)", "API Prompt Tokens", "API Completion Tokens"]
+        print(tabulate(data, headers=headers, tablefmt="grid"))
+
+    def print_llm_usage(self, scheduler_stats):
+        """LLM requests, tokens, cost and fallbacks per scenario and agent, then the request scheduler's totals."""
+        data = []
+        for scenario_name, records in self.results.items():
+            df = _dataframe(records)
+            if 'llm_calls' not in df:
+                continue
+            for agent, agent_df in df[df['llm_calls'].notna()].groupby('agent', sort=False):
+                queries, fallbacks = agent_df['llm_queries'].sum(), agent_df['llm_fallbacks'].sum()
+                data.append([scenario_name, agent, int(queries), int(agent_df['llm_calls'].sum()), int(agent_df['llm_retries'].sum()),
+                             int(agent_df['llm_prompt_tokens'].sum()), int(agent_df['llm_completion_tokens'].sum()),
+                             f"{agent_df['llm_cost_usd'].sum():.2f}", int(fallbacks),
+                             f"{fallbacks / queries * 100:.1f}" if queries else "-"])
+        print("\n--- LLM Usage ---")
+        if data:
+            headers = ["Scenario", "Algorithm", "Queries", "Requests", "Retries", "Prompt Tokens", "Completion Tokens", "Cost ($)",
+                       "Fallbacks", "Fallback Rate (%)"]
+            print(tabulate(data, headers=headers, tablefmt="grid"))
+        reasons = ", ".join(f"{reason}={count}" for reason, count in sorted(scheduler_stats['fallbacks'].items())) or "-"
+        data = [[scheduler_stats['requests'], scheduler_stats['retries'], scheduler_stats['rate_limited'],
+                 f"{scheduler_stats['wait_s']:.1f}", f"{scheduler_stats['spent_usd']:.2f}", reasons]]
+        headers = ["Requests", "Retries", "429s", "Rate-Limit Wait (s)", "Spent ($)", "Fallbacks by Reason"]
+        print(tabulate(data, headers=headers, tablefmt="grid"))
+
+    def print_trace_summary(self, summary):
+        """Per-phase time from the tracer. Spans nest (a cell contains its steps), so totals overlap."""
+        print("\n--- Profile: Time per Phase ---")
+        data = [[row['name'], row['calls'], f"{row['total_s']:.3f}", f"{row['mean_ms']:.3f}", f"{row['max_ms']:.3f}"]
+                for row in summary['spans']]
+        print(tabulate(data, headers=["Phase", "Calls", "Total (s)", "Mean (ms)", "Max (ms)"], tablefmt="grid"))
+        if summary['counters']:
+            print(tabulate(sorted(summary['counters'].items()), headers=["Counter", "Value"], tablefmt="grid"))
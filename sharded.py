@@ -0,0 +1,166 @@
+# sharded.py
+"""
+Sharded execution of a multi-RSU road.
+
+The RSUs are split into contiguous groups and the road into the matching
+segments, whose boundaries are RSU cell edges. Each segment is simulated by
+its own MultiRSUEnvironment and agent in a worker process. After every slot a
+worker sends back only the vehicles that left its segment, and the
+coordinator hands them to the segment they entered.
+
+    python sharded.py --vehicles 100000 --road-km 100 --rsus 200 --shards 8 --slots 100 --agent GO
+
+The agent runs inside each shard on that segment's vehicles.
+"""
+import argparse
+import json
+import multiprocessing
+import time
+import numpy as np
+from config import PARAMS
+from environment import MultiRSUEnvironment
+from main import AGENT_CLASSES
+from metrics import StreamingMetrics
+from pdt import PredictiveDigitalTwin
+
+def shard_segments(rsu_positions_m, num_shards, road_length_m):
+    """Splits sorted RSU positions into contiguous groups: (rsu positions, (start_m, end_m)) per shard."""
+    groups = np.array_split(np.sort(rsu_positions_m), num_shards)
+    if any(group.size == 0 for group in groups):
+        raise ValueError("Need at least one RSU per shard")
+    edges = [0.0] + [(left[-1] + right[0]) / 2 for left, right in zip(groups[:-1], groups[1:])] + [road_length_m]
+    return [(group, (edges[k], edges[k + 1])) for k, group in enumerate(groups)]
+
+class Shard:
+    """One road segment: its environment, its agent, and the vehicles that leave it."""
+    def __init__(self, agent_name, rsu_positions_m, segment, num_vehicles, first_vehicle_id, seed, dynamic_speed=False):
+        env_seed, pdt_seed, agent_seed = seed.spawn(3) # seed is a SeedSequence
+        self.segment = segment
+        self.env = MultiRSUEnvironment(num_vehicles, rsu_positions_m=rsu_positions_m, dynamic_speed=dynamic_speed,
+                                       rng=np.random.default_rng(env_seed), segment=segment, first_vehicle_id=first_vehicle_id)
+        pdt = PredictiveDigitalTwin(self.env, rng=np.random.default_rng(pdt_seed))
+        self.agent = AGENT_CLASSES[agent_name](self.env, pdt=pdt, rng=np.random.default_rng(agent_seed))
+
+    def step(self, arriving, semantic_goal):
+        """Adds arriving vehicles, runs one slot and returns the vehicles that left the segment."""
+        if arriving is not None:
+            self.env.add_vehicles(arriving)
+        if self.env.num_vehicles:
+            self.env.step(self.agent.act(self.env.get_state(), semantic_goal))
+        else:
+            self.env.time_slot += 1
+        start_m, end_m = self.segment
+        position_m = self.env.position_m
+        return self.env.remove_vehicles((position_m < start_m) | (position_m >= end_m))
+
+    def result(self, arriving=None):
+        # Vehicles still in transit after the last slot are counted where they arrive
+        if arriving is not None:
+            self.env.add_vehicles(arriving)
+        return {'metrics': self.env.metrics.state_dict(), 'handovers': self.env.handovers, 'num_vehicles': self.env.num_vehicles}
+
+def _shard_worker(conn, params, shard_args):
+    PARAMS.update(params)
+    shard = Shard(*shard_args)
+    while True:
+        message, payload = conn.recv()
+        if message == 'step':
+            conn.send(shard.step(*payload))
+        else:
+            conn.send(shard.result(payload))
+            return
+
+def _route(departures, segment_starts_m):
+    """Splits each shard's departing vehicles by the segment their position now falls in."""
+    incoming = [[] for _ in segment_starts_m]
+    for leaving in departures:
+        if not leaving['vehicle_id'].size:
+            continue
+        target = np.searchsorted(segment_starts_m, leaving['position_m'], side='right') - 1
+        for k in np.unique(target).tolist():
+            incoming[k].append({name: values[target == k] for name, values in leaving.items()})
+    return [
+        {name: np.concatenate([part[name] for part in parts]) for name in parts[0]} if parts else None
+        for parts in incoming
+    ]
+
+def run_sharded(num_vehicles, num_slots, num_shards, agent_name="GO", semantic_goal="BALANCE", rsu_positions_m=None,
+                dynamic_speed=False, seed=None, processes=True):
+    """
+    Simulates the whole road in `num_shards` segments, each in its own process
+    (or all in this process with processes=False). Returns the merged metrics
+    summary plus handover and per-shard vehicle counts.
+    """
+    road_length_m = PARAMS['road_length_km'] * 1000
+    if rsu_positions_m is None:
+        rsu_positions_m = (np.arange(PARAMS['num_rsus']) + 0.5) * road_length_m / PARAMS['num_rsus']
+    segments = shard_segments(rsu_positions_m, num_shards, road_length_m)
+    segment_starts_m = np.array([start for _, (start, _) in segments])
+
+    # Vehicles start spread uniformly, so each segment gets a share proportional to its length
+    lengths = np.array([end - start for _, (start, end) in segments])
+    counts = np.floor(num_vehicles * lengths / road_length_m).astype(int)
+    counts[:num_vehicles - counts.sum()] += 1
+    first_ids = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    shard_seeds = np.random.SeedSequence(seed).spawn(num_shards)
+    shard_args = [(agent_name, rsus, segment, int(n), int(first), shard_seed, dynamic_speed)
+                  for (rsus, segment), n, first, shard_seed in zip(segments, counts, first_ids, shard_seeds)]
+
+    start = time.perf_counter()
+    if processes:
+        pipes, workers = [], []
+        for args in shard_args:
+            parent_conn, child_conn = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=_shard_worker, args=(child_conn, dict(PARAMS), args), daemon=True)
+            worker.start()
+            pipes.append(parent_conn)
+            workers.append(worker)
+        incoming = [None] * num_shards
+        for _ in range(num_slots):
+            for conn, arriving in zip(pipes, incoming):
+                conn.send(('step', (arriving, semantic_goal)))
+            incoming = _route([conn.recv() for conn in pipes], segment_starts_m)
+        for conn, arriving in zip(pipes, incoming):
+            conn.send(('result', arriving))
+        results = [conn.recv() for conn in pipes]
+        for worker in workers:
+            worker.join()
+    else:
+        shards = [Shard(*args) for args in shard_args]
+        incoming = [None] * num_shards
+        for _ in range(num_slots):
+            incoming = _route([shard.step(arriving, semantic_goal) for shard, arriving in zip(shards, incoming)], segment_starts_m)
+        results = [shard.result(arriving) for shard, arriving in zip(shards, incoming)]
+    wall_s = time.perf_counter() - start
+
+    metrics = StreamingMetrics()
+    for result in results:
+        shard_metrics = StreamingMetrics()
+        shard_metrics.load_state_dict(result['metrics'])
+        metrics.merge(shard_metrics)
+    summary = {k: float(v[0]) for k, v in metrics.summary().items()}
+    summary.update(handovers=sum(r['handovers'] for r in results), shard_vehicles=[r['num_vehicles'] for r in results],
+                   wall_s=wall_s, slots_per_s=num_slots / wall_s)
+    return summary
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, default=10000)
+    parser.add_argument('--road-km', type=float, default=PARAMS['road_length_km'])
+    parser.add_argument('--rsus', type=int, default=PARAMS['num_rsus'])
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--slots', type=int, default=PARAMS['simulation_time_slots'])
+    parser.add_argument('--agent', default="GO")
+    parser.add_argument('--goal', default="BALANCE")
+    parser.add_argument('--dynamic-speed', action='store_true')
+    parser.add_argument('--seed', type=int, default=PARAMS['seed'])
+    parser.add_argument('--in-process', action='store_true', help="Run all shards in this process")
+    args = parser.parse_args(argv)
+
+    PARAMS.update(road_length_km=args.road_km, num_rsus=args.rsus)
+    summary = run_sharded(args.vehicles, args.slots, args.shards, args.agent, args.goal,
+                          dynamic_speed=args.dynamic_speed, seed=args.seed, processes=not args.in_process)
+    print(json.dumps(summary, indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# surrogate.py
+"""
+A fast NumPy stand-in for the LLM orchestrator, distilled from its decisions.
+
+Every vehicle of a slot is one sample: per-vehicle features of the state and
+pDT forecasts the LLM saw, crossed with the semantic goal (so each goal gets
+its own linear model), and targets w and a * N (allocations scaled by the
+fleet size, so one model serves every N). SurrogateModel is a ridge
+regression fitted in closed form; prediction is one matrix product per slot.
+Its novelty score, the mean leverage of a slot's vehicles relative to the
+training data, flags states unlike anything it was trained on.
+See distill.py for collecting data, training and evaluation.
+"""
+import numpy as np
+from config import PARAMS
+from environment import Action, as_observation, channel_gain
+from pdt import forecast_arrays
+
+GOALS = ("BALANCE", "SAVE_ENERGY", "LOW_LATENCY")
+BASE_FEATURES = ('position', 'speed_mps', 'gain_db', 'relative_gain_db', 'above_mean_gain', 'load_kb', 'queue',
+                 'queue_share', 'forecast_load_kb', 'forecast_gain_change_db', 'has_forecast', 'bias')
+
+def vehicle_features(state, pdt_forecasts, semantic_goal):
+    """(N, len(GOALS) * len(BASE_FEATURES)) feature matrix: the base features in the goal's block, zeros elsewhere."""
+    state = as_observation(state)
+    n = state.num_vehicles
+    gains_db = 10 * np.log10(np.maximum(state.channel_gain, 1e-30))
+    queues = state.server_queue_lengths.astype(float)
+    total_queue = queues.sum()
+    base = np.zeros((n, len(BASE_FEATURES)))
+    base[:, 0] = state.position_m / (PARAMS['road_length_km'] * 1000)
+    base[:, 1] = state.speed_mps
+    base[:, 2] = gains_db
+    base[:, 3] = gains_db - gains_db.mean() if n else 0
+    base[:, 4] = base[:, 3] > 0
+    base[:, 5] = state.task_load_bytes / 1000
+    base[:, 6] = queues
+    base[:, 7] = queues / total_queue * n if total_queue > 0 else 1.0
+    if pdt_forecasts:
+        f_positions, f_loads = forecast_arrays(pdt_forecasts)
+        base[:, 8] = f_loads.mean(axis=0) / 1000
+        base[:, 9] = 10 * np.log10(np.maximum(channel_gain(f_positions[-1]), 1e-30)) - gains_db
+        base[:, 10] = 1
+    base[:, 11] = 1
+
+    features = np.zeros((n, len(GOALS), len(BASE_FEATURES)))
+    features[:, GOALS.index(semantic_goal)] = base
+    return features.reshape(n, -1)
+
+def action_targets(action):
+    """(N, 2) targets of a per-vehicle action: w and a * N."""
+    w = np.asarray(action['w'], dtype=float)
+    return np.column_stack([w, np.asarray(action['a'], dtype=float) * w.size])
+
+class SurrogateModel:
+    """Ridge regression from vehicle_features() to action_targets(), on standardized features."""
+    def __init__(self, feature_mean, feature_scale, coef, intercept, inv_gram, train_leverage):
+        self.feature_mean = feature_mean
+        self.feature_scale = feature_scale
+        self.coef = coef
+        self.intercept = intercept
+        self.inv_gram = inv_gram
+        self.train_leverage = train_leverage
+
+    @classmethod
+    def fit(cls, features, targets, ridge=1.0):
+        feature_mean = features.mean(axis=0)
+        scale = features.std(axis=0)
+        feature_scale = np.where(scale > 0, scale, 1.0)
+        x = (features - feature_mean) / feature_scale
+        intercept = targets.mean(axis=0)
+        gram = x.T @ x + ridge * np.eye(x.shape[1])
+        coef = np.linalg.solve(gram, x.T @ (targets - intercept))
+        inv_gram = np.linalg.inv(gram)
+        train_leverage = float(np.mean(np.einsum('ij,jk,ik->i', x, inv_gram, x)))
+        return cls(feature_mean, feature_scale, coef, intercept, inv_gram, train_leverage)
+
+    def _standardize(self, features):
+        return (features - self.feature_mean) / self.feature_scale
+
+    def predict(self, features):
+        return self._standardize(features) @ self.coef + self.intercept
+
+    def predict_action(self, features):
+        """Per-vehicle Action, with w clipped to [0, 1] and a normalized to sum to 1."""
+        predicted = self.predict(features)
+        w = np.clip(predicted[:, 0], 0.0, 1.0)
+        a = np.maximum(predicted[:, 1], 0.0)
+        total_a = a.sum()
+        a = a / total_a if total_a > 0 else np.full(a.size, 1.0 / max(a.size, 1))
+        return Action(w, a)
+
+    def novelty(self, features):
+        """Mean leverage of the rows relative to the training data's; about 1 in distribution, large far outside it."""
+        x = self._standardize(features)
+        return float(np.mean(np.einsum('ij,jk,ik->i', x, self.inv_gram, x))) / self.train_leverage
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            np.savez(f, feature_mean=self.feature_mean, feature_scale=self.feature_scale, coef=self.coef,
+                     intercept=self.intercept, inv_gram=self.inv_gram, train_leverage=self.train_leverage)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['feature_mean'], data['feature_scale'], data['coef'], data['intercept'],
+                       data['inv_gram'], float(data['train_leverage']))
@@ -0,0 +1,212 @@
+# sweep.py
+"""
+Incremental parameter sweeps over any config.PARAMS key.
+
+A sweep is a JSON file naming a grid of PARAMS values, crossed with agents
+and replicas:
+
+    {
+        "name": "bandwidth",
+        "agents": ["GO", "S-MARL"],
+        "grid": {"network_bandwidth_mhz": [10, 20, 40], "num_vehicles": [10, 20, 30]},
+        "params": {"task_deadline_ms": 150},
+        "num_replicas": 3
+    }
+
+"num_vehicles" is the only grid key that is not a PARAMS key. "params" is
+applied to every cell. The optional keys "num_vehicles", "num_slots",
+"semantic_goal", "dynamic_speed" and "seed" set the other run settings.
+
+    python sweep.py run bandwidth.json --store sweep_results
+    python sweep.py table bandwidth.json --store sweep_results --columns network_bandwidth_mhz
+
+Each replica's metrics become one row of a ResultStore (result_store.py), and
+a cell's rows are written together as soon as all of its replicas are done.
+A re-run skips every (cell, replica) already in the store. Raising
+num_replicas or adding grid values therefore runs only the new replicas and
+cells. A cell is identified by the sweep definition and the master seed, not
+by edits to config.py, so use a new sweep name or store after changing
+defaults there. Tables are built from the store alone.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from config import PARAMS
+from main import _run_cell, _run_replica_task, cell_seeds
+from result_store import ResultStore
+from results_handler import ResultsHandler
+from tracing import tracer
+
+RUN_SETTINGS = {'num_vehicles': 20, 'num_slots': None, 'semantic_goal': "BALANCE", 'dynamic_speed': False}
+DEFAULT_METRICS = ('avg_latency_ms', 'qos_violation_rate', 'total_energy_j')
+
+def load_spec(path):
+    with open(path) as f:
+        spec = json.load(f)
+    for key in spec['grid']:
+        if key != 'num_vehicles' and key not in PARAMS:
+            raise ValueError(f"Unknown grid key {key!r}; grid keys are config.PARAMS keys or 'num_vehicles'")
+    for key in spec.get('params', {}):
+        if key not in PARAMS:
+            raise ValueError(f"Unknown PARAMS key {key!r}")
+    return spec
+
+def grid_points(spec):
+    """Every combination of the grid values, as dicts in grid order."""
+    keys = list(spec['grid'])
+    return [dict(zip(keys, values)) for values in itertools.product(*(spec['grid'][key] for key in keys))]
+
+def cell_params(spec, point):
+    """The PARAMS a cell runs with: the defaults, the sweep's fixed params, then the grid point."""
+    params = dict(PARAMS)
+    params.update(spec.get('params', {}))
+    params.update({k: v for k, v in point.items() if k != 'num_vehicles'})
+    # Keep the derived values in step with the ones they come from
+    params['channel_noise_watts'] = 10**(params['channel_noise_dbm'] / 10) / 1000
+    params['vehicle_tx_power_watts'] = params['vehicle_tx_power_mw'] / 1000
+    return params
+
+def _run_settings(spec, point, params):
+    settings = {key: spec.get(key, default) for key, default in RUN_SETTINGS.items()}
+    settings['num_vehicles'] = point.get('num_vehicles', settings['num_vehicles'])
+    settings['num_slots'] = settings['num_slots'] or params['simulation_time_slots']
+    return settings
+
+def cell_key(spec, agent_name, point, master_seed):
+    """Stable id of a cell: everything that decides its results except the replica index."""
+    settings = {key: spec.get(key) for key in RUN_SETTINGS}
+    identity = [spec['name'], agent_name, point, spec.get('params', {}), settings, str(master_seed)]
+    return hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()[:16]
+
+def sweep_master_seed(spec, store):
+    """The spec's seed, else PARAMS['seed'], else one drawn once and kept in the store so re-runs find their cells."""
+    seed = spec.get('seed', PARAMS['seed'])
+    if seed is not None:
+        return seed
+    seeds_path = os.path.join(store.path, "seeds.json")
+    seeds = {}
+    if os.path.exists(seeds_path):
+        with open(seeds_path) as f:
+            seeds = json.load(f)
+    if spec['name'] not in seeds:
+        seeds[spec['name']] = np.random.SeedSequence().entropy
+        with open(seeds_path, 'w') as f:
+            json.dump(seeds, f)
+    return seeds[spec['name']]
+
+def _column_value(value):
+    # Tuple-valued PARAMS (e.g. vehicle_speed_kmh) go in as their JSON text
+    return value if isinstance(value, (bool, int, float, str)) else json.dumps(value)
+
+def sweep_cells(spec, master_seed):
+    """(cell_key, cell, params, row columns, seeds) per cell, with the cell in main's (scenario, agent, params, kwargs) form."""
+    cells = []
+    for point in grid_points(spec):
+        params = cell_params(spec, point)
+        settings = _run_settings(spec, point, params)
+        kwargs = {'n_vehicles': settings['num_vehicles'], 'num_slots': settings['num_slots'],
+                  'semantic_goal': settings['semantic_goal'], 'dynamic_speed': settings['dynamic_speed']}
+        columns = {k: _column_value(v) for k, v in point.items()}
+        columns['num_vehicles'] = settings['num_vehicles']
+        for agent_name in spec['agents']:
+            cell = (spec['name'], agent_name, point, kwargs)
+            seeds = cell_seeds(master_seed, spec['name'], agent_name, point, spec.get('num_replicas', 1))
+            cells.append((cell_key(spec, agent_name, point, master_seed), cell, params, columns, seeds))
+    return cells
+
+def _run_here(params, cell, seed, replica):
+    saved = dict(PARAMS)
+    PARAMS.update(params)
+    try:
+        return _run_cell(cell, [seed], range(replica, replica + 1))
+    finally:
+        PARAMS.clear()
+        PARAMS.update(saved)
+
+def run_sweep(spec, store_path, max_workers=None):
+    """
+    Runs every (cell, replica) of the sweep that is not in the store yet, on a
+    process pool (or in this process with max_workers=1), and appends each
+    cell's rows once all of its missing replicas have finished.
+    Returns the number of replicas run and skipped.
+    """
+    store = ResultStore(store_path)
+    master_seed = sweep_master_seed(spec, store)
+    stored = store.read(columns=['cell_key', 'replica'])
+    done = set(zip(stored['cell_key'], stored['replica'].astype(int))) if len(stored) else set()
+
+    tasks, expected, skipped = [], {}, 0
+    for key, cell, params, columns, seeds in sweep_cells(spec, master_seed):
+        for r, seed in enumerate(seeds):
+            if (key, r) in done:
+                skipped += 1
+                continue
+            tasks.append((key, cell, params, columns, seed, r))
+            expected[key] = expected.get(key, 0) + 1
+
+    pending = {}
+    def finish(task, metrics):
+        key, cell, _, columns, _, r = task
+        row = {'sweep': spec['name'], 'cell_key': key, 'agent': cell[1], **columns, 'replica': r}
+        row.update({name: float(values[0]) for name, values in metrics.items()})
+        rows = pending.setdefault(key, [])
+        rows.append(row)
+        if len(rows) == expected[key]:
+            store.append(pending.pop(key))
+
+    max_workers = max_workers or PARAMS['num_workers']
+    if max_workers == 1:
+        for task in tasks:
+            _, cell, params, _, seed, r = task
+            finish(task, _run_here(params, cell, seed, r))
+    elif tasks:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            for task in tasks:
+                _, cell, params, _, seed, r = task
+                futures[executor.submit(_run_replica_task, (params, cell, seed, r))] = task
+            for future in as_completed(futures):
+                metrics, trace = future.result()
+                if trace is not None:
+                    tracer.merge(trace)
+                finish(futures[future], metrics)
+    return len(tasks), skipped
+
+def sweep_results(spec, store_path):
+    """The store's rows for this sweep definition: one per (cell, replica) with replica < num_replicas."""
+    store = ResultStore(store_path)
+    master_seed = sweep_master_seed(spec, store)
+    keys = {key for key, _, _, _, _ in sweep_cells(spec, master_seed)}
+    df = store.read()
+    if not len(df):
+        return df
+    df = df[df['cell_key'].isin(keys) & (df['replica'] < spec.get('num_replicas', 1))]
+    # Two runs racing on the same store may both have written a replica; keep the later row
+    return df.drop_duplicates(subset=['cell_key', 'replica'], keep='last').reset_index(drop=True)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=['run', 'table'])
+    parser.add_argument('spec', help="Sweep definition (JSON)")
+    parser.add_argument('--store', default="sweep_results")
+    parser.add_argument('--workers', type=int, default=None, help="Process pool size; 1 runs in this process")
+    parser.add_argument('--columns', help="Grid key across the table (default: the first grid key)")
+    parser.add_argument('--rows', nargs='+', help="Keys down the table (default: agent, then the other grid keys)")
+    parser.add_argument('--metrics', nargs='+', default=list(DEFAULT_METRICS))
+    args = parser.parse_args(argv)
+
+    spec = load_spec(args.spec)
+    if args.command == 'run':
+        ran, skipped = run_sweep(spec, args.store, args.workers)
+        print(f"Ran {ran} replicas, skipped {skipped} already in {args.store}")
+
+    column_key = args.columns or next(iter(spec['grid']))
+    row_keys = args.rows or ['agent'] + [key for key in spec['grid'] if key != column_key]
+    ResultsHandler().print_sweep(spec['name'], sweep_results(spec, args.store), row_keys, column_key, args.metrics)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import PARAMS
+
+@pytest.fixture(autouse=True)
+def restore_params():
+    """Tests change config.PARAMS freely; every test starts from the defaults."""
+    saved = {key: value for key, value in PARAMS.items()}
+    yield
+    PARAMS.clear()
+    PARAMS.update(saved)
@@ -0,0 +1,88 @@
+import asyncio
+import numpy as np
+import pytest
+import main
+from agents import GreedyAgent, ReplayAgent, SP_LLM_Agent, SurrogateAgent
+from config import PARAMS
+from environment import ArrayVECEnvironment, MultiRSUEnvironment
+from pdt import PredictiveDigitalTwin
+from surrogate import SurrogateModel, vehicle_features
+
+def _surrogate_agent(max_novelty=None):
+    env = ArrayVECEnvironment(6, rng=np.random.default_rng(0))
+    pdt = PredictiveDigitalTwin(env, rng=np.random.default_rng(1))
+    features = vehicle_features(env.get_state(), pdt.forecast(), "BALANCE")
+    model = SurrogateModel.fit(features, np.random.default_rng(2).random((features.shape[0], 2)))
+    return SurrogateAgent(env, pdt=pdt, rng=np.random.default_rng(3), model=model, max_novelty=max_novelty), env
+
+def test_surrogate_uses_llm_only_with_a_novelty_threshold():
+    assert not SurrogateAgent.queries_llm()
+    assert SurrogateAgent.queries_llm(max_novelty=2.0)
+    PARAMS['surrogate_max_novelty'] = 2.0
+    assert SurrogateAgent.queries_llm()
+    assert SP_LLM_Agent.queries_llm() and not GreedyAgent.queries_llm()
+
+    PARAMS['surrogate_max_novelty'] = None
+    assert not _surrogate_agent()[0].uses_llm
+    assert _surrogate_agent(max_novelty=2.0)[0].uses_llm
+
+def test_novel_slots_go_to_the_llm_backend():
+    PARAMS['llm_backend'] = 'mock'
+    agent, env = _surrogate_agent(max_novelty=0.0) # Every slot is novel
+    agent.act(env.get_state())
+    assert agent.llm_fallbacks == 1 and agent.last_query is not None
+    action = asyncio.run(agent.act_async(env.get_state()))
+    assert agent.llm_fallbacks == 2 and action.w.shape == (6,)
+
+    agent, env = _surrogate_agent(max_novelty=1e12)
+    asyncio.run(agent.act_async(env.get_state()))
+    assert agent.llm_fallbacks == 0 and agent.last_query is None
+
+def test_main_routes_surrogate_cells_by_novelty_threshold(tmp_path):
+    cell = ('surrogate', 'SP-LLM-S', {'num_vehicles': 6}, {})
+    PARAMS.update(llm_backend='replay', decision_replay_dir=str(tmp_path))
+    assert main.agent_class_for('SP-LLM-S') is SurrogateAgent # Nothing to replay without LLM calls
+    PARAMS['surrogate_max_novelty'] = 2.0
+    assert main.agent_class_for('SP-LLM-S') is ReplayAgent
+
+    PARAMS.update(llm_backend='mock', decision_replay_dir=None, decision_log_dir=str(tmp_path / "log"))
+    _, _, decision_keys = main._cell_agents(cell, range(2))
+    assert decision_keys == [('surrogate', 'SP-LLM-S', {'num_vehicles': 6}, r) for r in range(2)]
+    PARAMS['surrogate_max_novelty'] = None
+    assert main._cell_agents(cell, range(2))[2] is None
+
+def _plan_agent(num_vehicles=8):
+    PARAMS.update(llm_backend='mock', llm_plan_mode=True, num_rsus=2)
+    env = MultiRSUEnvironment(num_vehicles, rng=np.random.default_rng(0))
+    agent = SP_LLM_Agent(env, pdt=PredictiveDigitalTwin(env, rng=np.random.default_rng(1)), rng=np.random.default_rng(2))
+    return agent, env
+
+def test_plan_is_dropped_when_vehicles_leave_or_join():
+    agent, env = _plan_agent()
+    env.step(agent.act(env.get_state()))
+    env.step(agent.act(env.get_state())) # Replayed from the plan
+    assert agent.plan_stats['plan_requests'] == 1
+
+    leaving = env.remove_vehicles(np.arange(env.num_vehicles) < 2)
+    action = agent.act(env.get_state())
+    assert action.w.shape == (6,) and agent.plan_stats['fleet_replans'] == 1
+    np.testing.assert_array_equal(agent.plan_vehicle_ids, env.vehicle_id)
+    env.step(action)
+
+    # Same fleet size, different vehicles: the old entries must not be reused either
+    other = MultiRSUEnvironment(2, rng=np.random.default_rng(3), first_vehicle_id=100)
+    env.remove_vehicles(np.arange(env.num_vehicles) < 2)
+    env.add_vehicles(other.remove_vehicles(np.ones(2, dtype=bool)))
+    assert env.num_vehicles == 6
+    agent.act(env.get_state())
+    assert agent.plan_stats['fleet_replans'] == 2 and agent.plan_stats['plan_requests'] == 3
+    assert 100 in agent.plan_vehicle_ids and leaving['vehicle_id'][0] not in agent.plan_vehicle_ids
+
+def test_plan_vehicle_ids_survive_a_checkpoint():
+    agent, env = _plan_agent()
+    env.step(agent.act(env.get_state()))
+    restored, _ = _plan_agent()
+    restored.load_state_dict(agent.state_dict())
+    np.testing.assert_array_equal(restored.plan_vehicle_ids, env.vehicle_id)
+    restored.act(env.get_state())
+    assert restored.plan_stats == {**agent.plan_stats, 'decisions': 2}
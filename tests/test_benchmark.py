@@ -0,0 +1,41 @@
+import json
+import pytest
+import benchmark
+
+def _record(case, n, p50_ms):
+    return {'case': case, 'engine': 'array', 'n': n, 'h': None, 'p50_ms': p50_ms}
+
+@pytest.fixture
+def fake_run(monkeypatch):
+    """Makes run_benchmarks return the given records instead of timing anything."""
+    def install(records):
+        monkeypatch.setattr(benchmark, 'run_benchmarks', lambda *args: records)
+    return install
+
+def test_missing_baseline_is_an_error(tmp_path, fake_run, capsys):
+    fake_run([_record('env_step', 10, 1.0)])
+    with pytest.raises(SystemExit) as exit_info:
+        benchmark.main(['--baseline', str(tmp_path / "missing.json")])
+    assert exit_info.value.code == 2
+    assert "--save-baseline" in capsys.readouterr().err
+
+def test_baseline_round_trip_flags_regressions(tmp_path, fake_run, capsys):
+    path = str(tmp_path / "bench.json")
+    fake_run([_record('env_step', 10, 1.0), _record('env_step', 100, 2.0)])
+    assert benchmark.main(['--save-baseline', path]) == 0
+
+    fake_run([_record('env_step', 10, 1.1), _record('env_step', 100, 3.0), _record('env_step', 1000, 9.0)])
+    assert benchmark.main(['--baseline', path, '--output', str(tmp_path / "run.json")]) == 1
+    with open(tmp_path / "run.json") as f:
+        report = json.load(f)
+    assert [r['case'] for r in report['regressions']] == ['env_step|array|100|None']
+    assert report['unmatched'] == ['env_step|array|1000|None']
+    assert "not compared" in capsys.readouterr().err
+
+def test_baseline_without_matching_cases_fails(tmp_path, fake_run, capsys):
+    path = str(tmp_path / "bench.json")
+    fake_run([_record('env_step', 10, 1.0)])
+    benchmark.main(['--save-baseline', path])
+    fake_run([_record('env_step', 20, 1.0)])
+    assert benchmark.main(['--baseline', path]) == 2
+    assert "nothing was compared" in capsys.readouterr().err
@@ -0,0 +1,103 @@
+import os
+import numpy as np
+import pytest
+import main
+from backends import get_backend
+from config import PARAMS
+from environment import EnvReplicas, VectorVECEnv
+
+class Killed(Exception):
+    pass
+
+def _cell(agent_name):
+    return ('resume', agent_name, {'num_vehicles': 8},
+            {'n_vehicles': 8, 'num_slots': 30, 'dynamic_speed': True, 'track_peak': True})
+
+@pytest.fixture
+def kill_at(monkeypatch):
+    """kill_at(slot) makes the replicas' step raise Killed at that slot; kill_at(None) counts the steps instead."""
+    steps = []
+    originals = {EnvClass: EnvClass.step for EnvClass in (VectorVECEnv, EnvReplicas)}
+    def install(slot):
+        steps.clear()
+        for EnvClass, step in originals.items():
+            def dying_step(self, actions, step=step):
+                if self.time_slot == slot:
+                    raise Killed
+                steps.append(self.time_slot)
+                return step(self, actions)
+            monkeypatch.setattr(EnvClass, 'step', dying_step)
+        return steps
+    return install
+
+@pytest.mark.parametrize('agent_name, plan_mode, engine, num_rsus', [
+    ('S-MARL', False, 'array', 1), ('GO', False, 'array', 1), ('SP-LLM', True, 'array', 1),
+    ('GO', False, 'event', 1), ('GO', False, 'object', 1), ('S-MARL', False, 'array', 4)])
+def test_resumed_cell_matches_uninterrupted_run(tmp_path, kill_at, agent_name, plan_mode, engine, num_rsus):
+    PARAMS.update(num_replicas=2, checkpoint_every=10, llm_backend='mock', llm_plan_mode=plan_mode, engine=engine,
+                  num_rsus=num_rsus)
+    cells = [_cell(agent_name)]
+    expected, = main.run_cells(None, cells, master_seed=7)
+
+    # A directory that does not exist yet: run_cells must create it on the first save
+    PARAMS['checkpoint_dir'] = str(tmp_path / "checkpoints" / "run")
+    kill_at(25)
+    with pytest.raises(Killed):
+        main.run_cells(None, cells, master_seed=7)
+    assert os.path.exists(main._checkpoint_path(cells[0]))
+
+    steps = kill_at(None)
+    resumed, = main.run_cells(None, cells, master_seed=7)
+    assert steps == list(range(20, 30)) # Continued from the checkpoint at slot 20
+    assert expected.keys() == resumed.keys()
+    for key in expected:
+        np.testing.assert_array_equal(resumed[key], expected[key], err_msg=key)
+
+    # The finished cell is read back from its .done file without stepping
+    steps = kill_at(None)
+    again, = main.run_cells(None, cells, master_seed=7)
+    assert steps == []
+    for key in expected:
+        np.testing.assert_array_equal(again[key], expected[key], err_msg=key)
+
+def test_resume_restores_llm_spend(tmp_path, kill_at, monkeypatch):
+    llm = get_backend('real').llm
+    PARAMS.update(checkpoint_every=10, checkpoint_dir=str(tmp_path / "checkpoints"))
+    cells = [_cell('S-MARL')]
+
+    scheduler = llm.RequestScheduler()
+    scheduler.spent_usd = 1.25
+    scheduler.fallbacks = {'deadline': 3}
+    monkeypatch.setattr(llm, 'scheduler', scheduler)
+    kill_at(15)
+    with pytest.raises(Killed):
+        main.run_cells(None, cells, master_seed=7)
+
+    # A restarted process starts with a fresh scheduler
+    monkeypatch.setattr(llm, 'scheduler', llm.RequestScheduler())
+    kill_at(None)
+    main.run_cells(None, cells, master_seed=7)
+    assert llm.scheduler.spent_usd == 1.25
+    assert llm.scheduler.fallbacks == {'deadline': 3}
+
+    monkeypatch.setattr(llm, 'scheduler', llm.RequestScheduler())
+    main.run_cells(None, cells, master_seed=7)
+    assert llm.scheduler.spent_usd == 1.25
+
+def test_scheduler_state_keeps_the_largest_totals():
+    llm = get_backend('real').llm
+    scheduler = llm.RequestScheduler()
+    scheduler.spent_usd = 2.0
+    scheduler.load_state_dict({'spent_usd': 1.0, 'stats': {'requests': 5}, 'fallbacks': {'budget': 1},
+                               'completion_tokens_estimate': 80.0})
+    assert scheduler.spent_usd == 2.0
+    assert scheduler.stats['requests'] == 5
+    assert scheduler.fallbacks == {'budget': 1}
+
+def test_num_rsus_runs_cells_on_multi_rsu_roads():
+    PARAMS.update(num_replicas=2, num_rsus=4)
+    metrics, = main.run_cells(None, [_cell('GO')], master_seed=3)
+    assert metrics['handovers'].shape == (2,) and np.all(metrics['handovers'] > 0)
+    PARAMS['engine'] = 'event'
+    with pytest.raises(ValueError, match="array engine"):
+        main.run_cells(None, [_cell('GO')], master_seed=3)
@@ -0,0 +1,49 @@
+import numpy as np
+from clustering import VehicleClusters, kmeans_labels
+from environment import ArrayVECEnvironment
+
+def _state(n=40, seed=0):
+    env = ArrayVECEnvironment(n, rng=np.random.default_rng(seed))
+    queues = np.random.default_rng(seed + 1).integers(0, 6, n)
+    return env.get_state()._replace(server_queue_lengths=queues)
+
+def test_kmeans_numbers_clusters_by_their_first_feature():
+    rng = np.random.default_rng(0)
+    centres = np.array([[900.0, 5.0], [100.0, 1.0], [500.0, 3.0]])
+    features = np.concatenate([c + rng.normal(0, [10.0, 0.1], (20, 2)) for c in centres])
+    labels = kmeans_labels(features, 3)
+    assert labels.tolist() == [2] * 20 + [0] * 20 + [1] * 20
+    assert kmeans_labels(features, 3).tolist() == labels.tolist() # Deterministic
+
+def test_empty_clusters_are_dropped():
+    # Identical vehicles cannot fill more than one cluster
+    assert kmeans_labels(np.ones((6, 3)), 4).tolist() == [0] * 6
+    assert sorted(kmeans_labels(np.arange(3.0)[:, None], 8).tolist()) == [0, 1, 2] # Fewer vehicles than clusters
+    assert kmeans_labels(np.zeros((0, 3)), 4).size == 0
+
+    state = _state(6)
+    same = state._replace(position_m=np.full(6, 250.0), channel_gain=np.full(6, state.channel_gain[0]),
+                          task_load_bytes=np.full(6, 1e5))
+    clusters = VehicleClusters(same, num_clusters=4)
+    assert clusters.num_clusters == 1 and clusters.counts.tolist() == [6]
+    action = clusters.expand({'w': [0.3], 'a': [1.0]})
+    np.testing.assert_allclose(action.w, 0.3)
+    assert np.isclose(action.a.sum(), 1.0)
+
+def test_expand_gives_each_vehicle_its_clusters_decision():
+    state = _state()
+    clusters = VehicleClusters(state, num_clusters=5)
+    k = clusters.num_clusters
+    assert k == 5 and clusters.counts.sum() == state.num_vehicles
+    w = np.linspace(-0.2, 1.2, k) # Out-of-range offloading ratios are clipped
+    a = np.random.default_rng(2).dirichlet(np.ones(k)) * 0.9
+    action = clusters.expand({'w': w.tolist(), 'a': a.tolist()})
+    np.testing.assert_array_equal(action.w, np.clip(w, 0, 1)[clusters.labels])
+
+    # Each cluster's share is split by backlog, so the clusters' total (at most 1) is kept
+    assert action.a.sum() <= 1.0 and np.isclose(action.a.sum(), a.sum())
+    np.testing.assert_allclose(np.bincount(clusters.labels, weights=action.a, minlength=k), a)
+    for cluster in range(k):
+        members = clusters.labels == cluster
+        np.testing.assert_allclose(action.a[members] / action.a[members].sum(),
+                                   (state.server_queue_lengths[members] + 1) / (state.server_queue_lengths[members] + 1).sum())
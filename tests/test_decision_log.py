@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+import numpy as np
+import main
+from config import PARAMS
+from decision_log import DecisionReplay, prompt_hash
+from environment import ArrayVECEnvironment
+from pdt import PredictiveDigitalTwin
+
+def test_logging_with_a_local_backend_does_not_load_openai(tmp_path):
+    code = f"""
+import sys
+import main
+from config import PARAMS
+PARAMS.update(llm_backend='mock', decision_log_dir={str(tmp_path / 'log')!r})
+main.run_cells(None, [('s', 'SP-LLM', {{'num_vehicles': 5}}, {{'n_vehicles': 5, 'num_slots': 5}})], master_seed=1)
+loaded = [name for name in ('openai', 'httpx', 'dotenv', 'real_llm') if name in sys.modules]
+assert not loaded, loaded
+"""
+    subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.abspath(main.__file__)))
+
+def test_replay_reproduces_logged_run(tmp_path):
+    PARAMS.update(llm_backend='mock', decision_log_dir=str(tmp_path / "log"), num_replicas=2)
+    cells = [('s', 'SP-LLM', {'num_vehicles': 6}, {'n_vehicles': 6, 'num_slots': 12})]
+    logged, = main.run_cells(None, cells, master_seed=3)
+    PARAMS.update(decision_log_dir=None, decision_replay_dir=str(tmp_path / "log"))
+    replayed, = main.run_cells(None, cells, master_seed=3)
+    for key in ('avg_latency_ms', 'qos_violation_rate', 'total_energy_j', 'num_completed'):
+        np.testing.assert_array_equal(replayed[key], logged[key], err_msg=key)
+    assert len(DecisionReplay(str(tmp_path / "log")).decisions_for('s', 'SP-LLM', {'num_vehicles': 6}, 1)) == 12
+
+def test_prompt_hash_follows_the_prompt():
+    env = ArrayVECEnvironment(8, rng=np.random.default_rng(0))
+    forecasts = PredictiveDigitalTwin(env, rng=np.random.default_rng(1)).forecast()
+    state = env.get_state()
+    base = prompt_hash(state, forecasts, "BALANCE")
+    assert base == prompt_hash(state, forecasts, "BALANCE")
+    assert len({base, prompt_hash(state, forecasts, "SAVE_ENERGY"), prompt_hash(state, None, "BALANCE"),
+                prompt_hash(state, forecasts, "BALANCE", plan_horizon=5),
+                prompt_hash(state, forecasts, "BALANCE", num_clusters=3)}) == 5
@@ -0,0 +1,283 @@
+import numpy as np
+import pytest
+from checkpoint import load_checkpoint, save_checkpoint
+from config import PARAMS
+from environment import (VECEnvironment, ArrayVECEnvironment, VectorVECEnv, EventVECEnvironment, MultiRSUEnvironment,
+                         Observation, Action, TX_DONE)
+from sharded import Shard, _route, run_sharded, shard_segments
+
+class ConstantRNG:
+    """Every draw is `value`, so both engines see the same draws whatever order they take them in."""
+    def __init__(self, value):
+        self.value = value
+
+    def random(self, size=None):
+        return self.value if size is None else np.full(size, self.value)
+
+    def uniform(self, low, high, size=None):
+        return low + (high - low) * self.random(size)
+
+def _actions(num_vehicles, num_slots, seed=0):
+    """Random actions, some with allocations summing over 1 and some starving vehicles so their queues build up."""
+    rng = np.random.default_rng(seed)
+    actions = []
+    for t in range(num_slots):
+        w = rng.random(num_vehicles)
+        a = rng.random(num_vehicles) * (rng.random(num_vehicles) < 0.7)
+        actions.append(Action(w, a * (1.5 if t % 3 == 0 else 1 / max(a.sum(), 1e-9))))
+    return actions
+
+def _place(env, position_m, speed_mps):
+    if isinstance(env, VECEnvironment):
+        for v, pos, speed in zip(env.vehicles, position_m, speed_mps):
+            v.position_m, v.speed_mps = pos, speed
+    else:
+        env.position_m, env.speed_mps = position_m.copy(), speed_mps.copy()
+
+@pytest.mark.parametrize('draw', [0.1, 0.5, 0.65])
+def test_array_engine_matches_object_engine(draw):
+    n, num_slots = 16, 60
+    rng = np.random.default_rng(3)
+    position_m, speed_mps = rng.uniform(0, 2000, n), rng.uniform(15, 30, n)
+    envs = [VECEnvironment(n, dynamic_speed=True, rng=ConstantRNG(draw)),
+            ArrayVECEnvironment(n, dynamic_speed=True, queue_capacity=2, rng=ConstantRNG(draw))]
+    for env in envs:
+        _place(env, position_m, speed_mps)
+    for action in _actions(n, num_slots):
+        states = [env.step(action) for env in envs]
+        np.testing.assert_allclose(states[1].position_m, states[0].position_m)
+        np.testing.assert_array_equal(states[1].server_queue_lengths, states[0].server_queue_lengths)
+
+    expected, actual = envs[0].metrics.summary(), envs[1].metrics.summary()
+    assert actual['num_completed'][0] == expected['num_completed'][0] > 0
+    for key in ['avg_latency_ms', 'latency_std_ms', 'latency_p95_ms', 'qos_violation_rate', 'total_energy_j',
+                'local_energy_j', 'transmission_energy_j', 'server_energy_j']:
+        np.testing.assert_allclose(actual[key], expected[key], rtol=1e-9, err_msg=key)
+
+def test_array_engine_matches_object_engine_on_average():
+    # The engines take their random draws in different orders, so on real streams only the averages agree
+    n, num_slots, seeds = 20, 200, range(8)
+    def run(EnvClass, seed):
+        env = EnvClass(n, rng=np.random.default_rng(seed))
+        for action in _actions(n, num_slots, seed=100 + seed):
+            env.step(action)
+        return env.metrics.summary()
+    results = {EnvClass: [run(EnvClass, seed) for seed in seeds] for EnvClass in (VECEnvironment, ArrayVECEnvironment)}
+    for key, rtol in [('num_completed', 0.01), ('qos_violation_rate', 0.05), ('total_energy_j', 0.03), ('latency_p50_ms', 0.05)]:
+        expected, actual = (np.mean([summary[key][0] for summary in results[EnvClass]])
+                            for EnvClass in (VECEnvironment, ArrayVECEnvironment))
+        assert actual == pytest.approx(expected, rel=rtol), key
+
+def test_ring_buffer_growth_keeps_fifo_order():
+    n = 4
+    env = ArrayVECEnvironment(n, queue_capacity=2, rng=np.random.default_rng(0))
+    model = [[] for _ in range(n)]
+    rng = np.random.default_rng(1)
+    item = 0
+    for _ in range(200):
+        # Dequeue from some non-empty queues, then enqueue one item on a random subset
+        served = np.flatnonzero((env.queue_len > 0) & (rng.random(n) < 0.4))
+        size_bytes, creation_time = env._dequeue(served)
+        for v, size, created in zip(served.tolist(), size_bytes.tolist(), creation_time.tolist()):
+            assert (size, created) == model[v].pop(0)
+        idx = np.flatnonzero(rng.random(n) < 0.6)
+        sizes = item + np.arange(idx.size, dtype=float)
+        env._enqueue(idx, sizes, float(item))
+        for v, size in zip(idx.tolist(), sizes.tolist()):
+            model[v].append((size, float(item)))
+        item += idx.size
+        assert env.queue_len.tolist() == [len(q) for q in model]
+    assert env.queue_size_bytes.shape[1] > 2 # The rings had to grow, with heads all over the place
+
+def test_initial_queue_capacity_does_not_change_results():
+    n = 10
+    envs = [ArrayVECEnvironment(n, queue_capacity=capacity, rng=np.random.default_rng(4)) for capacity in (1, 64)]
+    for action in _actions(n, 80, seed=5):
+        states = [env.step(action) for env in envs]
+        np.testing.assert_array_equal(states[0].server_queue_lengths, states[1].server_queue_lengths)
+    assert envs[0].queue_size_bytes.shape[1] > 1
+    for key, values in envs[1].metrics.summary().items():
+        np.testing.assert_array_equal(envs[0].metrics.summary()[key], values, err_msg=key)
+
+@pytest.mark.parametrize('dynamic_speed', [False, True])
+def test_vector_replica_matches_standalone_engine(dynamic_speed):
+    n, num_replicas = 50, 3
+    seeds = np.random.SeedSequence(5).spawn(num_replicas)
+    venv = VectorVECEnv(num_replicas, n, dynamic_speed=dynamic_speed, seed=seeds)
+    solo = [ArrayVECEnvironment(n, dynamic_speed=dynamic_speed, rng=np.random.default_rng(seed)) for seed in seeds]
+    actions = [_actions(n, 40, seed=r) for r in range(num_replicas)]
+    for t in range(40):
+        venv.step([replica_actions[t] for replica_actions in actions])
+        for env, replica_actions in zip(solo, actions):
+            env.step(replica_actions[t])
+
+    metrics = venv.get_metrics()
+    for r, env in enumerate(solo):
+        vstate, state = venv.get_state(r), env.get_state()
+        for field in ('position_m', 'speed_mps', 'task_load_bytes', 'channel_gain', 'server_queue_lengths'):
+            np.testing.assert_array_equal(getattr(vstate, field), getattr(state, field), err_msg=field)
+        for key, values in env.metrics.summary().items():
+            assert metrics[key][r] == values[0], key
+
+def _event_env(n, seed, **kwargs):
+    return EventVECEnvironment(n, dynamic_speed=True, rng=np.random.default_rng(seed), **kwargs)
+
+@pytest.mark.parametrize('drop_expired', [False, True])
+def test_event_engine_state_round_trip(tmp_path, drop_expired):
+    # Busy enough that queues, tasks in service and pending events all cross the save point
+    n = 12
+    PARAMS['vec_server_cpu_freq_ghz'] = 2
+    actions = _actions(n, 40, seed=6)
+    env = _event_env(n, 7, task_rate_hz=3.0, drop_expired=drop_expired)
+    for action in actions[:20]:
+        env.step(action)
+    assert len(env.scheduler) and env.queue_len.sum() > 0
+    restored = _event_env(n, 99, task_rate_hz=3.0, drop_expired=drop_expired)
+    save_checkpoint(str(tmp_path / "env.npz"), env.state_dict())
+    restored.load_state_dict(load_checkpoint(str(tmp_path / "env.npz")))
+    for action in actions[20:]:
+        expected, actual = env.step(action), restored.step(action)
+        np.testing.assert_array_equal(actual.server_queue_lengths, expected.server_queue_lengths)
+        np.testing.assert_array_equal(actual.task_load_bytes, expected.task_load_bytes)
+    assert restored.dropped_tasks == env.dropped_tasks and restored.scheduler.processed == env.scheduler.processed
+    for key, values in env.metrics.summary().items():
+        np.testing.assert_array_equal(restored.metrics.summary()[key], values, err_msg=key)
+
+def test_event_engine_with_zero_duration_tasks_matches_slot_engine_counts():
+    # With no cycles to run, every task completes the moment it arrives (local) or is transmitted (offloaded)
+    PARAMS['cpu_cycles_per_byte_mhz'] = 0
+    n, num_slots, seeds = 30, 100, range(6)
+    actions = _actions(n, num_slots, seed=8)
+    event_counts, slot_counts = [], []
+    for seed in seeds:
+        event, slot = _event_env(n, seed), ArrayVECEnvironment(n, dynamic_speed=True, rng=np.random.default_rng(seed))
+        for action in actions:
+            action = Action(action.w, np.full(n, 1 / n)) # Every queue served every slot, so none builds up
+            event.step(action)
+            slot.step(action)
+        # Only tasks still on the uplink at the end of the last slot are unfinished
+        unfinished = sum(kind == TX_DONE for _, _, kind, _ in event.scheduler.heap)
+        assert event.metrics.count[0] + unfinished == event.task_id_counter
+        assert event.queue_len.sum() == 0 and slot.queue_len.sum() == 0
+        assert event.metrics.summary()['latency_p99_ms'][0] < 1 # Transmission only
+        event_counts.append(event.metrics.count[0])
+        slot_counts.append(slot.metrics.count[0])
+    # Poisson and Bernoulli arrivals with the same mean, 0.7 per vehicle and slot
+    expected = 0.7 * n * num_slots * len(seeds)
+    assert sum(slot_counts) == pytest.approx(expected, rel=0.02)
+    assert sum(event_counts) == pytest.approx(sum(slot_counts), rel=0.03)
+
+def _nearest_rsu(env, position_m):
+    return np.argmin(np.abs(position_m[:, None] - env.rsu_positions_m[None, :]), axis=1)
+
+def test_rsu_association_is_nearest_rsu():
+    rng = np.random.default_rng(9)
+    rsu_positions_m = rng.permutation(rng.uniform(0, 2000, 7)) # Unsorted on purpose
+    env = MultiRSUEnvironment(5, rsu_positions_m=rsu_positions_m, rng=np.random.default_rng(0))
+    assert np.all(np.diff(env.rsu_positions_m) > 0)
+    position_m = np.concatenate([rng.uniform(-100, 2100, 1000), env.rsu_positions_m, [0.0, 2000.0]])
+    np.testing.assert_array_equal(env.associate(position_m), _nearest_rsu(env, position_m))
+
+def test_handovers_count_changes_of_nearest_rsu():
+    PARAMS['num_rsus'] = 5
+    n = 40
+    env = MultiRSUEnvironment(n, dynamic_speed=True, rng=np.random.default_rng(10))
+    rsu = _nearest_rsu(env, env.position_m)
+    expected = 0
+    for action in _actions(n, 120, seed=11):
+        state = env.step(action)
+        new_rsu = _nearest_rsu(env, env.position_m)
+        expected += np.count_nonzero(new_rsu != rsu)
+        rsu = new_rsu
+        np.testing.assert_array_equal(state.rsu, rsu)
+        assert state.rsu_queue_lengths.sum() == state.server_queue_lengths.sum()
+    # At 60-100 km/h over 400 m cells, each vehicle is handed over every 15-25 slots, wrap-around included
+    assert env.handovers == expected and expected > n * 120 / 25
+
+def test_shard_segments_split_the_road_at_cell_edges():
+    rsu_positions_m = np.array([900.0, 100.0, 500.0, 1300.0, 1700.0])
+    segments = shard_segments(rsu_positions_m, 2, 2000.0)
+    assert [group.tolist() for group, _ in segments] == [[100.0, 500.0, 900.0], [1300.0, 1700.0]]
+    assert [segment for _, segment in segments] == [(0.0, 1100.0), (1100.0, 2000.0)]
+    with pytest.raises(ValueError):
+        shard_segments(rsu_positions_m, 6, 2000.0)
+
+def test_route_sends_departures_to_the_segment_they_entered():
+    starts = np.array([0.0, 1000.0, 2000.0])
+    departures = [
+        {'vehicle_id': np.array([1, 2, 3]), 'position_m': np.array([1500.0, 2500.0, 10.0])},
+        {'vehicle_id': np.array([], dtype=int), 'position_m': np.array([])},
+        {'vehicle_id': np.array([7]), 'position_m': np.array([1000.0])},
+    ]
+    incoming = _route(departures, starts)
+    assert incoming[0]['vehicle_id'].tolist() == [3]
+    assert incoming[1]['vehicle_id'].tolist() == [1, 7] # A vehicle exactly on an edge belongs to the later segment
+    assert incoming[2]['vehicle_id'].tolist() == [2]
+    assert _route(departures[1:2], starts) == [None, None, None]
+
+def test_sharded_run_in_process_matches_worker_processes():
+    PARAMS['num_rsus'] = 6
+    kwargs = dict(num_vehicles=60, num_slots=15, num_shards=3, agent_name='GO', dynamic_speed=True, seed=4)
+    in_process = run_sharded(processes=False, **kwargs)
+    workers = run_sharded(processes=True, **kwargs)
+    for summary in (in_process, workers):
+        del summary['wall_s'], summary['slots_per_s']
+    assert in_process == workers
+
+def test_sharded_plan_mode_replans_as_vehicles_cross_segments():
+    PARAMS.update(num_rsus=6, llm_backend='mock', llm_plan_mode=True)
+    summary = run_sharded(300, 20, 3, agent_name='SP-LLM', processes=False)
+    assert sum(summary['shard_vehicles']) == 300 and summary['handovers'] > 0
+
+def test_sharded_run_conserves_vehicles_and_counts_each_handover_once():
+    PARAMS['num_rsus'] = 6
+    road_length_m = PARAMS['road_length_km'] * 1000
+    rsu_positions_m = (np.arange(6) + 0.5) * road_length_m / 6
+    rsu_edges_m = (rsu_positions_m[1:] + rsu_positions_m[:-1]) / 2
+    segments = shard_segments(rsu_positions_m, 3, road_length_m)
+    starts = np.array([start for _, (start, _) in segments])
+    seeds = np.random.SeedSequence(5).spawn(3)
+    shards = [Shard('GO', group, segment, 20, 20 * k, seeds[k], True) for k, (group, segment) in enumerate(segments)]
+
+    def global_rsu(incoming):
+        parts = [(shard.env.vehicle_id, shard.env.position_m) for shard in shards]
+        parts += [(arriving['vehicle_id'], arriving['position_m']) for arriving in incoming if arriving is not None]
+        ids, position_m = (np.concatenate(column) for column in zip(*parts))
+        assert np.array_equal(np.sort(ids), np.arange(60)) # No vehicle lost or duplicated
+        return np.searchsorted(rsu_edges_m, position_m[np.argsort(ids)])
+
+    incoming = [None] * 3
+    rsu, expected = global_rsu(incoming), 0
+    for _ in range(40):
+        incoming = _route([shard.step(arriving, "BALANCE") for shard, arriving in zip(shards, incoming)], starts)
+        new_rsu = global_rsu(incoming)
+        expected += np.count_nonzero(new_rsu != rsu)
+        rsu = new_rsu
+    results = [shard.result(arriving) for shard, arriving in zip(shards, incoming)]
+    assert sum(result['num_vehicles'] for result in results) == 60
+    # Crossings between shards, the wrap-around from the road's end to its start included, count once
+    assert sum(result['handovers'] for result in results) == expected > 0
+
+@pytest.mark.parametrize('num_rsus', [1, 3])
+def test_observation_keys_match_its_dict_view(num_rsus):
+    PARAMS['num_rsus'] = num_rsus
+    env = MultiRSUEnvironment(5, rng=np.random.default_rng(0)) if num_rsus > 1 else ArrayVECEnvironment(5, rng=np.random.default_rng(0))
+    state = env.get_state()
+    as_dict = state.to_dict()
+    assert tuple(as_dict) == state.keys()
+    assert ('rsu_queue_lengths' in state) == (num_rsus > 1)
+    for key in as_dict:
+        assert key in state
+        assert state.get(key) == as_dict[key]
+    for key in ('position_m', 'channel_gain', 0, 'missing'):
+        assert key not in state
+    assert state.get('missing', 'default') == 'default'
+    # The tuple side is unchanged: fields, unpacking and _replace
+    assert len(state) == len(state._fields)
+    assert state._replace(time_slot=7).time_slot == 7
+    assert Observation.from_dict(as_dict).to_dict() == as_dict
+
+def test_action_keys_match_its_dict_view():
+    action = Action(np.array([0.5]), np.array([1.0]))
+    assert 'w' in action and 'a' in action and 'x' not in action
+    assert tuple(action.to_dict()) == action.keys()
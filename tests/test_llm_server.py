@@ -0,0 +1,81 @@
+import http.client
+import json
+import numpy as np
+import pytest
+import llm_server
+import loadgen
+import real_llm
+from environment import ArrayVECEnvironment
+from prompts import generate_user_prompt
+
+@pytest.fixture
+def server():
+    servers = []
+    def start(**config):
+        servers.append(llm_server.start_server(config={'latency': 'none', 'retry_after_s': 0, 'seed': 0, **config}))
+        return servers[-1]
+    yield start
+    for s in servers:
+        s.shutdown()
+        s.server_close()
+
+def _post(server, body):
+    host, port = server.server_address[:2]
+    conn = http.client.HTTPConnection(host, port, timeout=10)
+    try:
+        conn.request("POST", "/v1/chat/completions", body=body, headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        conn.close()
+
+def _request_body(n=4):
+    state = ArrayVECEnvironment(n, rng=np.random.default_rng(0)).get_state()
+    messages = [{'role': 'system', 'content': "system"}, {'role': 'user', 'content': generate_user_prompt(state, None, "BALANCE")}]
+    return json.dumps({'model': 'gpt-4-turbo', 'messages': messages})
+
+def test_injected_429_and_malformed_rates(server):
+    s = server(rate_429=0.3, malformed_rate=0.2)
+    body = _request_body()
+    statuses, malformed = [], 0
+    for _ in range(400):
+        status, response = _post(s, body)
+        statuses.append(status)
+        if status == 429:
+            assert response['error']['type'] == 'requests'
+            continue
+        content = response['choices'][0]['message']['content']
+        try:
+            decision = json.loads(content)
+        except ValueError:
+            malformed += 1
+        else:
+            assert len(decision['w']) == len(decision['a']) == 4
+    rate_limited = statuses.count(429)
+    assert set(statuses) == {200, 429}
+    assert rate_limited / 400 == pytest.approx(0.3, abs=0.07)
+    assert malformed / (400 - rate_limited) == pytest.approx(0.2, abs=0.07)
+    assert s.stats == {'requests': 400, 'ok': 400 - rate_limited - malformed, 'rate_limited': rate_limited,
+                       'malformed': malformed, 'bad_request': 0}
+
+def test_malformed_request_body_gets_a_400(server):
+    s = server()
+    status, response = _post(s, b'{"messages": [')
+    assert status == 400 and response['error']['type'] == 'invalid_request_error'
+    status, _ = _post(s, json.dumps({'messages': [{'role': 'user', 'content': "no state here"}]}))
+    assert status == 400
+    assert s.stats['bad_request'] == 2 and s.stats['requests'] == 1 # The bad body never reached admission
+    assert _post(s, _request_body())[0] == 200 # The server keeps serving
+
+def test_loadgen_reports_the_servers_faults(monkeypatch, capsys):
+    # loadgen points real_llm at its own server; put the module state back afterwards
+    for name in ('client', '_api_key', '_base_url', '_async_client', '_async_semaphore', 'decision_cache'):
+        monkeypatch.setattr(real_llm, name, getattr(real_llm, name))
+    monkeypatch.setattr(real_llm, 'scheduler', real_llm.RequestScheduler())
+    loadgen.main(['--requests', '60', '--concurrency', '4', '--vehicles', '4', '--states', '5', '--latency', 'none',
+                  '--malformed-rate', '0.2', '--server-seed', '0'])
+    report = json.loads(capsys.readouterr().out)
+    stats = report['server']['stats']
+    assert report['requests'] == 60 and stats['requests'] == 60
+    assert stats['malformed'] > 0 and report['fallbacks'] == stats['malformed'] # Malformed answers are not retried
+    assert report['latency_ms']['p50'] <= report['latency_ms']['max']
@@ -0,0 +1,167 @@
+import asyncio
+import json
+import types
+import numpy as np
+import pytest
+import main
+import real_llm
+from config import PARAMS
+from environment import ArrayVECEnvironment, VECEnvironment
+from results_handler import ci_half_width
+
+def _cells(agents=("SP-LLM", "GO"), n_vehicles=6, num_slots=12):
+    return [('async', agent_name, {'num_vehicles': n_vehicles}, {'n_vehicles': n_vehicles, 'num_slots': num_slots, 'track_peak': True})
+            for agent_name in agents]
+
+def _assert_same_metrics(first, second):
+    for a, b in zip(first, second, strict=True):
+        assert a.keys() == b.keys()
+        for key in a:
+            np.testing.assert_array_equal(a[key], b[key], err_msg=key)
+
+@pytest.mark.parametrize('plan_mode', [False, True])
+def test_async_runner_matches_the_sync_runner(plan_mode):
+    PARAMS.update(llm_backend='mock', llm_plan_mode=plan_mode, num_replicas=3)
+    cells = _cells()
+    sync = main.run_cells(None, cells, master_seed=7)
+    _assert_same_metrics(asyncio.run(main.run_cells_async(None, cells, master_seed=7)), sync)
+
+class FakeAsyncOpenAI:
+    """Answers after a short sleep and records how many requests were in flight at once."""
+    in_flight = 0
+    max_in_flight = 0
+
+    def __init__(self, **kwargs):
+        self.chat = types.SimpleNamespace(completions=types.SimpleNamespace(create=self.create))
+
+    async def create(self, messages, timeout=None, **kwargs):
+        cls = FakeAsyncOpenAI
+        cls.in_flight += 1
+        cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        await asyncio.sleep(0.01)
+        cls.in_flight -= 1
+        content = json.dumps({'w': [0.5] * 4, 'a': [0.25] * 4})
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))],
+                                     usage=types.SimpleNamespace(prompt_tokens=100, completion_tokens=20))
+
+    async def close(self):
+        pass
+
+def test_async_queries_respect_the_concurrency_limit(monkeypatch):
+    PARAMS['llm_max_concurrency'] = 3
+    monkeypatch.setattr(real_llm, 'AsyncOpenAI', FakeAsyncOpenAI)
+    monkeypatch.setattr(FakeAsyncOpenAI, 'max_in_flight', 0)
+    monkeypatch.setattr(real_llm, 'scheduler', real_llm.RequestScheduler())
+    monkeypatch.setattr(real_llm, 'decision_cache', None)
+    monkeypatch.setattr(real_llm, '_api_key', "test")
+    monkeypatch.setattr(real_llm, '_async_client', None)
+    state = ArrayVECEnvironment(4, rng=np.random.default_rng(0)).get_state()
+
+    async def run():
+        try:
+            return await asyncio.gather(*(real_llm.query_gpt4_orchestrator_async(state) for _ in range(10)))
+        finally:
+            await real_llm.close_async_client()
+    actions = asyncio.run(run())
+    assert FakeAsyncOpenAI.max_in_flight == 3
+    for action in actions:
+        np.testing.assert_array_equal(action.w, np.full(4, 0.5))
+    assert real_llm.scheduler.stats['requests'] == 10
+
+class FakeRun:
+    """Stands in for run_cells: replica r of a cell scores mean + sd * (draw r of a fixed normal stream)."""
+    DRAWS = np.random.default_rng(0).standard_normal(1000)
+
+    def __init__(self, spread):
+        self.spread = spread # cell name -> (mean, sd)
+        self.batches = []
+
+    def __call__(self, results_handler, cells, master_seed, replicas):
+        self.batches.append({cell[0]: list(rs) for cell, rs in zip(cells, replicas)})
+        all_metrics = []
+        for cell, rs in zip(cells, replicas):
+            mean, sd = self.spread[cell[0]]
+            values = mean + sd * self.DRAWS[list(rs)]
+            all_metrics.append({'avg_latency_ms': values, 'qos_violation_rate': np.zeros(len(rs)), 'total_energy_j': values / 100})
+        return all_metrics
+
+def _adaptive_cells(*names):
+    return [(name, 'GO', {}, {}) for name in names]
+
+def test_replicas_missing_follows_the_ci_target():
+    PARAMS.update(adaptive_ci_rel_width=0.05, adaptive_ci_metrics={'avg_latency_ms': 0.0})
+    assert main._replicas_missing({'avg_latency_ms': np.full(3, 100.0)}) == 0
+    assert main._replicas_missing({'avg_latency_ms': np.array([100.0])}) == 1 # No variance estimate yet
+    values = np.array([90.0, 100.0, 110.0])
+    target = 5.0
+    needed = 3 + main._replicas_missing({'avg_latency_ms': values})
+    assert needed == int(np.ceil(3 * (ci_half_width(values) / target)**2))
+
+def test_adaptive_replication_stops_once_the_ci_is_narrow_enough():
+    PARAMS.update(adaptive_min_replicas=3, adaptive_max_replicas=200, adaptive_ci_rel_width=0.05,
+                  adaptive_ci_metrics={'avg_latency_ms': 0.0, 'total_energy_j': 0.0})
+    run = FakeRun({'steady': (100.0, 0.0), 'noisy': (100.0, 20.0)})
+    steady, noisy = main.run_cells_adaptive(None, _adaptive_cells('steady', 'noisy'), run=run)
+    assert len(steady['avg_latency_ms']) == 3 and run.batches[0]['steady'] == [0, 1, 2]
+    assert all('steady' not in batch for batch in run.batches[1:])
+
+    n = len(noisy['avg_latency_ms'])
+    assert 3 < n < 200
+    assert ci_half_width(noisy['avg_latency_ms']) <= 5.0
+    last = len(run.batches[-1]['noisy'])
+    assert ci_half_width(noisy['avg_latency_ms'][:n - last]) > 5.0 # The round before was still too wide
+    # Replicas are numbered on from round to round, at most doubling the cell each time
+    replicas = [r for batch in run.batches for r in batch.get('noisy', [])]
+    assert replicas == list(range(n))
+    seen = 0
+    for batch in run.batches:
+        assert len(batch.get('noisy', [])) <= max(seen, 3)
+        seen += len(batch.get('noisy', []))
+
+def test_adaptive_replication_stops_at_the_replica_cap():
+    PARAMS.update(adaptive_min_replicas=3, adaptive_max_replicas=20, adaptive_ci_rel_width=0.001,
+                  adaptive_ci_metrics={'avg_latency_ms': 0.0})
+    run = FakeRun({'wild': (100.0, 50.0)})
+    metrics, = main.run_cells_adaptive(None, _adaptive_cells('wild'), run=run)
+    assert len(metrics['avg_latency_ms']) == 20
+    assert [r for batch in run.batches for r in batch['wild']] == list(range(20))
+
+def _contains(outer, inner):
+    return outer['ts'] <= inner['ts'] and inner['ts'] + inner['dur'] <= outer['ts'] + outer['dur']
+
+def test_trace_flag_writes_nested_chrome_trace_events(tmp_path):
+    PARAMS.update(num_vehicles_range=[4], simulation_time_slots=5)
+    path = tmp_path / "trace.json"
+    try:
+        main.main(['--scenarios', '1', '--agents', 'SP-LLM', 'GO', '--backend', 'mock', '--format', 'json',
+                   '--replicas', '2', '--trace', str(path)])
+    finally:
+        main.tracer.reset(False)
+    assert PARAMS['trace_enabled'] and PARAMS['trace_path'] == str(path)
+
+    trace = json.loads(path.read_text())
+    assert trace['displayTimeUnit'] == 'ms'
+    spans = [e for e in trace['traceEvents'] if e['ph'] == 'X']
+    assert all({'name', 'ts', 'dur', 'pid', 'tid', 'args'} <= e.keys() and e['dur'] >= 0 for e in spans)
+    by_name = {}
+    for e in spans:
+        by_name.setdefault(e['name'], []).append(e)
+    cells = by_name['cell']
+    assert sorted((e['args']['agent'], e['args']['replicas']) for e in cells) == [('GO', 1)] * 2 + [('SP-LLM', 1)] * 2
+    assert len(by_name['env.step']) == len(by_name['agent.act']) == 4 * 5
+    # Every slot's spans sit inside a cell on the same track, and every cell inside the run
+    for name in ('env.get_state', 'agent.act', 'env.step', 'pdt.forecast'):
+        for e in by_name[name]:
+            assert any(c['pid'] == e['pid'] and c['tid'] == e['tid'] and _contains(c, e) for c in cells), name
+    run, = by_name['run.local_cells']
+    assert all(_contains(run, c) for c in cells)
+
+def test_object_engine_runs_the_original_environment():
+    PARAMS['engine'] = 'object'
+    venv = main._make_envs(5, True, np.random.SeedSequence(0).spawn(2))
+    assert [type(env) for env in venv.envs] == [VECEnvironment] * 2 and venv.envs[0].dynamic_speed
+    metrics, = main.run_cells(None, _cells(agents=("GO",)), master_seed=7)
+    assert len(metrics['avg_latency_ms']) == PARAMS['num_replicas'] and np.all(metrics['num_completed'] > 0)
+    PARAMS['engine'] = 'objects'
+    with pytest.raises(ValueError, match="'object'"):
+        main._make_envs(5, False, np.random.SeedSequence(0).spawn(1))
@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+from metrics import LATENCY_BIN_EDGES_S, StreamingMetrics
+
+BIN_RATIO = LATENCY_BIN_EDGES_S[1] / LATENCY_BIN_EDGES_S[0]
+
+def _sample(size=5000, seed=0):
+    # Lognormal latencies around 100 ms, a fair share of them over the 200 ms deadline
+    return np.random.default_rng(seed).lognormal(np.log(0.1), 0.6, size)
+
+def _batches(latencies, seed=1):
+    """Splits the sample into random-length batches, as environments add them slot by slot."""
+    cuts = np.sort(np.random.default_rng(seed).choice(np.arange(1, latencies.size), 40, replace=False))
+    return np.split(latencies, cuts)
+
+def _assert_moments(metrics, latencies, stream=0):
+    summary = metrics.summary()
+    assert summary['num_completed'][stream] == latencies.size
+    np.testing.assert_allclose(summary['avg_latency_ms'][stream], latencies.mean() * 1000, rtol=1e-12)
+    np.testing.assert_allclose(summary['latency_std_ms'][stream], latencies.std() * 1000, rtol=1e-9)
+    assert summary['qos_violation_rate'][stream] == pytest.approx(np.mean(latencies > metrics.deadline_s) * 100)
+
+def test_one_at_a_time_matches_numpy():
+    latencies = _sample()
+    metrics = StreamingMetrics(deadline_s=0.2)
+    for latency in latencies.tolist():
+        metrics.add_task(latency)
+    _assert_moments(metrics, latencies)
+
+def test_batches_match_numpy_per_stream():
+    latencies = _sample()
+    streams = np.random.default_rng(2).integers(3, size=latencies.size)
+    metrics = StreamingMetrics(num_streams=3, deadline_s=0.2)
+    for batch, batch_streams in zip(_batches(latencies), _batches(streams)):
+        metrics.add_tasks(batch, batch_streams)
+    for s in range(3):
+        _assert_moments(metrics, latencies[streams == s], stream=s)
+
+@pytest.mark.parametrize('q', [0.05, 0.5, 0.9, 0.95, 0.99])
+def test_quantiles_within_one_bin(q):
+    latencies = _sample()
+    metrics = StreamingMetrics(deadline_s=0.2)
+    for batch in _batches(latencies):
+        metrics.add_tasks(batch)
+    estimate = metrics.latency_quantile(q)[0]
+    exact = np.percentile(latencies, q * 100)
+    # Bins are log-spaced, so one bin's width is a fixed ratio
+    assert exact / BIN_RATIO <= estimate <= exact * BIN_RATIO
+
+def test_merge_of_halves_equals_one_pass():
+    latencies = _sample()
+    energy = np.random.default_rng(3).random(latencies.size) * 1e-4
+    whole, first, second = (StreamingMetrics(deadline_s=0.2) for _ in range(3))
+    whole.add_tasks(latencies)
+    whole.add_energy('server', energy)
+    half = latencies.size // 2
+    first.add_tasks(latencies[:half])
+    first.add_energy('server', energy[:half])
+    second.add_tasks(latencies[half:])
+    second.add_energy('server', energy[half:])
+    first.merge(second)
+
+    assert first.count[0] == whole.count[0]
+    assert first.violations[0] == whole.violations[0]
+    np.testing.assert_array_equal(first.histogram, whole.histogram)
+    np.testing.assert_allclose(first.mean_s, whole.mean_s, rtol=1e-12)
+    np.testing.assert_allclose(first.m2_s2, whole.m2_s2, rtol=1e-9)
+    np.testing.assert_allclose(first.total_energy_j, whole.total_energy_j, rtol=1e-12)
+    for key in ['latency_p50_ms', 'latency_p95_ms', 'latency_p99_ms']:
+        np.testing.assert_array_equal(first.summary()[key], whole.summary()[key])
+
+def test_merge_into_empty_accumulator():
+    latencies = _sample(100)
+    empty, filled = StreamingMetrics(deadline_s=0.2), StreamingMetrics(deadline_s=0.2)
+    filled.add_tasks(latencies)
+    empty.merge(filled)
+    _assert_moments(empty, latencies)
+
+@pytest.mark.parametrize('window', [1, 4, 10])
+def test_violation_window_wraps_around(window):
+    # Batches longer and shorter than the window, on several streams, mixed with single adds
+    rng = np.random.default_rng(4)
+    num_streams = 3
+    metrics = StreamingMetrics(num_streams=num_streams, deadline_s=0.2, violation_window=window)
+    flags = [[] for _ in range(num_streams)]
+    for step in range(60):
+        if step % 5 == 0:
+            stream, latency = int(rng.integers(num_streams)), float(rng.choice([0.1, 0.3]))
+            metrics.add_task(latency, stream=stream)
+            flags[stream].append(latency > 0.2)
+        else:
+            size = int(rng.integers(0, 3 * window + 2))
+            latencies = rng.choice([0.1, 0.3], size)
+            streams = rng.integers(num_streams, size=size)
+            metrics.add_tasks(latencies, streams)
+            for s, latency in zip(streams.tolist(), latencies.tolist()):
+                flags[s].append(latency > 0.2)
+        expected = [sum(f[-window:]) / window * 100 for f in flags]
+        np.testing.assert_allclose(metrics.recent_violation_rate(), expected)
+
+def test_state_dict_round_trip():
+    latencies = _sample(500)
+    metrics = StreamingMetrics(num_streams=2, deadline_s=0.2, trace_every=7)
+    metrics.add_tasks(latencies, np.arange(latencies.size) % 2, np.arange(latencies.size, dtype=float))
+    metrics.add_energy('local', np.full(10, 1e-3), np.arange(10) % 2)
+    restored = StreamingMetrics(num_streams=2, deadline_s=0.2, trace_every=7)
+    restored.load_state_dict(metrics.state_dict())
+    for key, values in metrics.summary().items():
+        np.testing.assert_array_equal(restored.summary()[key], values)
+    assert restored.traces == metrics.traces
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+from config import PARAMS
+from pdt import ForecastArrays, PredictiveDigitalTwin, forecast_arrays
+
+class FixedEnv:
+    """Vehicles that never change, so a forecast's loads differ only by its noise."""
+    def __init__(self, n=5):
+        rng = np.random.default_rng(0)
+        self.time_slot = 0
+        self.arrays = (rng.uniform(0, 2000, n), rng.uniform(15, 30, n), rng.uniform(1e5, 5e5, n))
+
+    def get_vehicle_arrays(self):
+        return self.arrays
+
+def test_shifted_noise_matches_drawing_every_slot_at_once():
+    PARAMS['pdt_prediction_horizon'] = 4
+    env = FixedEnv()
+    pdt = PredictiveDigitalTwin(env, rng=np.random.default_rng(3))
+    slots = [0, 1, 2, 4, 5, 8]
+    # Drawn in one go, row k is the noise of absolute slot k + 1
+    noise = np.random.default_rng(3).normal(1.0, 0.2, size=(slots[-1] + 4, 5))
+    decay = 0.9**np.arange(1, 5)[:, None]
+    for slot in slots:
+        env.time_slot = slot
+        forecast = pdt.forecast()
+        expected = env.arrays[2] * noise[slot:slot + 4] * decay
+        np.testing.assert_allclose(forecast.task_loads_bytes, expected, rtol=1e-12, err_msg=f"slot {slot}")
+        assert pdt.forecast() is forecast # Cached within the slot
+
+def test_forecast_arrays_keep_the_dict_format():
+    positions = np.array([[10.0, 20.0], [11.0, 21.0], [12.0, 22.0]])
+    loads = np.array([[100.0, 200.0], [90.0, 180.0], [81.0, 162.0]])
+    forecast = ForecastArrays(7, positions, loads, np.ones_like(positions))
+    assert len(forecast) == 3
+    assert forecast[0] == {'time_slot': 8, 'vehicles': [
+        {'id': 0, 'predicted_position_m': 10.0, 'predicted_task_load_bytes': 100.0},
+        {'id': 1, 'predicted_position_m': 20.0, 'predicted_task_load_bytes': 200.0},
+    ]}
+    assert forecast[-1] == forecast[2] and forecast[-1]['time_slot'] == 10
+    assert forecast[1:] == [forecast[1], forecast[2]] and list(forecast) == forecast[:]
+    with pytest.raises(IndexError):
+        forecast[3]
+    # The dict view converts back to the same arrays
+    for converted, original in zip(forecast_arrays(list(forecast)), (positions, loads)):
+        np.testing.assert_array_equal(converted, original)
+    assert forecast_arrays(forecast)[0] is positions
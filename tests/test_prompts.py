@@ -0,0 +1,30 @@
+import json
+import numpy as np
+import prompts
+from environment import ArrayVECEnvironment
+from pdt import PredictiveDigitalTwin
+
+def _state_and_forecasts(n=6):
+    env = ArrayVECEnvironment(n, rng=np.random.default_rng(0))
+    state = env.get_state()._replace(server_queue_lengths=np.array([3, 7, 12, 0, 1, 25])[:n])
+    return state, PredictiveDigitalTwin(env, rng=np.random.default_rng(1)).forecast()
+
+def _encoded_state(prompt):
+    return json.loads(prompt.splitlines()[2])
+
+def test_coarsening_stops_at_each_fields_floor():
+    state, forecasts = _state_and_forecasts()
+    encoded, encoded_forecasts = prompts.encode_compact_state(state, forecasts, coarsen=prompts.MAX_PROMPT_COARSENING)
+    assert encoded['queue'] == [3, 7, 12, 0, 1, 25]
+    np.testing.assert_array_equal(encoded['load_bytes'], np.round(state.task_load_bytes))
+    np.testing.assert_array_equal(encoded['speed_mps'], np.round(state.speed_mps))
+    np.testing.assert_array_equal(encoded['pos_m'], np.round(state.position_m, -1))
+    assert all(isinstance(v, int) for v in encoded['pos_m'] + encoded_forecasts[0]['dload_bytes'])
+
+def test_queue_lengths_survive_a_tight_token_budget():
+    state, forecasts = _state_and_forecasts()
+    full = prompts.generate_compact_user_prompt(state, forecasts, "BALANCE")
+    tight = prompts.generate_compact_user_prompt(state, forecasts, "BALANCE", token_budget=1)
+    assert prompts.estimate_tokens(tight) < prompts.estimate_tokens(full)
+    assert _encoded_state(tight)['queue'] == _encoded_state(full)['queue'] == [3, 7, 12, 0, 1, 25]
+    assert _encoded_state(tight)['load_bytes'] == _encoded_state(full)['load_bytes']
@@ -0,0 +1,256 @@
+import json
+import os
+import random
+import subprocess
+import sys
+import types
+import numpy as np
+import pytest
+import real_llm
+from config import PARAMS
+from environment import ArrayVECEnvironment
+from real_llm import RequestScheduler, TokenBucket
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+class FakeAPIError(Exception):
+    def __init__(self, status_code, retry_after=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = types.SimpleNamespace(headers={} if retry_after is None else {'retry-after': str(retry_after)})
+
+def _usage(prompt_tokens, completion_tokens):
+    return types.SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+@pytest.fixture
+def scheduler(clock):
+    return RequestScheduler(clock=clock, rng=random.Random(0))
+
+def test_token_bucket_spaces_requests_at_the_refill_rate():
+    bucket = TokenBucket(60, now=0.0) # One a second, a burst of one
+    assert [bucket.reserve(1, 0.0) for _ in range(4)] == [0.0, 1.0, 2.0, 3.0]
+    # Four seconds later the overdraft is paid back, and idle time beyond that does not add to the burst
+    assert bucket.reserve(1, 4.0) == 0.0
+    assert bucket.reserve(1, 100.0) == 0.0
+    assert bucket.reserve(1, 100.0) == 1.0
+
+def test_token_bucket_burst_fits_the_largest_reservation():
+    bucket = TokenBucket(600, now=0.0) # 10 tokens a second
+    assert bucket.reserve(50, 0.0) == pytest.approx(4.0) # Only the one second's worth held so far is free
+    assert bucket.capacity == 50
+    # Once the grown burst has refilled, an oversized request need not wait when idle
+    assert bucket.reserve(50, 100.0) == 0.0
+
+def test_back_to_back_oversized_reservations_wait_the_full_refill_time():
+    bucket = TokenBucket(600, now=0.0)
+    first = bucket.reserve(50, 0.0)
+    assert bucket.reserve(50, 0.0) - first == pytest.approx(5.0)
+    assert bucket.reserve(80, 0.0) - bucket.reserve(80, 0.0) == pytest.approx(-8.0)
+    # No tokens were handed out for free: the 10 held at the start, less the 260 taken
+    assert bucket.level == pytest.approx(10 - 260)
+
+def test_admit_paces_to_the_rpm_limit(scheduler, clock):
+    PARAMS['llm_rate_limit_rpm'] = 120
+    waits = [scheduler.admit(100, None)[0] for _ in range(5)]
+    assert waits == pytest.approx([0.0, 0.0, 0.5, 1.0, 1.5])
+    clock.now += 10
+    assert scheduler.admit(100, None)[0] == 0.0
+    assert scheduler.stats['requests'] == 6
+
+def test_admit_paces_to_the_tpm_limit(scheduler):
+    PARAMS['llm_rate_limit_tpm'] = 6000 # 100 tokens a second
+    scheduler.completion_tokens_estimate = 0
+    waits = [scheduler.admit(50, None)[0] for _ in range(4)]
+    assert waits == pytest.approx([0.0, 0.0, 0.5, 1.0])
+
+def test_deadline_miss_refunds_its_reservation(scheduler, clock):
+    PARAMS['llm_rate_limit_rpm'] = 60
+    deadline = clock.now + 1.5
+    assert scheduler.admit(10, deadline)[0] == 0.0
+    assert scheduler.admit(10, deadline)[0] == 1.0
+    assert scheduler.admit(10, deadline) is None # Would have to wait 2 s
+    # The refused request gave its slot back, so the next one waits 2 s, not 3 s
+    assert scheduler.admit(10, None)[0] == 2.0
+    assert scheduler.stats['requests'] == 3
+
+def test_settle_refunds_unused_tokens_and_books_cost(scheduler):
+    PARAMS.update(llm_rate_limit_tpm=6000, llm_price_per_1k_tokens={'prompt': 0.01, 'completion': 0.03})
+    _, reserved = scheduler.admit(500, None)
+    scheduler.settle(_usage(500, 20), reserved)
+    assert scheduler.tokens.level == pytest.approx(100 - 520) # The bucket started with one second's worth
+    assert scheduler.spent_usd == pytest.approx(0.005 + 0.0006)
+    assert scheduler.completion_tokens_estimate == pytest.approx(100 + 0.1 * (20 - 100))
+
+def test_budget_stops_queries(scheduler, monkeypatch):
+    PARAMS.update(llm_budget_usd=0.1, llm_price_per_1k_tokens={'prompt': 0.01, 'completion': 0.03})
+    for _ in range(2):
+        scheduler.settle(_usage(1000, 1000), 0)
+        assert not scheduler.over_budget()
+    scheduler.settle(_usage(1000, 1000), 0)
+    assert scheduler.over_budget()
+
+    # Over budget, a query falls back without sending anything
+    def create(**kwargs):
+        raise AssertionError("request sent over budget")
+    client = types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+    monkeypatch.setattr(real_llm, 'client', client)
+    monkeypatch.setattr(real_llm, 'decision_cache', None)
+    monkeypatch.setattr(real_llm, 'scheduler', scheduler)
+    state = ArrayVECEnvironment(4, rng=np.random.default_rng(0)).get_state()
+    action = real_llm.query_gpt4_orchestrator(state)
+    np.testing.assert_array_equal(action.w, real_llm.get_default_action(4).w)
+    assert scheduler.fallbacks == {'budget': 1}
+
+@pytest.mark.parametrize('attempt', [0, 1, 2, 5])
+def test_backoff_is_full_jitter_within_bounds(scheduler, attempt):
+    PARAMS.update(llm_max_retries=10, llm_backoff_base_s=0.5, llm_backoff_max_s=4)
+    bound = min(4, 0.5 * 2**attempt)
+    delays = [scheduler.retry_delay(FakeAPIError(503), attempt, 0, None)[0] for _ in range(500)]
+    assert 0 <= min(delays) and max(delays) <= bound
+    assert max(delays) > 0.9 * bound and min(delays) < 0.1 * bound # Spread over the whole range
+    assert scheduler.stats['retries'] == 500
+
+def test_retry_gives_up(scheduler, clock):
+    PARAMS.update(llm_max_retries=2)
+    assert scheduler.retry_delay(FakeAPIError(400), 0, 0, None) == (None, 'error') # Not retryable
+    assert scheduler.retry_delay(FakeAPIError(503), 2, 0, None) == (None, 'error') # Out of retries
+    PARAMS.update(llm_backoff_base_s=10, llm_backoff_max_s=10)
+    assert scheduler.retry_delay(FakeAPIError(429, retry_after=5), 0, 0, clock.now + 1) == (None, 'deadline')
+
+def test_retry_after_delays_only_the_throttled_request(scheduler, clock):
+    PARAMS.update(llm_max_retries=2, llm_backoff_base_s=0.01, llm_rate_limit_cooldown_s=0.25)
+    delay, reason = scheduler.retry_delay(FakeAPIError(429, retry_after=5), 0, 0, None)
+    assert reason is None and delay >= 5
+    assert scheduler.stats['rate_limited'] == 1
+    # Everyone else is held back only for the short cooldown
+    assert scheduler.admit(10, None)[0] == pytest.approx(0.25)
+    clock.now += 0.25
+    assert scheduler.admit(10, None)[0] == 0.0
+
+def test_retry_refunds_the_failed_requests_tokens(scheduler):
+    PARAMS.update(llm_rate_limit_tpm=6000, llm_max_retries=2)
+    _, reserved = scheduler.admit(300, None)
+    scheduler.retry_delay(FakeAPIError(503), 0, reserved, None)
+    assert scheduler.tokens.level == pytest.approx(100) # Back to the one second's worth it started with
+
+def test_build_messages_returns_its_token_estimate(monkeypatch):
+    monkeypatch.setattr(real_llm, 'prompt_stats', real_llm.PromptStats())
+    state = ArrayVECEnvironment(4, rng=np.random.default_rng(0)).get_state()
+    messages, prompt_tokens = real_llm.build_messages(state, None, "BALANCE", "system", "user prompt")
+    assert [m['content'] for m in messages] == ["system", "user prompt"]
+    assert prompt_tokens == real_llm.estimate_tokens("system") + real_llm.estimate_tokens("user prompt")
+    assert real_llm.prompt_stats.summary()['max_prompt_tokens'] == prompt_tokens
+
+def test_prompt_stats_keep_running_totals():
+    stats = real_llm.PromptStats()
+    assert stats.summary()['avg_prompt_tokens'] == 0.0
+    for tokens in (100, 300, 200):
+        stats.record(tokens, tokens / 1e5)
+    stats.record_usage(_usage(590, 40))
+    assert stats.summary() == pytest.approx({'calls': 3, 'avg_prompt_tokens': 200.0, 'max_prompt_tokens': 300,
+                                             'avg_encode_ms': 2.0, 'api_prompt_tokens': 590, 'api_completion_tokens': 40})
+
+def _answering_client(content):
+    def create(**kwargs):
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=types.SimpleNamespace(content=content))],
+                                     usage=_usage(100, 20))
+    return types.SimpleNamespace(chat=types.SimpleNamespace(completions=types.SimpleNamespace(create=create)))
+
+@pytest.mark.parametrize('horizon', [None, 3])
+def test_cluster_query_expands_to_per_vehicle_actions(monkeypatch, horizon):
+    state = ArrayVECEnvironment(12, rng=np.random.default_rng(0)).get_state()
+    clusters = real_llm.VehicleClusters(state, None, 3)
+    decision = {'w': [0.2, 0.5, 0.8], 'a': [0.5, 0.3, 0.2]}
+    content = json.dumps({'plan': [decision] * horizon} if horizon else decision)
+    monkeypatch.setattr(real_llm, 'client', _answering_client(content))
+    monkeypatch.setattr(real_llm, 'decision_cache', None)
+    monkeypatch.setattr(real_llm, 'scheduler', real_llm.RequestScheduler())
+    if horizon:
+        actions = real_llm.query_gpt4_plan(state, horizon=horizon, num_clusters=3)
+    else:
+        actions = [real_llm.query_gpt4_orchestrator(state, num_clusters=3)]
+    assert len(actions) == (horizon or 1)
+    expected = clusters.expand(decision)
+    for action in actions:
+        np.testing.assert_array_equal(action.w, expected.w)
+        np.testing.assert_allclose(action.a, expected.a)
+        assert action.w.shape == (12,) and action.a.sum() <= 1.0 + 1e-12
+
+    # A response for the wrong number of clusters falls back to the per-vehicle default
+    monkeypatch.setattr(real_llm, 'client', _answering_client(json.dumps({'w': [0.5], 'a': [1.0]})))
+    action = real_llm.query_gpt4_orchestrator(state, num_clusters=3)
+    np.testing.assert_array_equal(action.w, real_llm.get_default_action(12).w)
+
+def _state(seed=0, n=4):
+    return ArrayVECEnvironment(n, rng=np.random.default_rng(seed)).get_state()
+
+def _decision(value, n=4):
+    return real_llm.Action(np.full(n, value), np.full(n, 1 / n))
+
+def test_decision_cache_is_off_by_default():
+    assert PARAMS['llm_cache_enabled'] is False
+
+def test_decision_cache_evicts_least_recently_used():
+    cache = real_llm.DecisionCache(max_entries=2)
+    cache.put('a', _decision(0.1), 1.0)
+    cache.put('b', _decision(0.2), 1.0)
+    assert cache.get('a') is not None # 'a' is now the most recently used
+    cache.put('c', _decision(0.3), 1.0)
+    assert cache.get('b') is None
+    assert cache.get('a').w[0] == 0.1 and cache.get('c').w[0] == 0.3
+    assert list(cache.entries) == ['a', 'c']
+    assert cache.stats()['hits'] == 3 and cache.stats()['misses'] == 1
+
+def test_decision_cache_returns_copies():
+    cache = real_llm.DecisionCache()
+    cache.put('a', _decision(0.1), 1.0)
+    cache.get('a').w[:] = 0.9
+    assert cache.get('a').w[0] == 0.1
+
+def test_decision_cache_sqlite_round_trip(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = real_llm.DecisionCache(path=path)
+    plan = [_decision(0.25), _decision(0.75)]
+    cache.put('action', _decision(0.5), 1.5)
+    cache.put('plan', plan, 2.0)
+
+    reopened = real_llm.DecisionCache(max_entries=1, path=path) # A later run, with an LRU too small for both
+    for _ in range(2):
+        np.testing.assert_array_equal(reopened.get('action').w, np.full(4, 0.5))
+        restored = reopened.get('plan')
+        assert isinstance(restored, list) and len(restored) == 2
+        for step, expected in zip(restored, plan):
+            np.testing.assert_array_equal(step.w, expected.w)
+            np.testing.assert_array_equal(step.a, expected.a)
+    assert reopened.stats()['hits'] == 4 and reopened.latency_saved_s == pytest.approx(7.0)
+    assert reopened.get('missing') is None
+
+def test_decision_cache_key_follows_the_buckets():
+    cache = real_llm.DecisionCache(quantization={'position_m': 50})
+    state = _state()
+    key = cache.make_key(state, None, "BALANCE")
+    assert key == real_llm.DecisionCache(quantization={'position_m': 50}).make_key(state, None, "BALANCE")
+    bucket_start = np.floor(state.position_m / 50) * 50
+    within = state._replace(position_m=bucket_start + 49.9)
+    across = state._replace(position_m=bucket_start + 50.0)
+    # channel_gain is left as is, so only the position bucket changes
+    assert cache.make_key(within, None, "BALANCE") == key
+    assert cache.make_key(across, None, "BALANCE") != key
+    assert cache.make_key(state, None, "SAVE_ENERGY") != key
+
+def test_decision_cache_key_is_stable_across_processes():
+    # No salted hash() in the key, so another process (or run) finds the same entries
+    code = ("import numpy as np, real_llm; from environment import ArrayVECEnvironment; "
+            "print(real_llm.DecisionCache().make_key(ArrayVECEnvironment(4, rng=np.random.default_rng(0)).get_state(), None, 'BALANCE'))")
+    keys = {subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                           env={**os.environ, 'PYTHONHASHSEED': str(seed)}).stdout.strip() for seed in (1, 2)}
+    assert keys == {real_llm.DecisionCache().make_key(_state(), None, "BALANCE")}
@@ -0,0 +1,14 @@
+import pandas as pd
+from results_handler import ResultsHandler, metric_precision
+
+def test_energy_is_printed_with_enough_decimals():
+    assert ResultsHandler.format_ci([0.0046, 0.0048], metric_precision('total_energy_j')) == "0.00470 ± 0.00020"
+    assert ResultsHandler.format_ci([56.03, 56.02], metric_precision('avg_latency_ms')) == "56.0 ± 0.0"
+
+def test_print_sweep_keeps_energy_visible(capsys):
+    df = pd.DataFrame({'agent': ['GO'] * 4, 'replica': [0, 1, 0, 1], 'network_bandwidth_mhz': [10, 10, 20, 20],
+                       'total_energy_j': [0.0012, 0.0014, 0.0007, 0.0009], 'avg_latency_ms': [80.0, 82.0, 60.0, 61.0]})
+    ResultsHandler().print_sweep("bandwidth", df, ['agent'], 'network_bandwidth_mhz', ['avg_latency_ms', 'total_energy_j'])
+    out = capsys.readouterr().out
+    assert "0.00130 ± 0.00020" in out and "0.00080 ± 0.00020" in out
+    assert "81.0 ± 2.0" in out
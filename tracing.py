@@ -0,0 +1,102 @@
+# tracing.py
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from config import PARAMS
+
+_NO_SPAN = contextlib.nullcontext()
+
+class Tracer:
+    """
+    Timed spans and counters for profiling a run. When disabled, span() hands
+    back a shared no-op context manager and count() returns immediately, so
+    the hooks can stay in the hot loop.
+
+    Every span is kept as a Chrome trace event (open the export in
+    chrome://tracing or ui.perfetto.dev) and folded into per-name totals.
+    Spans inside asyncio tasks get one track per task, so concurrent
+    simulations do not overlap on a single track. Timestamps come from the
+    monotonic clock, so spans merged from worker processes line up.
+    """
+    def __init__(self, enabled=False):
+        self.reset(enabled)
+
+    def reset(self, enabled=None):
+        if enabled is not None:
+            self.enabled = enabled
+        self.events = []
+        self.totals = {}   # name -> [calls, total_s, max_s]
+        self.counters = {}
+        self._tracks = {}
+
+    def _track(self):
+        # No asyncio task can be running if nothing has imported asyncio
+        asyncio = sys.modules.get('asyncio')
+        try:
+            task = asyncio.current_task() if asyncio else None
+        except RuntimeError:
+            task = None
+        if task is None:
+            return threading.get_ident() % 100000
+        return self._tracks.setdefault(id(task), 100000 + len(self._tracks))
+
+    def span(self, name, **args):
+        if not self.enabled:
+            return _NO_SPAN
+        return self._span(name, args)
+
+    @contextlib.contextmanager
+    def _span(self, name, args):
+        track = self._track()
+        start_ns = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            duration_ns = time.perf_counter_ns() - start_ns
+            self.events.append({'name': name, 'ph': 'X', 'ts': start_ns / 1000, 'dur': duration_ns / 1000,
+                                'pid': os.getpid(), 'tid': track, 'args': args})
+            total = self.totals.setdefault(name, [0, 0.0, 0.0])
+            total[0] += 1
+            total[1] += duration_ns / 1e9
+            total[2] = max(total[2], duration_ns / 1e9)
+
+    def count(self, name, n=1):
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self):
+        """Events, totals and counters as plain data, e.g. to ship back from a worker process."""
+        return {'events': self.events, 'totals': self.totals, 'counters': self.counters}
+
+    def merge(self, snapshot):
+        self.events.extend(snapshot['events'])
+        for name, (calls, total_s, max_s) in snapshot['totals'].items():
+            total = self.totals.setdefault(name, [0, 0.0, 0.0])
+            total[0] += calls
+            total[1] += total_s
+            total[2] = max(total[2], max_s)
+        for name, n in snapshot['counters'].items():
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        """Per-span rows (name, calls, total_s, mean_ms, max_ms), largest total first, and the counters."""
+        rows = [
+            {'name': name, 'calls': calls, 'total_s': total_s, 'mean_ms': total_s / calls * 1000, 'max_ms': max_s * 1000}
+            for name, (calls, total_s, max_s) in self.totals.items()
+        ]
+        rows.sort(key=lambda row: row['total_s'], reverse=True)
+        return {'spans': rows, 'counters': dict(self.counters)}
+
+    def export_chrome_trace(self, path):
+        # Counters are attached to the end of the trace as one counter event each
+        end_us = max((e['ts'] + e['dur'] for e in self.events), default=0)
+        counter_events = [{'name': name, 'ph': 'C', 'ts': end_us, 'pid': os.getpid(), 'args': {name: n}}
+                          for name, n in self.counters.items()]
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events + counter_events, 'displayTimeUnit': 'ms'}, f)
+
+tracer = Tracer(PARAMS['trace_enabled'])